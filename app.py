@@ -1,5 +1,4 @@
 import logging
-import threading
 
 from flask import Flask, Response, request
 from slack_bolt import App as SlackApp
@@ -8,8 +7,8 @@ from slack_bolt.adapter.socket_mode import SocketModeHandler
 from config import Config
 from models.database import init_db
 from web.routes import bp as web_bp
+from web.webhooks import bp as webhooks_bp
 from scheduler.setup import create_scheduler
-from scheduler.jobs import sync_all_data
 from slack_bot.handlers import register_handlers
 
 logging.basicConfig(
@@ -22,6 +21,7 @@ logger = logging.getLogger(__name__)
 def create_flask_app() -> Flask:
     app = Flask(__name__)
     app.register_blueprint(web_bp)
+    app.register_blueprint(webhooks_bp)
     return app
 
 
@@ -37,22 +37,13 @@ def create_slack_app() -> SlackApp:
 logger.info("Initializing database...")
 init_db()
 
-# 2. Run initial data sync in background (so gunicorn can start serving immediately)
-def _initial_sync():
-    try:
-        sync_all_data()
-    except Exception as e:
-        logger.warning(f"Initial sync failed (will retry on schedule): {e}")
-
-logger.info("Running initial data sync in background...")
-threading.Thread(target=_initial_sync, daemon=True).start()
-
-# 3. Start scheduler
+# 2. Start scheduler (its sync job fires immediately, covering the initial sync
+#    in the background so gunicorn can start serving right away)
 logger.info("Starting scheduler...")
 scheduler = create_scheduler()
 scheduler.start()
 
-# 4. Start Slack Socket Mode in a background thread
+# 3. Start Slack Socket Mode in a background thread
 if Config.SLACK_BOT_TOKEN and Config.SLACK_APP_TOKEN:
     logger.info("Starting Slack Socket Mode...")
     slack_app = create_slack_app()
@@ -62,7 +53,7 @@ if Config.SLACK_BOT_TOKEN and Config.SLACK_APP_TOKEN:
 else:
     logger.warning("Slack tokens not configured — skipping Slack bot")
 
-# 5. Create Flask app
+# 4. Create Flask app
 flask_app = create_flask_app()
 
 
@@ -70,6 +61,8 @@ flask_app = create_flask_app()
 def require_auth():
     if not Config.DASHBOARD_USER:
         return  # skip auth when not configured (local dev)
+    if request.blueprint == "webhooks":
+        return  # verified by provider signature instead
     auth = request.authorization
     if not auth or auth.username != Config.DASHBOARD_USER or auth.password != Config.DASHBOARD_PASS:
         return Response("Unauthorized", 401, {"WWW-Authenticate": 'Basic realm="Login Required"'})
@@ -7,9 +7,45 @@ load_dotenv()
 class Config:
     # Stripe
     STRIPE_API_KEY = os.getenv("STRIPE_API_KEY", "")
+    # Signing secret for /webhooks/stripe (whsec_...). When set, webhooks keep
+    # invoices/subscriptions current; otherwise invoices sync incrementally
+    # from the Events API. Either way a full walk reconciles every N hours.
+    STRIPE_WEBHOOK_SECRET = os.getenv("STRIPE_WEBHOOK_SECRET", "")
+    STRIPE_RECONCILE_HOURS = int(os.getenv("STRIPE_RECONCILE_HOURS", "168"))
 
     # Mercury
     MERCURY_API_TOKEN = os.getenv("MERCURY_API_TOKEN", "")
+    # Incremental sync: re-fetch this many days before each account's cursor
+    # to pick up late postings, and run a full history pull every N hours.
+    MERCURY_RECHECK_DAYS = int(os.getenv("MERCURY_RECHECK_DAYS", "14"))
+    MERCURY_FULL_SYNC_HOURS = int(os.getenv("MERCURY_FULL_SYNC_HOURS", "24"))
+    # Accounts fetched in parallel (also the HTTP keep-alive pool size)
+    MERCURY_MAX_WORKERS = int(os.getenv("MERCURY_MAX_WORKERS", "4"))
+    # backfill_mercury.py: months per date shard and shards fetched in parallel
+    MERCURY_BACKFILL_SHARD_MONTHS = int(os.getenv("MERCURY_BACKFILL_SHARD_MONTHS", "3"))
+    MERCURY_BACKFILL_WORKERS = int(os.getenv("MERCURY_BACKFILL_WORKERS", "8"))
+    # Signing secret for /webhooks/mercury (enables near-real-time ingestion)
+    MERCURY_WEBHOOK_SECRET = os.getenv("MERCURY_WEBHOOK_SECRET", "")
+
+    # Outbound API calls (services/http_client.py): connect/read timeouts,
+    # retries with jittered exponential backoff (Retry-After wins when sent),
+    # and a per-host circuit breaker that fails fast after repeated failures
+    HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "5"))
+    HTTP_READ_TIMEOUT = float(os.getenv("HTTP_READ_TIMEOUT", "20"))
+    HTTP_MAX_RETRIES = int(os.getenv("HTTP_MAX_RETRIES", "3"))
+    HTTP_BACKOFF_BASE_SECONDS = float(os.getenv("HTTP_BACKOFF_BASE_SECONDS", "0.5"))
+    HTTP_BACKOFF_MAX_SECONDS = float(os.getenv("HTTP_BACKOFF_MAX_SECONDS", "30"))
+    HTTP_BREAKER_FAILURES = int(os.getenv("HTTP_BREAKER_FAILURES", "5"))
+    HTTP_BREAKER_RESET_SECONDS = float(os.getenv("HTTP_BREAKER_RESET_SECONDS", "60"))
+
+    # Time-series charts: default first month, and the most periods one chart
+    # returns before it is downsampled to a coarser granularity
+    CHART_START_MONTH = os.getenv("CHART_START_MONTH", "2025-04")
+    CHART_MAX_POINTS = int(os.getenv("CHART_MAX_POINTS", "36"))
+
+    # Live balances: serve cached values for this long, then refresh in the
+    # background (the scheduler also refreshes on the same cadence)
+    BALANCE_TTL_SECONDS = int(os.getenv("BALANCE_TTL_SECONDS", "300"))
 
     # Slack
     SLACK_BOT_TOKEN = os.getenv("SLACK_BOT_TOKEN", "")
@@ -26,6 +62,8 @@ class Config:
 
     # Scheduler
     SYNC_INTERVAL_HOURS = int(os.getenv("SYNC_INTERVAL_HOURS", "4"))
+    # Seconds each sync source (Mercury, Stripe invoices, Stripe subscriptions) may run
+    SYNC_TIMEOUT_SECONDS = int(os.getenv("SYNC_TIMEOUT_SECONDS", "600"))
     LATE_CHECK_HOUR = int(os.getenv("LATE_CHECK_HOUR", "9"))
     WEEKLY_SUMMARY_DAY = os.getenv("WEEKLY_SUMMARY_DAY", "mon")
     WEEKLY_SUMMARY_HOUR = int(os.getenv("WEEKLY_SUMMARY_HOUR", "9"))
@@ -36,3 +74,12 @@ class Config:
 
     # Database
     DB_PATH = os.getenv("DATABASE_PATH", os.path.join(os.path.dirname(__file__), "finance.db"))
+    # Rows per executemany/commit when bulk-upserting synced records
+    DB_BATCH_SIZE = int(os.getenv("DB_BATCH_SIZE", "500"))
+    # API pages buffered between the sync fetchers and the DB writer thread
+    SYNC_QUEUE_PAGES = int(os.getenv("SYNC_QUEUE_PAGES", "8"))
+    # Idle connections kept by models.database.connection() and per-connection tuning
+    DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "4"))
+    DB_BUSY_TIMEOUT = float(os.getenv("DB_BUSY_TIMEOUT", "30"))
+    DB_MMAP_SIZE = int(os.getenv("DB_MMAP_SIZE", str(256 * 1024 * 1024)))
+    DB_CACHE_SIZE_KB = int(os.getenv("DB_CACHE_SIZE_KB", "16384"))
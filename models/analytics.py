@@ -0,0 +1,312 @@
+import logging
+import threading
+import time
+
+import numpy as np
+
+from models.counterparties import SPEND_CATEGORIES
+from models.database import connection
+from models.queries import CUSTOMER_JOIN, CUSTOMER_NAME, get_active_client_ids, get_data_generation, period_of
+
+logger = logging.getLogger(__name__)
+
+# Columnar, in-memory copy of the transaction rows behind the chart rollups
+# that would otherwise scan raw rows per request: tracked Mercury spend
+# (vendor spend detail) and Stripe invoices (revenue by client, days to
+# pay). Each column is a NumPy array; text columns are stored as int codes
+# into a label list, with -1 for NULL. Text labels are sorted, so comparing
+# codes compares the strings the way SQLite's BINARY collation does
+# (MAX(name) is the max code).
+#
+# The snapshot is rebuilt after each sync (refresh_snapshot), and in the
+# background whenever a reader finds the data generation has moved on since
+# it was built; readers keep the previous snapshot until the new one lands.
+
+# YYYY-MM month as an integer index, so months group with bincount
+_MONTH_INDEX = "CAST(substr({col}, 1, 4) AS INTEGER) * 12 + CAST(substr({col}, 6, 2) AS INTEGER) - 1"
+
+
+def month_index(month: str) -> int:
+    """YYYY-MM label to the integer month index used by the snapshot."""
+    return int(month[:4]) * 12 + int(month[5:7]) - 1
+
+
+def month_label(index: int) -> str:
+    return f"{index // 12:04d}-{index % 12 + 1:02d}"
+
+
+def _bucket(months, granularity: str):
+    """Map month indices to the first month index of their quarter/year."""
+    if granularity == "quarter":
+        return months - months % 3
+    if granularity == "year":
+        return months - months % 12
+    return months
+
+
+def _factorize(values, sort: bool = True):
+    """Return (labels, int32 codes) for a text column; NULL becomes -1."""
+    labels = {v for v in values if v is not None}
+    labels = sorted(labels) if sort else list(labels)
+    index = {v: i for i, v in enumerate(labels)}
+    codes = np.fromiter((index.get(v, -1) for v in values), dtype=np.int32, count=len(values))
+    return labels, codes
+
+
+def _column(rows, i, dtype, null):
+    return np.fromiter((null if r[i] is None else r[i] for r in rows), dtype=dtype, count=len(rows))
+
+
+def _round1(values):
+    """SQLite ROUND(x, 1): halves round away from zero."""
+    return np.sign(values) * np.floor(np.abs(values) * 10 + 0.5) / 10
+
+
+class AnalyticsSnapshot:
+    """Columnar arrays of mercury_transactions and stripe_invoices at one data generation."""
+
+    def __init__(self, generation: int):
+        self.generation = generation
+        started = time.monotonic()
+        with connection() as conn:
+            self._load_mercury(conn)
+            self._load_invoices(conn)
+        self.build_ms = int((time.monotonic() - started) * 1000)
+        logger.info(
+            f"Analytics snapshot for generation {generation}: {len(self.m_amount)} spend transactions, "
+            f"{len(self.i_customer)} invoices in {self.build_ms} ms"
+        )
+
+    def _load_mercury(self, conn):
+        # Only tracked, successful outflows feed the spend rollups; flows and
+        # category totals already come from the monthly_facts tables
+        cur = conn.cursor()
+        cur.row_factory = None
+        rows = cur.execute(
+            f"""SELECT {_MONTH_INDEX.format(col="month")}, amount, spend_category, counterparty_name
+                FROM mercury_transactions
+                WHERE is_tracked_spend = 1
+                  AND amount < 0
+                  AND month IS NOT NULL
+                  AND status = 'sent'"""
+        ).fetchall()
+        self.m_month = _column(rows, 0, np.int32, -1)
+        self.m_amount = _column(rows, 1, np.float64, 0.0)
+        self.categories, self.m_category = _factorize([r[2] for r in rows])
+        self.vendors, self.m_vendor = _factorize([r[3] for r in rows])
+
+    def _load_invoices(self, conn):
+        cur = conn.cursor()
+        cur.row_factory = None
+        rows = cur.execute(
+            f"""SELECT si.customer_id, {CUSTOMER_NAME}, si.status, si.amount_paid,
+                       julianday(si.created_at), julianday(si.paid_at),
+                       CASE WHEN si.paid_at IS NOT NULL THEN {_MONTH_INDEX.format(col="si.paid_at")} END
+                FROM stripe_invoices si
+                {CUSTOMER_JOIN}"""
+        ).fetchall()
+        self.customer_ids, self.i_customer = _factorize([r[0] for r in rows], sort=False)
+        self.names, self.i_name = _factorize([r[1] for r in rows])
+        self.invoice_statuses, self.i_status = _factorize([r[2] for r in rows])
+        self.i_amount_paid = _column(rows, 3, np.float64, 0.0)
+        self.i_created = _column(rows, 4, np.float64, np.nan)
+        self.i_paid = _column(rows, 5, np.float64, np.nan)
+        self.i_paid_month = _column(rows, 6, np.int32, -1)
+        # GROUP BY customer_id puts NULL ids in a group of their own
+        self.i_group = np.where(self.i_customer >= 0, self.i_customer, len(self.customer_ids))
+
+    def _code(self, labels, value):
+        try:
+            return labels.index(value)
+        except ValueError:
+            return -2  # matches nothing (NULL is -1)
+
+    def _paid_window(self, start: str = None, end: str = None):
+        mask = np.ones(len(self.i_customer), dtype=bool)
+        if start:
+            mask &= self.i_paid_month >= month_index(start)
+        if end:
+            mask &= (self.i_paid_month >= 0) & (self.i_paid_month <= month_index(end))
+        return mask
+
+    def _by_customer(self, mask, weights=None):
+        """(groups present, row count, weight sum, MAX name code) per customer group under mask."""
+        size = len(self.customer_ids) + 1
+        groups = self.i_group[mask]
+        counts = np.bincount(groups, minlength=size)
+        sums = np.bincount(groups, weights=weights, minlength=size) if weights is not None else None
+        names = np.full(size, -1, dtype=np.int32)
+        np.maximum.at(names, groups, self.i_name[mask])
+        return np.flatnonzero(counts), counts, sums, names
+
+    def revenue_by_client(self, start: str = None, end: str = None):
+        """Vectorized get_revenue_by_client: paid revenue per customer, largest first."""
+        mask = (self.i_amount_paid > 0) & (self.i_name >= 0) & self._paid_window(start, end)
+        present, counts, sums, names = self._by_customer(mask, self.i_amount_paid[mask])
+        order = present[np.argsort(-sums[present], kind="stable")]
+        return [
+            {"customer_name": self.names[names[g]], "total_revenue": float(sums[g]), "invoice_count": int(counts[g])}
+            for g in order
+        ]
+
+    def _paid_invoices(self, start: str = None, end: str = None):
+        return (
+            (self.i_status == self._code(self.invoice_statuses, "paid"))
+            & (self.i_paid_month >= 0)
+            & self._paid_window(start, end)
+        )
+
+    def avg_days_to_pay(self, active_ids, start: str = None, end: str = None):
+        """Vectorized get_avg_days_to_pay for the given active customer ids, slowest first."""
+        active = np.zeros(len(self.customer_ids) + 1, dtype=bool)
+        active[[i for i, cid in enumerate(self.customer_ids) if cid in active_ids]] = True
+        mask = self._paid_invoices(start, end) & (self.i_name >= 0) & active[self.i_group]
+        days = self.i_paid[mask] - self.i_created[mask]
+        present, counts, _, names = self._by_customer(mask)
+        # AVG skips NULL differences; COUNT(*) does not
+        valid = ~np.isnan(days)
+        size = len(counts)
+        day_sums = np.bincount(self.i_group[mask][valid], weights=days[valid], minlength=size)
+        day_counts = np.bincount(self.i_group[mask][valid], minlength=size)
+        present = present[day_counts[present] > 0]
+        averages = _round1(day_sums[present] / day_counts[present])
+        order = np.argsort(-averages, kind="stable")
+        return [
+            {"customer_name": self.names[names[g]], "avg_days": float(a), "invoice_count": int(counts[g])}
+            for g, a in zip(present[order], averages[order])
+        ]
+
+    def overall_avg_days_to_pay(self, start: str = None, end: str = None):
+        """Vectorized get_overall_avg_days_to_pay."""
+        mask = self._paid_invoices(start, end)
+        days = self.i_paid[mask] - self.i_created[mask]
+        days = days[~np.isnan(days)]
+        avg = float(_round1(days.mean())) if len(days) else None
+        return {"avg_days": avg, "total_invoices": int(mask.sum())}
+
+    def spend_details(self, start: str = None, end: str = None, granularity: str = "month"):
+        """Vectorized get_monthly_spend_details: {period: {category: [(vendor, amount), ...]}}.
+
+        Groups tracked spend by (period, category, vendor) with one
+        np.unique over a combined int key and a weighted bincount.
+        """
+        mask = np.ones(len(self.m_month), dtype=bool)
+        if start:
+            mask &= self.m_month >= month_index(start)
+        if end:
+            mask &= self.m_month <= month_index(end)
+
+        periods = _bucket(self.m_month[mask].astype(np.int64), granularity)
+        categories = self.m_category[mask].astype(np.int64) + 1  # shift NULL (-1) to 0
+        vendors = self.m_vendor[mask].astype(np.int64) + 1
+        n_categories, n_vendors = len(self.categories) + 1, len(self.vendors) + 1
+        keys = (periods * n_categories + categories) * n_vendors + vendors
+        unique, inverse = np.unique(keys, return_inverse=True)
+        totals = np.bincount(inverse, weights=-self.m_amount[mask], minlength=len(unique))
+
+        # Largest vendor first within each (period, category)
+        cells = unique // n_vendors
+        order = np.lexsort((-totals, cells))
+        result = {}
+        for key, total in zip(unique[order].tolist(), totals[order].tolist()):
+            cell, vendor = divmod(key, n_vendors)
+            period, category = divmod(cell, n_categories)
+            label = period_of(month_label(period), granularity)
+            if label not in result:
+                result[label] = {c: [] for c in SPEND_CATEGORIES}
+            name = self.categories[category - 1] if category else None
+            result[label].setdefault(name, []).append((self.vendors[vendor - 1] if vendor else None, total))
+        return result
+
+
+_snapshot = None
+_snapshot_lock = threading.Lock()
+# Held by the one build in flight; a plain Lock may be released by the thread that ran it
+_build_lock = threading.Lock()
+
+
+def refresh_snapshot() -> AnalyticsSnapshot:
+    """Rebuild the snapshot for the current data generation (call after a sync lands)."""
+    global _snapshot
+    generation, _ = get_data_generation()
+    snapshot = AnalyticsSnapshot(generation)
+    with _snapshot_lock:
+        if _snapshot is None or _snapshot.generation <= generation:
+            _snapshot = snapshot
+    return snapshot
+
+
+def _refresh_in_background():
+    if not _build_lock.acquire(blocking=False):
+        return  # a build is already in flight
+
+    def run():
+        try:
+            refresh_snapshot()
+        except Exception as e:
+            logger.error(f"Analytics snapshot refresh error: {e}")
+        finally:
+            _build_lock.release()
+
+    threading.Thread(target=run, name="snapshot-refresh", daemon=True).start()
+
+
+def snapshot_generation():
+    """Data generation of the current snapshot, or None before the first build."""
+    with _snapshot_lock:
+        return _snapshot.generation if _snapshot is not None else None
+
+
+def get_snapshot() -> AnalyticsSnapshot:
+    """Return the current snapshot without waiting on a rebuild.
+
+    A snapshot from an older data generation is served as-is while one
+    background thread rebuilds it. Only a cold start (no snapshot yet)
+    builds inline, and concurrent cold callers wait for that one build.
+    """
+    generation, _ = get_data_generation()
+    with _snapshot_lock:
+        snapshot = _snapshot
+    if snapshot is None:
+        with _build_lock:
+            with _snapshot_lock:
+                snapshot = _snapshot
+            if snapshot is None:
+                snapshot = refresh_snapshot()
+    elif snapshot.generation != generation:
+        _refresh_in_background()
+    return snapshot
+
+
+def get_revenue_by_client(start: str = None, end: str = None):
+    """Return total paid revenue by client, sorted by amount descending.
+
+    start/end (YYYY-MM) limit it to invoices paid in those months.
+    """
+    return get_snapshot().revenue_by_client(start, end)
+
+
+def get_avg_days_to_pay(start: str = None, end: str = None):
+    """Return average days to pay for active clients only, slowest payers first.
+
+    start/end (YYYY-MM) limit it to invoices paid in those months.
+    """
+    active_ids = get_active_client_ids()
+    if not active_ids:
+        return []
+    return get_snapshot().avg_days_to_pay(active_ids, start, end)
+
+
+def get_overall_avg_days_to_pay(start: str = None, end: str = None):
+    """Return overall average days to pay across all paid invoices (optionally paid in months start..end)."""
+    return get_snapshot().overall_avg_days_to_pay(start, end)
+
+
+def get_monthly_spend_details(start: str = None, end: str = None, granularity: str = "month"):
+    """Return spending with vendor-level detail for hover info.
+
+    Optionally limited to months start..end and summed per quarter or year.
+    Returns dict: {period: {category: [(vendor, amount), ...]}}, vendors
+    largest first.
+    """
+    return get_snapshot().spend_details(start, end, granularity)
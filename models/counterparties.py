@@ -0,0 +1,335 @@
+import hashlib
+import json
+import os
+import re
+from datetime import datetime, timezone
+from functools import lru_cache
+
+# Counterparty rules, evaluated once per transaction at ingest time and
+# stored on mercury_transactions so analytics filter on indexed flags.
+# "like" patterns use SQL LIKE syntax (% wildcard, ASCII case-insensitive)
+# and "eq" names must match exactly — the same semantics as the SQL
+# filters these rules replaced.
+
+# Internal/self transfers and owner draws
+INTERNAL_RULES = [
+    ("like", "%Wells Fargo%0430%"),
+    ("like", "%Bank of America%1717%"),
+    ("like", "BANK OF AMERICA"),
+    ("like", "%Chase%"),
+    ("like", "Mercury Checking%"),
+    ("like", "Mercury Savings%"),
+    ("like", "Mercury Credit%"),
+    ("like", "Mercury IO%"),
+    ("eq", "Alex Fine"),
+    ("eq", "Alexander Yildirim"),
+]
+
+# Owner distribution counterparties
+OWNER_DISTRIBUTION_RULES = [
+    ("like", "%Wells Fargo%0430%"),
+    ("like", "%Bank of America%1717%"),
+    ("eq", "BANK OF AMERICA"),
+    ("eq", "Alex Fine"),
+    ("eq", "Alexander Yildirim"),
+]
+
+# Inflows that are not client revenue: Stripe payout batches (already
+# counted via invoices), interest, cashback, insurance and brokerage
+NON_REVENUE_RULES = [
+    ("eq", "STRIPE"),
+    ("like", "Savings Interest%"),
+    ("like", "%Cashback%"),
+    ("like", "%ANTHEM%"),
+    ("like", "%Kaiser%"),
+    ("like", "%JP Morgan%"),
+]
+
+# Credit card itemized purchases (excludes balance payments to checking)
+CREDIT_CARD_KINDS = ("creditCardTransaction", "cardInternationalTransactionFee")
+CREDIT_CARD_EXCLUDE_RULES = [
+    ("like", "Mercury Checking%"),
+]
+
+# Checking account labor payments (contractors, freelancers), excluding owners
+LABOR_EXCLUDE_RULES = [
+    ("eq", "Alex Fine"),
+    ("eq", "Alexander Yildirim"),
+]
+
+# Checking/savings account operational costs (salaries, taxes, labor via Payoneer)
+CHECKING_OPS_RULES = [
+    ("like", "ADP%"),
+    ("like", "%IRS%"),
+    ("like", "%GEORGIA ITS TAX%"),
+    ("like", "%GA DEPT OF LABOR%"),
+    ("like", "%BOYLE TAX%"),
+    ("like", "%SAVERITE TAX%"),
+    ("like", "%STATE OF TN%"),
+    ("like", "%DELAWARE CORP%"),
+    ("like", "%Payoneer%"),
+    ("like", "%GROWTHX%"),
+]
+
+# Bump whenever a rule above changes. init_db compares it (together with a
+# hash of the vendor category rules file) against the fingerprint stored in
+# app_state and reclassifies every transaction in a single UPDATE when they
+# differ.
+RULES_VERSION = 1
+
+
+def _like_to_regex(pattern: str) -> str:
+    return "".join(
+        ".*" if ch == "%" else "." if ch == "_" else re.escape(ch)
+        for ch in pattern
+    )
+
+
+def _compile_rules(rules):
+    """Compile a rule list into a predicate over a counterparty name."""
+    exact = {value for op, value in rules if op == "eq"}
+    likes = [_like_to_regex(value) for op, value in rules if op == "like"]
+    regex = re.compile("(?:" + "|".join(likes) + ")", re.IGNORECASE | re.ASCII | re.DOTALL) if likes else None
+
+    def matches(name):
+        if name in exact:
+            return True
+        return bool(regex and regex.fullmatch(name))
+
+    return matches
+
+
+_is_internal = _compile_rules(INTERNAL_RULES)
+_is_owner_distribution = _compile_rules(OWNER_DISTRIBUTION_RULES)
+_is_non_revenue = _compile_rules(NON_REVENUE_RULES)
+_is_credit_card_excluded = _compile_rules(CREDIT_CARD_EXCLUDE_RULES)
+_is_labor_excluded = _compile_rules(LABOR_EXCLUDE_RULES)
+_is_checking_ops = _compile_rules(CHECKING_OPS_RULES)
+
+
+def is_internal(name) -> bool:
+    # Unnamed counterparties never passed the old NOT LIKE chain, so they
+    # stay excluded along with internal transfers.
+    return name is None or _is_internal(name)
+
+
+def is_owner_distribution(name) -> bool:
+    return name is not None and _is_owner_distribution(name)
+
+
+def is_non_revenue(name) -> bool:
+    return name is None or _is_non_revenue(name)
+
+
+def is_tracked_spend(name, kind) -> bool:
+    """Return True if a transaction belongs in the spend-by-category breakdown.
+
+    Covers credit card itemized purchases, checking labor payments and
+    checking/savings operational costs (ADP, taxes, Payoneer).
+    """
+    if name is None:
+        return False
+    if kind in CREDIT_CARD_KINDS:
+        return not _is_credit_card_excluded(name)
+    if kind == "outgoingPayment":
+        return not _is_labor_excluded(name)
+    if kind == "other":
+        return _is_checking_ops(name) and not is_internal(name)
+    return False
+
+
+def classify_transaction(name, kind) -> dict:
+    """Return the stored classification columns for a Mercury transaction."""
+    return {
+        "is_internal": int(is_internal(name)),
+        "is_owner_distribution": int(is_owner_distribution(name)),
+        "is_non_revenue": int(is_non_revenue(name)),
+        "is_tracked_spend": int(is_tracked_spend(name, kind)),
+        "spend_category": categorize_vendor(name, kind),
+    }
+
+
+def reclassify_transactions(conn):
+    """Recompute every transaction's classification columns in one UPDATE."""
+    conn.create_function("cp_is_internal", 1, lambda n: int(is_internal(n)), deterministic=True)
+    conn.create_function("cp_is_owner_distribution", 1, lambda n: int(is_owner_distribution(n)), deterministic=True)
+    conn.create_function("cp_is_non_revenue", 1, lambda n: int(is_non_revenue(n)), deterministic=True)
+    conn.create_function("cp_is_tracked_spend", 2, lambda n, k: int(is_tracked_spend(n, k)), deterministic=True)
+    conn.create_function("cp_spend_category", 2, categorize_vendor, deterministic=True)
+    now = datetime.now(timezone.utc).isoformat()
+    with conn:
+        conn.execute(
+            """UPDATE mercury_transactions SET
+                   is_internal = cp_is_internal(counterparty_name),
+                   is_owner_distribution = cp_is_owner_distribution(counterparty_name),
+                   is_non_revenue = cp_is_non_revenue(counterparty_name),
+                   is_tracked_spend = cp_is_tracked_spend(counterparty_name, kind),
+                   spend_category = cp_spend_category(counterparty_name, kind)"""
+        )
+        conn.execute(
+            """INSERT INTO app_state (key, value, updated_at)
+               VALUES ('counterparty_rules_version', ?, ?)
+               ON CONFLICT(key) DO UPDATE SET value=excluded.value, updated_at=excluded.updated_at""",
+            (rules_fingerprint(), now),
+        )
+        # Classifications feed every chart, so advance the data generation
+        # (see models.queries.bump_data_generation) to invalidate cached renders.
+        conn.execute(
+            """INSERT INTO app_state (key, value, updated_at)
+               VALUES ('data_generation', '1', ?)
+               ON CONFLICT(key) DO UPDATE SET
+                   value = CAST(value AS INTEGER) + 1,
+                   updated_at = excluded.updated_at""",
+            (now,),
+        )
+
+
+def ensure_classified(conn):
+    """Reclassify stored transactions if the rules changed since the last run."""
+    row = conn.execute(
+        "SELECT value FROM app_state WHERE key = 'counterparty_rules_version'"
+    ).fetchone()
+    if row is None or row[0] != rules_fingerprint():
+        reclassify_transactions(conn)
+
+
+# --------------- Spend Categories ---------------
+
+# Vendor category rules live in a data file so categories and keywords can
+# grow without touching code. Rules are checked in file order — the first
+# rule with a matching prefix or keyword wins.
+VENDOR_RULES_PATH = os.path.join(os.path.dirname(__file__), "vendor_categories.json")
+
+
+class VendorCategorizer:
+    """Compiled form of the vendor category rules.
+
+    Each rule's prefixes and keywords become one alternation regex, and a
+    combined regex over every rule lets unmatched names (most of the long
+    tail) fall through to the default with a single search.
+    """
+
+    def __init__(self, rules: dict):
+        self.categories = list(rules["categories"])
+        self.kind_defaults = dict(rules.get("kind_defaults", {}))
+        self.default = rules["default"]
+        self._rules = []
+        patterns = []
+        for rule in rules["rules"]:
+            alternatives = [f"^{re.escape(p)}" for p in rule.get("prefixes", [])]
+            alternatives += [re.escape(kw) for kw in rule.get("keywords", [])]
+            if not alternatives:
+                continue
+            pattern = "|".join(alternatives)
+            self._rules.append((re.compile(pattern), rule["category"]))
+            patterns.append(pattern)
+        self._any = re.compile("|".join(patterns)) if patterns else None
+
+    @classmethod
+    def from_file(cls, path: str = VENDOR_RULES_PATH):
+        with open(path) as f:
+            return cls(json.load(f))
+
+    def categorize(self, name, kind=None) -> str:
+        if not name:
+            return self.default
+        upper = name.upper()
+        if self._any is not None and self._any.search(upper):
+            for regex, category in self._rules:
+                if regex.search(upper):
+                    return category
+        return self.kind_defaults.get(kind, self.default)
+
+
+_categorizer = VendorCategorizer.from_file()
+
+SPEND_CATEGORIES = _categorizer.categories
+
+
+@lru_cache(maxsize=4096)
+def categorize_vendor(name, kind=None):
+    """Categorize a counterparty name into a spending category.
+
+    Args:
+        name: Counterparty name.
+        kind: Mercury transaction kind. If 'outgoingPayment', unmatched
+              vendors default to Labor (contractors) instead of Miscellaneous.
+    """
+    return _categorizer.categorize(name, kind)
+
+
+def rules_fingerprint() -> str:
+    """Identify the current rule set: RULES_VERSION plus the vendor rules file hash."""
+    with open(VENDOR_RULES_PATH, "rb") as f:
+        digest = hashlib.sha1(f.read()).hexdigest()[:12]
+    return f"{RULES_VERSION}:{digest}"
+
+
+# --------------- Stripe Customer Resolution ---------------
+
+# Mercury direct payers are deduplicated against Stripe clients by fuzzy
+# name match (normalized equality or substring either way). Matches are
+# resolved once per counterparty into counterparty_customers, so analytics
+# join on the table instead of re-running the O(names × customers) scan.
+
+_CLIENT_NAME_SUFFIXES = [", inc.", ", inc", " inc.", " inc", " llc", " ltd"]
+
+
+def normalize_client_name(name: str) -> str:
+    """Lowercase a company name and drop one trailing Inc/LLC/Ltd suffix."""
+    n = name.lower().strip()
+    for suffix in _CLIENT_NAME_SUFFIXES:
+        if n.endswith(suffix):
+            n = n[:-len(suffix)].strip()
+            break
+    return n
+
+
+class StripeCustomerIndex:
+    """Normalized Stripe customer names, for resolving Mercury counterparties."""
+
+    def __init__(self, customer_names):
+        self._by_normalized = {}
+        for name in sorted(customer_names):
+            self._by_normalized.setdefault(normalize_client_name(name), name)
+
+    def match(self, counterparty_name):
+        """Return the Stripe customer a counterparty fuzzy-matches, or None."""
+        norm = normalize_client_name(counterparty_name)
+        exact = self._by_normalized.get(norm)
+        if exact is not None:
+            return exact
+        for sn, name in self._by_normalized.items():
+            if norm in sn or sn in norm:
+                return name
+        return None
+
+
+def resolve_stripe_customers(conn, stripe_names, full: bool = False):
+    """Fill counterparty_customers for counterparties not yet resolved.
+
+    With full=True (the Stripe customer set changed) every counterparty is
+    re-resolved. Returns the number of counterparties resolved.
+    """
+    if full:
+        conn.execute("DELETE FROM counterparty_customers")
+    rows = conn.execute(
+        """SELECT DISTINCT mt.counterparty_name
+           FROM mercury_transactions mt
+           LEFT JOIN counterparty_customers cc ON cc.counterparty_name = mt.counterparty_name
+           WHERE mt.counterparty_name IS NOT NULL
+             AND mt.counterparty_name != ''
+             AND cc.counterparty_name IS NULL"""
+    ).fetchall()
+    if not rows:
+        return 0
+
+    index = StripeCustomerIndex(stripe_names)
+    now = datetime.now(timezone.utc).isoformat()
+    conn.executemany(
+        """INSERT OR REPLACE INTO counterparty_customers
+               (counterparty_name, stripe_customer_name, updated_at)
+           VALUES (?, ?, ?)""",
+        [(r[0], index.match(r[0]), now) for r in rows],
+    )
+    return len(rows)
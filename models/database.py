@@ -1,17 +1,317 @@
 import os
+import queue
 import sqlite3
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timezone
 
 from config import Config
+from models.counterparties import ensure_classified
+from models.facts import refresh_monthly_facts
 
 
 def get_connection():
-    conn = sqlite3.connect(Config.DB_PATH)
+    """Open a standalone, fully configured connection. The caller closes it."""
+    conn = sqlite3.connect(Config.DB_PATH, timeout=Config.DB_BUSY_TIMEOUT, check_same_thread=False)
     conn.row_factory = sqlite3.Row
     conn.execute("PRAGMA journal_mode=WAL")
     conn.execute("PRAGMA foreign_keys=ON")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    conn.execute(f"PRAGMA mmap_size={int(Config.DB_MMAP_SIZE)}")
+    conn.execute(f"PRAGMA cache_size={-int(Config.DB_CACHE_SIZE_KB)}")
     return conn
 
 
+# ── Connection pool ─────────────────────────────────────────────────────────
+# Idle connections are kept (most recently used first) so request handlers and
+# scheduler jobs skip the connect + PRAGMA round-trip. The pool only bounds how
+# many idle connections are retained; a burst beyond it opens extra ones that
+# are closed on release. DB_POOL_SIZE=0 disables pooling.
+
+# maxsize=0 would make the queue unbounded, so a pool size of 0 keeps none
+_pool = queue.LifoQueue(maxsize=max(Config.DB_POOL_SIZE, 1))
+_local = threading.local()
+
+
+def _acquire():
+    while True:
+        try:
+            conn, path = _pool.get_nowait()
+        except queue.Empty:
+            return get_connection()
+        if path == Config.DB_PATH:
+            return conn
+        conn.close()  # DB_PATH changed since this connection was pooled
+
+
+def _release(conn):
+    if conn.in_transaction:
+        conn.rollback()
+    if Config.DB_POOL_SIZE <= 0:
+        conn.close()
+        return
+    try:
+        _pool.put_nowait((conn, Config.DB_PATH))
+    except queue.Full:
+        conn.close()
+
+
+@contextmanager
+def connection():
+    """Borrow a pooled connection for the duration of a ``with`` block.
+
+    Commits when the outermost block exits cleanly and rolls back if it raises.
+    Nested ``connection()`` blocks on the same thread reuse the outer
+    connection, so helpers can open their own block without starting a second
+    transaction.
+    """
+    conn = getattr(_local, "conn", None)
+    if conn is not None:
+        yield conn
+        return
+
+    conn = _acquire()
+    _local.conn = conn
+    try:
+        yield conn
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+    finally:
+        _local.conn = None
+        _release(conn)
+
+
+def in_connection() -> bool:
+    """True inside a connection() block on this thread (its transaction is the caller's)."""
+    return getattr(_local, "conn", None) is not None
+
+
+def close_pool():
+    """Close every idle pooled connection (e.g. before deleting the DB file)."""
+    while True:
+        try:
+            conn, _ = _pool.get_nowait()
+        except queue.Empty:
+            return
+        conn.close()
+
+
+def _migration_effective_dates(conn):
+    """Add generated date columns and covering indexes for the analytics queries.
+
+    SQLite can only ALTER in VIRTUAL generated columns; the indexes below
+    store the computed values, so filters and GROUP BYs on them never
+    re-evaluate the date expressions per row.
+    """
+    conn.execute(
+        """ALTER TABLE mercury_transactions ADD COLUMN effective_date TEXT
+           GENERATED ALWAYS AS (COALESCE(posted_date, created_at)) VIRTUAL"""
+    )
+    conn.execute(
+        """ALTER TABLE mercury_transactions ADD COLUMN month TEXT
+           GENERATED ALWAYS AS (strftime('%Y-%m', COALESCE(posted_date, created_at))) VIRTUAL"""
+    )
+    conn.execute(
+        """CREATE INDEX IF NOT EXISTS idx_mercury_month
+           ON mercury_transactions (month, amount, kind, status, counterparty_name)"""
+    )
+    conn.execute(
+        """CREATE INDEX IF NOT EXISTS idx_mercury_effective_date
+           ON mercury_transactions (effective_date, amount, kind, status, counterparty_name)"""
+    )
+
+    # Invoices are read with SELECT *, so their month key is an expression
+    # index rather than a generated column that would leak into every row.
+    conn.execute(
+        """CREATE INDEX IF NOT EXISTS idx_stripe_invoices_created_month
+           ON stripe_invoices (strftime('%Y-%m', created_at), status, amount_due)"""
+    )
+    conn.execute(
+        """CREATE INDEX IF NOT EXISTS idx_stripe_invoices_created
+           ON stripe_invoices (created_at, amount_due, amount_paid, customer_name)"""
+    )
+    conn.execute(
+        """CREATE INDEX IF NOT EXISTS idx_stripe_invoices_paid
+           ON stripe_invoices (paid_at, amount_paid, customer_name)"""
+    )
+    conn.execute(
+        """CREATE INDEX IF NOT EXISTS idx_stripe_invoices_status_due
+           ON stripe_invoices (status, due_date, amount_due)"""
+    )
+    conn.execute(
+        """CREATE INDEX IF NOT EXISTS idx_stripe_invoices_customer
+           ON stripe_invoices (customer_name, status)"""
+    )
+
+
+def _migration_counterparty_classification(conn):
+    """Add counterparty classification columns (filled by models.counterparties)."""
+    conn.execute("ALTER TABLE mercury_transactions ADD COLUMN is_internal INTEGER")
+    conn.execute("ALTER TABLE mercury_transactions ADD COLUMN is_owner_distribution INTEGER")
+    conn.execute("ALTER TABLE mercury_transactions ADD COLUMN is_non_revenue INTEGER")
+    conn.execute("ALTER TABLE mercury_transactions ADD COLUMN is_tracked_spend INTEGER")
+    conn.execute("ALTER TABLE mercury_transactions ADD COLUMN spend_category TEXT")
+    conn.execute(
+        """CREATE INDEX IF NOT EXISTS idx_mercury_spend
+           ON mercury_transactions (is_tracked_spend, spend_category, month)"""
+    )
+    conn.execute(
+        """CREATE INDEX IF NOT EXISTS idx_mercury_owner_distributions
+           ON mercury_transactions (is_owner_distribution, effective_date)"""
+    )
+
+
+def _migration_monthly_facts(conn):
+    """Track months whose source rows changed, for models.facts to re-aggregate.
+
+    Update triggers only fire when a column that feeds the rollups changes,
+    so re-upserting unchanged records during sync leaves facts untouched.
+    The marks use an explicit ON CONFLICT DO NOTHING: an INSERT OR IGNORE
+    inside a trigger takes the conflict policy of the outer statement,
+    which for the sync upserts is ABORT.
+    """
+    mercury_changed = " OR ".join(
+        f"OLD.{col} IS NOT NEW.{col}"
+        for col in (
+            "amount", "status", "kind", "posted_date", "created_at", "counterparty_name",
+            "is_internal", "is_owner_distribution", "is_non_revenue", "is_tracked_spend",
+            "spend_category",
+        )
+    )
+    invoice_changed = " OR ".join(
+        f"OLD.{col} IS NOT NEW.{col}" for col in ("amount_due", "status", "created_at")
+    )
+    mark_mercury = (
+        "INSERT INTO monthly_facts_dirty (month) "
+        "SELECT {row}.month WHERE {row}.month IS NOT NULL "
+        "ON CONFLICT(month) DO NOTHING;"
+    )
+    mark_invoice = (
+        "INSERT INTO monthly_facts_dirty (month) "
+        "SELECT strftime('%Y-%m', {row}.created_at) WHERE {row}.created_at IS NOT NULL "
+        "ON CONFLICT(month) DO NOTHING;"
+    )
+    triggers = [
+        ("trg_mercury_facts_insert", "AFTER INSERT ON mercury_transactions",
+         mark_mercury.format(row="NEW")),
+        ("trg_mercury_facts_update", f"AFTER UPDATE ON mercury_transactions WHEN {mercury_changed}",
+         mark_mercury.format(row="OLD") + " " + mark_mercury.format(row="NEW")),
+        ("trg_mercury_facts_delete", "AFTER DELETE ON mercury_transactions",
+         mark_mercury.format(row="OLD")),
+        ("trg_invoice_facts_insert", "AFTER INSERT ON stripe_invoices",
+         mark_invoice.format(row="NEW")),
+        ("trg_invoice_facts_update", f"AFTER UPDATE ON stripe_invoices WHEN {invoice_changed}",
+         mark_invoice.format(row="OLD") + " " + mark_invoice.format(row="NEW")),
+        ("trg_invoice_facts_delete", "AFTER DELETE ON stripe_invoices",
+         mark_invoice.format(row="OLD")),
+    ]
+    # One execute per trigger — executescript would commit the migration's transaction
+    for name, event, body in triggers:
+        conn.execute(f"DROP TRIGGER IF EXISTS {name}")
+        conn.execute(f"CREATE TRIGGER {name} {event} BEGIN {body} END")
+
+
+def _migration_sync_durations(conn):
+    """Record how long each sync (and each Mercury account fetch) took."""
+    conn.execute("ALTER TABLE sync_log ADD COLUMN duration_ms INTEGER")
+
+
+def _migration_stripe_customers(conn):
+    """Seed stripe_customers from invoice/subscription copies and index invoices by customer_id.
+
+    Each customer starts with the name/email on its most recent invoice (or
+    its subscription name) until the customer sync replaces them.
+    """
+    now = datetime.now(timezone.utc).isoformat()
+    conn.execute(
+        """INSERT INTO stripe_customers (id, name, email, updated_at)
+           SELECT customer_id, NULLIF(customer_name, ''), NULLIF(customer_email, ''), ?
+           FROM stripe_invoices si
+           WHERE customer_id IS NOT NULL
+             AND id = (
+                 SELECT id FROM stripe_invoices si2
+                 WHERE si2.customer_id = si.customer_id
+                 ORDER BY created_at DESC
+                 LIMIT 1
+             )
+           ON CONFLICT(id) DO NOTHING""",
+        (now,),
+    )
+    conn.execute(
+        """INSERT INTO stripe_customers (id, name, updated_at)
+           SELECT customer_id, MAX(NULLIF(customer_name, 'Unknown')), ?
+           FROM stripe_subscriptions
+           WHERE customer_id IS NOT NULL
+           GROUP BY customer_id
+           ON CONFLICT(id) DO NOTHING""",
+        (now,),
+    )
+    conn.execute("DROP INDEX IF EXISTS idx_stripe_invoices_customer")
+    conn.execute("DROP INDEX IF EXISTS idx_stripe_invoices_created")
+    conn.execute("DROP INDEX IF EXISTS idx_stripe_invoices_paid")
+    conn.execute(
+        """CREATE INDEX IF NOT EXISTS idx_stripe_invoices_customer_id
+           ON stripe_invoices (customer_id, status, amount_due)"""
+    )
+    conn.execute(
+        """CREATE INDEX IF NOT EXISTS idx_stripe_invoices_created
+           ON stripe_invoices (created_at, amount_due, amount_paid, customer_id)"""
+    )
+    conn.execute(
+        """CREATE INDEX IF NOT EXISTS idx_stripe_invoices_paid
+           ON stripe_invoices (paid_at, amount_paid, customer_id)"""
+    )
+    conn.execute(
+        """CREATE INDEX IF NOT EXISTS idx_stripe_subscriptions_customer_id
+           ON stripe_subscriptions (status, customer_id, monthly_amount)"""
+    )
+
+
+def _migration_daily_ledger(conn):
+    """Mark every month dirty so the next fact refresh fills daily_ledger."""
+    conn.execute(
+        """INSERT INTO monthly_facts_dirty (month)
+           SELECT DISTINCT month FROM mercury_transactions WHERE month IS NOT NULL
+           ON CONFLICT(month) DO NOTHING"""
+    )
+
+
+def _migration_stripe_observed_at(conn):
+    """Record when each Stripe row's state was read, so older state never overwrites newer."""
+    for table in ("stripe_invoices", "stripe_subscriptions", "stripe_customers"):
+        conn.execute(f"ALTER TABLE {table} ADD COLUMN observed_at INTEGER")
+
+
+# Schema migrations, applied in order. The database's PRAGMA user_version
+# records how many have run, so append new steps — never reorder or edit.
+MIGRATIONS = [
+    _migration_effective_dates,
+    _migration_counterparty_classification,
+    _migration_monthly_facts,
+    _migration_sync_durations,
+    _migration_stripe_customers,
+    _migration_daily_ledger,
+    _migration_stripe_observed_at,
+]
+
+
+def _apply_migrations(conn):
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    for number, migration in enumerate(MIGRATIONS[version:], start=version + 1):
+        # DDL is transactional in SQLite — a failed step leaves no partial schema
+        conn.execute("BEGIN")
+        try:
+            migration(conn)
+            conn.execute(f"PRAGMA user_version = {number}")
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
+
 def init_db():
     schema_path = os.path.join(os.path.dirname(__file__), "schema.sql")
     with open(schema_path) as f:
@@ -36,4 +336,7 @@ def init_db():
            )"""
     )
     conn.commit()
+    _apply_migrations(conn)
+    ensure_classified(conn)
+    refresh_monthly_facts(conn)
     conn.close()
@@ -0,0 +1,254 @@
+import hashlib
+from datetime import datetime, timezone
+
+from models.counterparties import resolve_stripe_customers
+
+# Pre-aggregated monthly rollups read by the charts, KPI cards and Slack
+# reports. Triggers on mercury_transactions and stripe_invoices (see
+# models.database._migration_monthly_facts) record every month whose
+# underlying rows changed in monthly_facts_dirty; refresh_monthly_facts()
+# re-aggregates just those months.
+#
+# daily_ledger / daily_ledger_categories hold the same Mercury figures per
+# day with running totals; they are rebuilt for the dirty months and the
+# running totals re-accumulated from the first changed day onward.
+#
+# "Collected" throughout the dashboard means Mercury inflows (Stripe payouts
+# land there too), so monthly_facts.inflows doubles as the collected figure.
+
+MERCURY_VALID = "status NOT IN ('cancelled', 'failed')"
+MERCURY_INFLOW = (
+    "amount > 0"
+    " AND kind NOT IN ('creditCardTransaction', 'cardInternationalTransactionFee')"
+    " AND is_internal = 0"
+)
+
+# Months are re-aggregated in groups of this size to keep IN (...) lists short
+_MONTH_CHUNK = 50
+
+_STRIPE_NAMES_KEY = "monthly_facts_stripe_names"
+
+
+def _stripe_names(conn):
+    rows = conn.execute(
+        """SELECT DISTINCT COALESCE(sc.name, si.customer_name)
+           FROM stripe_invoices si
+           LEFT JOIN stripe_customers sc ON sc.id = si.customer_id
+           WHERE COALESCE(sc.name, si.customer_name) IS NOT NULL"""
+    ).fetchall()
+    return {r[0] for r in rows}
+
+
+def _stripe_names_fingerprint(names):
+    return hashlib.sha1("\n".join(sorted(names)).encode()).hexdigest()
+
+
+def _direct_invoiced(conn, months):
+    """Mercury inflows per month from direct payers not already billed in Stripe.
+
+    Counterparties resolved to a Stripe customer (see
+    models.counterparties.resolve_stripe_customers) are skipped so clients
+    paying through both channels are not double-counted.
+    """
+    placeholders = ",".join("?" for _ in months)
+    rows = conn.execute(
+        f"""SELECT mt.month, SUM(mt.amount) AS total
+           FROM mercury_transactions mt
+           JOIN counterparty_customers cc ON cc.counterparty_name = mt.counterparty_name
+           WHERE mt.month IN ({placeholders})
+             AND cc.stripe_customer_name IS NULL
+             AND {MERCURY_INFLOW}
+             AND {MERCURY_VALID}
+             AND is_non_revenue = 0
+           GROUP BY mt.month""",
+        months,
+    ).fetchall()
+    return {r[0]: r[1] for r in rows}
+
+
+def _rebuild_months(conn, months, now):
+    placeholders = ",".join("?" for _ in months)
+    conn.execute(f"DELETE FROM monthly_facts WHERE month IN ({placeholders})", months)
+    conn.execute(f"DELETE FROM monthly_spend_facts WHERE month IN ({placeholders})", months)
+
+    conn.execute(
+        f"""INSERT INTO monthly_facts
+               (month, transactions, inflows, outflows, owner_distributions, updated_at)
+           SELECT month,
+                  COUNT(*),
+                  SUM(CASE WHEN {MERCURY_INFLOW} THEN amount ELSE 0 END),
+                  SUM(CASE WHEN amount < 0 AND is_internal = 0 THEN ABS(amount) ELSE 0 END),
+                  SUM(CASE WHEN amount < 0 AND is_owner_distribution = 1 THEN ABS(amount) ELSE 0 END),
+                  ?
+           FROM mercury_transactions
+           WHERE month IN ({placeholders})
+             AND {MERCURY_VALID}
+           GROUP BY month""",
+        [now, *months],
+    )
+
+    stripe_rows = conn.execute(
+        f"""SELECT strftime('%Y-%m', created_at) AS month, SUM(amount_due) AS total
+           FROM stripe_invoices
+           WHERE strftime('%Y-%m', created_at) IN ({placeholders})
+             AND status != 'void'
+             AND amount_due > 0
+           GROUP BY month""",
+        months,
+    ).fetchall()
+    stripe_invoiced = {r[0]: r[1] for r in stripe_rows}
+    direct_invoiced = _direct_invoiced(conn, months)
+
+    for month in set(stripe_invoiced) | set(direct_invoiced):
+        stripe_total = stripe_invoiced.get(month, 0)
+        conn.execute(
+            """INSERT INTO monthly_facts (month, stripe_invoiced, invoiced, updated_at)
+               VALUES (?, ?, ?, ?)
+               ON CONFLICT(month) DO UPDATE SET
+                   stripe_invoiced=excluded.stripe_invoiced,
+                   invoiced=excluded.invoiced""",
+            (month, stripe_total, stripe_total + direct_invoiced.get(month, 0), now),
+        )
+
+    conn.execute(
+        f"""INSERT INTO monthly_spend_facts (month, category, total)
+           SELECT month, spend_category, SUM(ABS(amount))
+           FROM mercury_transactions
+           WHERE month IN ({placeholders})
+             AND is_tracked_spend = 1
+             AND amount < 0
+             AND status = 'sent'
+           GROUP BY month, spend_category""",
+        months,
+    )
+
+
+def _rebuild_ledger_days(conn, months):
+    placeholders = ",".join("?" for _ in months)
+    conn.execute(f"DELETE FROM daily_ledger WHERE substr(day, 1, 7) IN ({placeholders})", months)
+    conn.execute(f"DELETE FROM daily_ledger_categories WHERE substr(day, 1, 7) IN ({placeholders})", months)
+
+    conn.execute(
+        f"""INSERT INTO daily_ledger (day, inflows, outflows, owner_distributions)
+           SELECT strftime('%Y-%m-%d', effective_date) AS day,
+                  SUM(CASE WHEN {MERCURY_INFLOW} THEN amount ELSE 0 END),
+                  SUM(CASE WHEN amount < 0 AND is_internal = 0 THEN ABS(amount) ELSE 0 END),
+                  SUM(CASE WHEN amount < 0 AND is_owner_distribution = 1 THEN ABS(amount) ELSE 0 END)
+           FROM mercury_transactions
+           WHERE month IN ({placeholders})
+             AND {MERCURY_VALID}
+           GROUP BY day""",
+        months,
+    )
+    conn.execute(
+        f"""INSERT INTO daily_ledger_categories (category, day, spend)
+           SELECT COALESCE(spend_category, ''), strftime('%Y-%m-%d', effective_date) AS day, SUM(ABS(amount))
+           FROM mercury_transactions
+           WHERE month IN ({placeholders})
+             AND amount < 0
+             AND is_internal = 0
+             AND {MERCURY_VALID}
+           GROUP BY 1, day""",
+        months,
+    )
+
+
+def _accumulate_ledger(conn, from_day: str):
+    """Recompute the running totals of every ledger row on or after from_day."""
+    conn.execute(
+        """WITH base AS (
+               SELECT cum_inflows, cum_outflows, cum_owner_distributions
+               FROM daily_ledger WHERE day < ? ORDER BY day DESC LIMIT 1
+           ),
+           running AS (
+               SELECT day,
+                      SUM(inflows) OVER w AS inflows,
+                      SUM(outflows) OVER w AS outflows,
+                      SUM(owner_distributions) OVER w AS owner_distributions
+               FROM daily_ledger
+               WHERE day >= ?
+               WINDOW w AS (ORDER BY day)
+           )
+           UPDATE daily_ledger SET
+               cum_inflows = running.inflows + COALESCE((SELECT cum_inflows FROM base), 0),
+               cum_outflows = running.outflows + COALESCE((SELECT cum_outflows FROM base), 0),
+               cum_owner_distributions = running.owner_distributions
+                   + COALESCE((SELECT cum_owner_distributions FROM base), 0)
+           FROM running
+           WHERE daily_ledger.day = running.day""",
+        (from_day, from_day),
+    )
+    conn.execute(
+        """WITH running AS (
+               SELECT category, day,
+                      SUM(spend) OVER (PARTITION BY category ORDER BY day)
+                      + COALESCE((SELECT prev.cum_spend FROM daily_ledger_categories prev
+                                  WHERE prev.category = cur.category AND prev.day < ?
+                                  ORDER BY prev.day DESC LIMIT 1), 0) AS cum_spend
+               FROM daily_ledger_categories cur
+               WHERE day >= ?
+           )
+           UPDATE daily_ledger_categories SET cum_spend = running.cum_spend
+           FROM running
+           WHERE daily_ledger_categories.category = running.category
+             AND daily_ledger_categories.day = running.day""",
+        (from_day, from_day),
+    )
+
+
+def refresh_monthly_facts(conn, full: bool = False):
+    """Re-aggregate dirty months (or every month when full) into the fact tables and daily ledger.
+
+    New Mercury counterparties are resolved against Stripe customers first.
+    The invoiced figure depends on the set of Stripe customer names, so a
+    change to that set re-resolves every counterparty and rebuilds every
+    month. Returns the number of months rebuilt. Inside a caller's open
+    transaction the work joins it, and the caller commits or rolls back.
+    """
+    owns = not conn.in_transaction
+    if owns:
+        conn.execute("BEGIN IMMEDIATE")
+    try:
+        now = datetime.now(timezone.utc).isoformat()
+        stripe_names = _stripe_names(conn)
+        fingerprint = _stripe_names_fingerprint(stripe_names)
+        row = conn.execute(
+            "SELECT value FROM app_state WHERE key = ?", (_STRIPE_NAMES_KEY,)
+        ).fetchone()
+        full = full or row is None or row[0] != fingerprint
+        resolve_stripe_customers(conn, stripe_names, full)
+
+        if full:
+            months = [r[0] for r in conn.execute(
+                """SELECT month FROM mercury_transactions WHERE month IS NOT NULL
+                   UNION
+                   SELECT strftime('%Y-%m', created_at) FROM stripe_invoices
+                   WHERE created_at IS NOT NULL"""
+            )]
+            conn.execute("DELETE FROM monthly_facts")
+            conn.execute("DELETE FROM monthly_spend_facts")
+            conn.execute("DELETE FROM daily_ledger")
+            conn.execute("DELETE FROM daily_ledger_categories")
+        else:
+            months = [r[0] for r in conn.execute("SELECT month FROM monthly_facts_dirty")]
+
+        for i in range(0, len(months), _MONTH_CHUNK):
+            _rebuild_months(conn, months[i:i + _MONTH_CHUNK], now)
+            _rebuild_ledger_days(conn, months[i:i + _MONTH_CHUNK])
+        if months:
+            _accumulate_ledger(conn, f"{min(months)}-01")
+
+        conn.execute("DELETE FROM monthly_facts_dirty")
+        conn.execute(
+            """INSERT INTO app_state (key, value, updated_at)
+               VALUES (?, ?, ?)
+               ON CONFLICT(key) DO UPDATE SET value=excluded.value, updated_at=excluded.updated_at""",
+            (_STRIPE_NAMES_KEY, fingerprint, now),
+        )
+        if owns:
+            conn.commit()
+    except Exception:
+        if owns:
+            conn.rollback()
+        raise
+    return len(months)
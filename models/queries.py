@@ -1,159 +1,178 @@
-from datetime import datetime, timezone
+import copy
+import functools
+import json
+import threading
+import time
+from datetime import datetime, timedelta, timezone
 
-from models.database import get_connection
+from config import Config
+from models.counterparties import classify_transaction, SPEND_CATEGORIES, StripeCustomerIndex
+from models.database import connection, in_connection
+from models.facts import refresh_monthly_facts
+
+# Counterparty filters read the classification columns that
+# models.counterparties stores on every transaction at ingest time.
 
 # SQL clause to exclude internal/self transfers and owner draws
-EXCLUDE_INTERNAL = """
-    AND counterparty_name NOT LIKE '%Wells Fargo%0430%'
-    AND counterparty_name NOT LIKE '%Bank of America%1717%'
-    AND counterparty_name NOT LIKE 'BANK OF AMERICA'
-    AND counterparty_name NOT LIKE '%Chase%'
-    AND counterparty_name NOT LIKE 'Mercury Checking%'
-    AND counterparty_name NOT LIKE 'Mercury Savings%'
-    AND counterparty_name NOT LIKE 'Mercury Credit%'
-    AND counterparty_name NOT LIKE 'Mercury IO%'
-    AND counterparty_name != 'Alex Fine'
-    AND counterparty_name != 'Alexander Yildirim'
-"""
+EXCLUDE_INTERNAL = "AND is_internal = 0"
+
+# SQL clause to exclude inflows that are not client revenue (Stripe payouts,
+# interest, cashback, insurance)
+EXCLUDE_NON_REVENUE = "AND is_non_revenue = 0"
 
 # SQL clause matching owner distribution counterparties
-OWNER_DISTRIBUTIONS = """
-    (counterparty_name LIKE '%Wells Fargo%0430%'
-     OR counterparty_name LIKE '%Bank of America%1717%'
-     OR counterparty_name = 'BANK OF AMERICA'
-     OR counterparty_name = 'Alex Fine'
-     OR counterparty_name = 'Alexander Yildirim')
-"""
+OWNER_DISTRIBUTIONS = "is_owner_distribution = 1"
+
 
+# --------------- Memoization ---------------
 
-# --------------- Spend Categories ---------------
+_generation_memo = {}  # {function name: (data generation, result)}
+_generation_memo_lock = threading.Lock()
 
-def categorize_vendor(name, kind=None):
-    """Categorize a counterparty name into a spending category.
 
-    Args:
-        name: Counterparty name.
-        kind: Mercury transaction kind. If 'outgoingPayment', unmatched
-              vendors default to Labor (contractors) instead of Miscellaneous.
+def _memoize_per_generation(fn):
+    """Cache a no-argument query's result until the data generation advances.
+
+    Callers receive a shallow copy, so mutating the result never leaks into
+    the cache.
     """
-    if not name:
-        return "Miscellaneous"
-    upper = name.upper()
-
-    # Salaries — ADP payroll
-    if upper.startswith("ADP"):
-        return "Salaries"
-
-    # Taxes — IRS, state taxes, tax/accounting firms
-    if any(kw in upper for kw in [
-        "IRS", "GEORGIA ITS TAX", "GA DEPT OF LABOR",
-        "BOYLE TAX", "SAVERITE TAX", "STATE OF TN",
-        "DELAWARE CORP",
-    ]):
-        return "Taxes"
-
-    # Email Infrastructure — premium inboxes, email sending, email domains
-    if upper.startswith("RMT*"):
-        return "Email Infrastructure"
-    if any(kw in upper for kw in [
-        "BEANSTALK CONSULTING", "INBOXKIT", "PREMIUM INBOX",
-        "MISSION INBOX", "OUTBOUNDSYNC", "COLDEMAILDOMAINS",
-        "BOUNCEBAN", "MAILTESTER",
-    ]):
-        return "Email Infrastructure"
-
-    # Travel — airlines, hotels, rideshare, parking
-    if any(kw in upper for kw in [
-        "AIRLINE", "DELTA AIR", "UNITED AIR", "AMERICAN AIR", "SOUTHWEST",
-        "TURKISH AIR", "HOTEL", "MARRIOTT", "HILTON", "AIRBNB", "UBER",
-        "LYFT", "WAYMO", "TRAVELURO", "HOTELS.COM", "THE PEARL",
-        "DIPLOMAT", "RITZ-CARLTON", "CANOPY BY HILTON", "MOTTO BY HILTON",
-        "PARKING", "OWLPARKING", "12 OAKS",
-    ]):
-        return "Travel"
-
-    # Tech Vendors — software, SaaS, AI, sales tools, lead gen, ads
-    if any(kw in upper for kw in [
-        "STRIPE", "OPENAI", "OPEN AI", "CHATGPT", "ANTHROPIC",
-        "CLAUDE", "LOVABLE", "MANUS", "GITHUB", "GOOGLE", "MICROSOFT",
-        "AMAZON WEB", "AWS", "HEROKU", "VERCEL", "NETLIFY", "DIGITAL OCEAN",
-        "CLOUDFLARE", "SLACK", "NOTION", "FIGMA", "CANVA", "HUBSPOT",
-        "SALESFORCE", "ZAPIER", "AIRTABLE", "CLICKUP", "ZOOM", "LOOM",
-        "LINKEDIN", "FACEBOOK", "FACEBK", "CLAY LABS", "INSTANTLY",
-        "HEYREACH", "FIREFLIES", "PANDADOC", "MIRO", "CALENDLY",
-        "ATLASSIAN", "BEEHIIV", "MAKE", "WISPR", "SUPERMETRICS",
-        "QUICKBOOKS", "1PASSWORD", "SUPABASE", "CURSOR", "APIFY",
-        "RAILWAY", "GAMMA", "TELLA", "WP ENGINE", "PORTER METRICS",
-        "PERPLEXITY", "SQUARESPACE", "BOOMERANG", "RIVERSIDE",
-        "CHECKR", "NAMECHEAP", "PERSONA", "PORKBUN", "SERPER",
-        "OTTERAD", "KIIN", "ENRICH LABS",
-        "STORE LEADS", "TEAMFLUENCE", "LEADSFRIDAY", "LEADWAVE",
-        "AMPLELEADS", "LEADS ON TREES", "FOLLOWINGG", "ENGAGERS",
-        "AI ARK", "TRYKITT", "OVERVUE", "UPSCALE SYSTEMS",
-        "SALES AUTOMATION", "THEIRSTACK", "MERGR", "LEADASSIST",
-        "DEMANDGEN", "AI.FYXER", "SUPERHOG", "AMAZON PRIME",
-        "VIASAT", "FIBBLER", "OCTAVE",
-    ]):
-        return "Tech Vendors"
-
-    # Labor — consulting, agencies, services
-    if any(kw in upper for kw in [
-        "FUELFINANCE", "AUTOMATEDEMAND", "FANBASIS", "PAYONEER",
-        "REVPARTNERS", "VIVA GROWTH", "CHITLANGIA", "NOAH GREEN",
-        "COASTAL-COLLECTIVE", "LA WHENCE", "TRADEMIMIC", "KS-MEDIA", "GROWTHX",
-    ]):
-        return "Labor"
-
-    # Outgoing payments from checking are contractor/labor payments
-    if kind == "outgoingPayment":
-        return "Labor"
-
-    # Miscellaneous — food, health, entertainment, everything else
-    return "Miscellaneous"
-
-
-SPEND_CATEGORIES = [
-    "Salaries",
-    "Labor",
-    "Tech Vendors",
-    "Email Infrastructure",
-    "Taxes",
-    "Travel",
-    "Miscellaneous",
-]
+    @functools.wraps(fn)
+    def wrapper():
+        generation, _ = get_data_generation()
+        with _generation_memo_lock:
+            cached = _generation_memo.get(fn.__name__)
+        if cached is None or cached[0] != generation:
+            cached = (generation, fn())
+            with _generation_memo_lock:
+                _generation_memo[fn.__name__] = cached
+        return copy.copy(cached[1])
+    return wrapper
+
+
+# --------------- Periods ---------------
+
+# Reporting periods, keyed from a "YYYY-MM" month column
+PERIOD_EXPRESSIONS = {
+    "month": "month",
+    "quarter": "substr(month, 1, 4) || '-Q' || ((CAST(substr(month, 6, 2) AS INTEGER) + 2) / 3)",
+    "year": "substr(month, 1, 4)",
+}
+
+
+def shift_month(month: str, n: int) -> str:
+    """Return the YYYY-MM label n months after month (n may be negative)."""
+    index = int(month[:4]) * 12 + int(month[5:7]) - 1 + n
+    return f"{index // 12:04d}-{index % 12 + 1:02d}"
+
+
+def period_of(month: str, granularity: str) -> str:
+    """Python twin of PERIOD_EXPRESSIONS for one YYYY-MM label."""
+    if granularity == "quarter":
+        return f"{month[:4]}-Q{(int(month[5:7]) + 2) // 3}"
+    if granularity == "year":
+        return month[:4]
+    return month
+
+
+def period_months(start: str, end: str, granularity: str):
+    """Return {period: [month, ...]} for months start..end (inclusive), in order."""
+    if granularity not in PERIOD_EXPRESSIONS:
+        raise ValueError(f"granularity must be one of {', '.join(PERIOD_EXPRESSIONS)}")
+    periods = {}
+    month = start
+    while month <= end:
+        periods.setdefault(period_of(month, granularity), []).append(month)
+        month = shift_month(month, 1)
+    return periods
+
+
+# --------------- Bulk writes ---------------
+
+def _bulk_upsert(sql: str, params, chunk_size: int = None):
+    """Run an upsert statement over many parameter tuples on one connection.
+
+    Rows are written with executemany in chunks of chunk_size (default
+    Config.DB_BATCH_SIZE), each chunk in its own transaction, so a large
+    ingest pays one commit per chunk instead of one per row. Inside an
+    enclosing connection() block the chunks join that block's transaction
+    instead, and it commits or rolls back as a whole.
+    """
+    chunk_size = chunk_size or Config.DB_BATCH_SIZE
+    outermost = not in_connection()
+    count = 0
+    with connection() as conn:
+        chunk = []
+        for p in params:
+            chunk.append(p)
+            if len(chunk) >= chunk_size:
+                conn.executemany(sql, chunk)
+                if outermost:
+                    conn.commit()
+                count += len(chunk)
+                chunk = []
+        if chunk:
+            conn.executemany(sql, chunk)
+            count += len(chunk)
+    return count
 
 
 # --------------- Mercury Transactions ---------------
 
-def upsert_mercury_transaction(txn: dict):
-    conn = get_connection()
-    conn.execute(
-        """INSERT INTO mercury_transactions
-               (id, amount, counterparty_name, note, kind, status, created_at, posted_date, account_id)
-           VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-           ON CONFLICT(id) DO UPDATE SET
-               amount=excluded.amount,
-               counterparty_name=excluded.counterparty_name,
-               note=excluded.note,
-               kind=excluded.kind,
-               status=excluded.status,
-               created_at=excluded.created_at,
-               posted_date=excluded.posted_date,
-               account_id=excluded.account_id""",
-        (
-            txn["id"],
-            txn["amount"],
-            txn.get("counterparty_name"),
-            txn.get("note"),
-            txn.get("kind"),
-            txn.get("status"),
-            txn.get("created_at"),
-            txn.get("posted_date"),
-            txn.get("account_id"),
-        ),
+_MERCURY_UPSERT_SQL = """INSERT INTO mercury_transactions
+       (id, amount, counterparty_name, note, kind, status, created_at, posted_date, account_id,
+        is_internal, is_owner_distribution, is_non_revenue, is_tracked_spend, spend_category)
+   VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+   ON CONFLICT(id) DO UPDATE SET
+       amount=excluded.amount,
+       counterparty_name=excluded.counterparty_name,
+       note=excluded.note,
+       kind=excluded.kind,
+       status=excluded.status,
+       created_at=excluded.created_at,
+       posted_date=excluded.posted_date,
+       account_id=excluded.account_id,
+       is_internal=excluded.is_internal,
+       is_owner_distribution=excluded.is_owner_distribution,
+       is_non_revenue=excluded.is_non_revenue,
+       is_tracked_spend=excluded.is_tracked_spend,
+       spend_category=excluded.spend_category"""
+
+
+def _mercury_transaction_params(txn: dict):
+    cls = classify_transaction(txn.get("counterparty_name"), txn.get("kind"))
+    return (
+        txn["id"],
+        txn["amount"],
+        txn.get("counterparty_name"),
+        txn.get("note"),
+        txn.get("kind"),
+        txn.get("status"),
+        txn.get("created_at"),
+        txn.get("posted_date"),
+        txn.get("account_id"),
+        cls["is_internal"],
+        cls["is_owner_distribution"],
+        cls["is_non_revenue"],
+        cls["is_tracked_spend"],
+        cls["spend_category"],
     )
-    conn.commit()
-    conn.close()
+
+
+def upsert_mercury_transaction(txn: dict):
+    upsert_mercury_transactions([txn])
+
+
+def upsert_mercury_transactions(txns, chunk_size: int = None):
+    """Upsert many Mercury transactions, one transaction per chunk. Returns row count."""
+    return _bulk_upsert(_MERCURY_UPSERT_SQL, map(_mercury_transaction_params, txns), chunk_size)
+
+
+def get_mercury_transaction(txn_id: str):
+    with connection() as conn:
+        row = conn.execute(
+            "SELECT * FROM mercury_transactions WHERE id = ?", (txn_id,)
+        ).fetchone()
+    return dict(row) if row else None
 
 
 def get_mercury_monthly_flows():
@@ -162,229 +181,309 @@ def get_mercury_monthly_flows():
     Inflows exclude credit card transactions (no CC refunds exist and they
     would be noise).  Outflows *include* itemized CC charges so that
     spending is fully reflected in margin calculations.  The lump CC bill
-    payment (checking → Mercury Credit) is excluded via EXCLUDE_INTERNAL,
-    preventing double-counting.
+    payment (checking → Mercury Credit) is excluded via is_internal,
+    preventing double-counting. Read from monthly_facts (see models.facts).
     """
-    conn = get_connection()
-    rows = conn.execute(
-        f"""SELECT
-               strftime('%Y-%m', COALESCE(posted_date, created_at)) AS month,
-               SUM(CASE WHEN amount > 0
-                        AND kind NOT IN ('creditCardTransaction', 'cardInternationalTransactionFee')
-                        {EXCLUDE_INTERNAL} THEN amount ELSE 0 END) AS inflows,
-               SUM(CASE WHEN amount < 0 {EXCLUDE_INTERNAL} THEN ABS(amount) ELSE 0 END) AS outflows,
-               SUM(CASE WHEN amount < 0 AND {OWNER_DISTRIBUTIONS} THEN ABS(amount) ELSE 0 END) AS owner_distributions
-           FROM mercury_transactions
-           WHERE COALESCE(posted_date, created_at) IS NOT NULL
-             AND status NOT IN ('cancelled', 'failed')
-           GROUP BY month
-           ORDER BY month"""
-    ).fetchall()
-    conn.close()
+    with connection() as conn:
+        rows = conn.execute(
+            """SELECT month, inflows, outflows, owner_distributions
+               FROM monthly_facts
+               WHERE transactions > 0
+               ORDER BY month"""
+        ).fetchall()
     return [dict(r) for r in rows]
 
 
+def get_period_flows(start: str, end: str, granularity: str = "month"):
+    """Return {period: {inflows, outflows, owner_distributions, invoiced}} for months start..end.
+
+    One grouped query over monthly_facts (see PERIOD_EXPRESSIONS); periods
+    with no facts are omitted. MANUAL_INVOICED_OVERRIDES replace their
+    month's invoiced figure, as in get_monthly_invoiced.
+    """
+    overrides = {m: v for m, v in MANUAL_INVOICED_OVERRIDES.items() if start <= m <= end}
+    placeholders = ",".join("?" for _ in overrides)
+    invoiced = f"CASE WHEN month IN ({placeholders}) THEN 0 ELSE invoiced END" if overrides else "invoiced"
+    with connection() as conn:
+        rows = conn.execute(
+            f"""SELECT {PERIOD_EXPRESSIONS[granularity]} AS period,
+                       SUM(inflows) AS inflows,
+                       SUM(outflows) AS outflows,
+                       SUM(owner_distributions) AS owner_distributions,
+                       SUM({invoiced}) AS invoiced
+                FROM monthly_facts
+                WHERE month >= ? AND month <= ?
+                GROUP BY period""",
+            [*overrides, start, end],
+        ).fetchall()
+
+    result = {r["period"]: dict(r) for r in rows}
+    for month, amount in overrides.items():
+        period = result.setdefault(period_of(month, granularity), {
+            "period": period_of(month, granularity),
+            "inflows": 0, "outflows": 0, "owner_distributions": 0, "invoiced": 0,
+        })
+        period["invoiced"] += amount
+    return result
+
+
 def get_mercury_inflows_over_time():
     """Return monthly inflows for the line chart, excluding internal transfers."""
-    conn = get_connection()
-    rows = conn.execute(
-        f"""SELECT
-               strftime('%Y-%m', COALESCE(posted_date, created_at)) AS month,
-               SUM(amount) AS total
-           FROM mercury_transactions
-           WHERE amount > 0
-             AND COALESCE(posted_date, created_at) IS NOT NULL
-             AND status NOT IN ('cancelled', 'failed')
-             AND kind NOT IN ('creditCardTransaction', 'cardInternationalTransactionFee')
-             {EXCLUDE_INTERNAL}
-           GROUP BY month
-           ORDER BY month"""
-    ).fetchall()
-    conn.close()
+    with connection() as conn:
+        rows = conn.execute(
+            """SELECT month, inflows AS total
+               FROM monthly_facts
+               WHERE inflows > 0
+               ORDER BY month"""
+        ).fetchall()
     return [dict(r) for r in rows]
 
 
+# --------------- Stripe Customers ---------------
+# Stripe rows carry observed_at, the Unix time their state was read from
+# Stripe: the fetch time, or a webhook event's created. Stripe does not
+# guarantee webhook delivery order, so an upsert only replaces a row with
+# state observed at the same time or later.
+# Invoices and subscriptions reference customers by id. Readers join
+# stripe_customers for the current name/email, falling back to the copy
+# Stripe froze onto the invoice (e.g. for customers deleted since), and
+# group by customer_id.
+
+CUSTOMER_JOIN = "LEFT JOIN stripe_customers sc ON sc.id = si.customer_id"
+CUSTOMER_NAME = "COALESCE(sc.name, si.customer_name)"
+CUSTOMER_EMAIL = "COALESCE(sc.email, si.customer_email)"
+# Every stripe_invoices column, with the customer fields resolved
+INVOICE_COLUMNS = f"""si.id, si.number, si.customer_id,
+       {CUSTOMER_NAME} AS customer_name, {CUSTOMER_EMAIL} AS customer_email,
+       si.amount_due, si.amount_paid, si.currency, si.status, si.due_date,
+       si.created_at, si.paid_at, si.hosted_invoice_url"""
+
+_STRIPE_CUSTOMER_UPSERT_SQL = """INSERT INTO stripe_customers (id, name, email, created_at, updated_at, observed_at)
+   VALUES (?, ?, ?, ?, ?, ?)
+   ON CONFLICT(id) DO UPDATE SET
+       name=excluded.name,
+       email=excluded.email,
+       created_at=excluded.created_at,
+       updated_at=excluded.updated_at,
+       observed_at=excluded.observed_at
+   WHERE excluded.observed_at >= COALESCE(stripe_customers.observed_at, 0)"""
+
+
+def upsert_stripe_customer(customer: dict):
+    upsert_stripe_customers([customer])
+
+
+def upsert_stripe_customers(customers, chunk_size: int = None):
+    """Upsert many Stripe customers, one transaction per chunk. Returns row count."""
+    now = datetime.now(timezone.utc).isoformat()
+    params = (
+        (c["id"], c.get("name") or None, c.get("email") or None, c.get("created_at"), now,
+         c.get("observed_at") or int(time.time()))
+        for c in customers
+    )
+    return _bulk_upsert(_STRIPE_CUSTOMER_UPSERT_SQL, params, chunk_size)
+
+
 # --------------- Stripe Invoices ---------------
 
-def upsert_stripe_invoice(inv: dict):
-    conn = get_connection()
-    conn.execute(
-        """INSERT INTO stripe_invoices
-               (id, number, customer_id, customer_name, customer_email,
-                amount_due, amount_paid, currency, status, due_date, created_at, paid_at, hosted_invoice_url)
-           VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-           ON CONFLICT(id) DO UPDATE SET
-               number=excluded.number,
-               customer_id=excluded.customer_id,
-               customer_name=excluded.customer_name,
-               customer_email=excluded.customer_email,
-               amount_due=excluded.amount_due,
-               amount_paid=excluded.amount_paid,
-               currency=excluded.currency,
-               status=excluded.status,
-               due_date=excluded.due_date,
-               created_at=excluded.created_at,
-               paid_at=excluded.paid_at,
-               hosted_invoice_url=excluded.hosted_invoice_url""",
-        (
-            inv["id"],
-            inv.get("number"),
-            inv.get("customer_id"),
-            inv.get("customer_name"),
-            inv.get("customer_email"),
-            inv["amount_due"],
-            inv.get("amount_paid", 0),
-            inv.get("currency", "usd"),
-            inv.get("status"),
-            inv.get("due_date"),
-            inv.get("created_at"),
-            inv.get("paid_at"),
-            inv.get("hosted_invoice_url"),
-        ),
+_STRIPE_INVOICE_UPSERT_SQL = """INSERT INTO stripe_invoices
+       (id, number, customer_id, customer_name, customer_email,
+        amount_due, amount_paid, currency, status, due_date, created_at, paid_at, hosted_invoice_url,
+        observed_at)
+   VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+   ON CONFLICT(id) DO UPDATE SET
+       number=excluded.number,
+       customer_id=excluded.customer_id,
+       customer_name=excluded.customer_name,
+       customer_email=excluded.customer_email,
+       amount_due=excluded.amount_due,
+       amount_paid=excluded.amount_paid,
+       currency=excluded.currency,
+       status=excluded.status,
+       due_date=excluded.due_date,
+       created_at=excluded.created_at,
+       paid_at=excluded.paid_at,
+       hosted_invoice_url=excluded.hosted_invoice_url,
+       observed_at=excluded.observed_at
+   WHERE excluded.observed_at >= COALESCE(stripe_invoices.observed_at, 0)"""
+
+
+def _stripe_invoice_params(inv: dict):
+    return (
+        inv["id"],
+        inv.get("number"),
+        inv.get("customer_id"),
+        inv.get("customer_name"),
+        inv.get("customer_email"),
+        inv["amount_due"],
+        inv.get("amount_paid", 0),
+        inv.get("currency", "usd"),
+        inv.get("status"),
+        inv.get("due_date"),
+        inv.get("created_at"),
+        inv.get("paid_at"),
+        inv.get("hosted_invoice_url"),
+        inv.get("observed_at") or int(time.time()),
     )
-    conn.commit()
-    conn.close()
+
+
+def upsert_stripe_invoice(inv: dict):
+    upsert_stripe_invoices([inv])
+
+
+def upsert_stripe_invoices(invoices, chunk_size: int = None):
+    """Upsert many Stripe invoices, one transaction per chunk. Returns row count."""
+    return _bulk_upsert(_STRIPE_INVOICE_UPSERT_SQL, map(_stripe_invoice_params, invoices), chunk_size)
+
+
+def delete_stripe_invoice(invoice_id: str):
+    """Remove a deleted (draft) invoice."""
+    with connection() as conn:
+        conn.execute("DELETE FROM stripe_invoices WHERE id = ?", (invoice_id,))
 
 
 def get_late_invoices():
     """Return open invoices past due date that haven't been notified yet."""
     now = datetime.now(timezone.utc).strftime("%Y-%m-%d")
-    conn = get_connection()
-    rows = conn.execute(
-        """SELECT si.*
-           FROM stripe_invoices si
-           LEFT JOIN late_payment_notifications lpn ON si.id = lpn.invoice_id
-           WHERE si.status = 'open'
-             AND si.due_date < ?
-             AND si.amount_due > 0
-             AND lpn.invoice_id IS NULL
-           ORDER BY si.due_date""",
-        (now,),
-    ).fetchall()
-    conn.close()
+    with connection() as conn:
+        rows = conn.execute(
+            f"""SELECT {INVOICE_COLUMNS}
+               FROM stripe_invoices si
+               {CUSTOMER_JOIN}
+               LEFT JOIN late_payment_notifications lpn ON si.id = lpn.invoice_id
+               WHERE si.status = 'open'
+                 AND si.due_date < ?
+                 AND si.amount_due > 0
+                 AND lpn.invoice_id IS NULL
+               ORDER BY si.due_date""",
+            (now,),
+        ).fetchall()
     return [dict(r) for r in rows]
 
 
 def get_all_late_invoices():
     """Return all open invoices past due (regardless of notification status)."""
     now = datetime.now(timezone.utc).strftime("%Y-%m-%d")
-    conn = get_connection()
-    rows = conn.execute(
-        """SELECT si.*, lpn.notify_email
-           FROM stripe_invoices si
-           LEFT JOIN late_payment_notifications lpn ON si.id = lpn.invoice_id
-           LEFT JOIN disregarded_invoices di ON si.id = di.invoice_id
-           WHERE si.status = 'open'
-             AND si.due_date < ?
-             AND si.amount_due > 0
-             AND di.invoice_id IS NULL
-           ORDER BY si.due_date""",
-        (now,),
-    ).fetchall()
-    conn.close()
+    with connection() as conn:
+        rows = conn.execute(
+            f"""SELECT {INVOICE_COLUMNS}, lpn.notify_email
+               FROM stripe_invoices si
+               {CUSTOMER_JOIN}
+               LEFT JOIN late_payment_notifications lpn ON si.id = lpn.invoice_id
+               LEFT JOIN disregarded_invoices di ON si.id = di.invoice_id
+               WHERE si.status = 'open'
+                 AND si.due_date < ?
+                 AND si.amount_due > 0
+                 AND di.invoice_id IS NULL
+               ORDER BY si.due_date""",
+            (now,),
+        ).fetchall()
     return [dict(r) for r in rows]
 
 
 def get_invoice_by_id(invoice_id: str):
-    conn = get_connection()
-    row = conn.execute(
-        "SELECT * FROM stripe_invoices WHERE id = ?", (invoice_id,)
-    ).fetchone()
-    conn.close()
+    with connection() as conn:
+        row = conn.execute(
+            f"SELECT {INVOICE_COLUMNS} FROM stripe_invoices si {CUSTOMER_JOIN} WHERE si.id = ?",
+            (invoice_id,),
+        ).fetchone()
     return dict(row) if row else None
 
 
 def mark_notified(invoice_id: str):
     now = datetime.now(timezone.utc).isoformat()
-    conn = get_connection()
-    conn.execute(
-        """INSERT INTO late_payment_notifications (invoice_id, notified_at)
-           VALUES (?, ?)
-           ON CONFLICT(invoice_id) DO NOTHING""",
-        (invoice_id, now),
-    )
-    conn.commit()
-    conn.close()
+    with connection() as conn:
+        conn.execute(
+            """INSERT INTO late_payment_notifications (invoice_id, notified_at)
+               VALUES (?, ?)
+               ON CONFLICT(invoice_id) DO NOTHING""",
+            (invoice_id, now),
+        )
 
 
 def mark_email_sent(invoice_id: str):
     now = datetime.now(timezone.utc).isoformat()
-    conn = get_connection()
-    conn.execute(
-        """UPDATE late_payment_notifications
-           SET email_sent = 1, email_sent_at = ?
-           WHERE invoice_id = ?""",
-        (now, invoice_id),
-    )
-    conn.commit()
-    conn.close()
+    with connection() as conn:
+        conn.execute(
+            """UPDATE late_payment_notifications
+               SET email_sent = 1, email_sent_at = ?
+               WHERE invoice_id = ?""",
+            (now, invoice_id),
+        )
     return now
 
 
 # --------------- Stripe Subscriptions ---------------
 
-def upsert_stripe_subscription(sub: dict):
-    conn = get_connection()
-    conn.execute(
-        """INSERT INTO stripe_subscriptions
-               (id, customer_id, customer_name, status, monthly_amount, currency,
-                current_period_start, current_period_end)
-           VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-           ON CONFLICT(id) DO UPDATE SET
-               customer_id=excluded.customer_id,
-               customer_name=excluded.customer_name,
-               status=excluded.status,
-               monthly_amount=excluded.monthly_amount,
-               currency=excluded.currency,
-               current_period_start=excluded.current_period_start,
-               current_period_end=excluded.current_period_end""",
-        (
-            sub["id"],
-            sub.get("customer_id"),
-            sub.get("customer_name"),
-            sub.get("status"),
-            sub["monthly_amount"],
-            sub.get("currency", "usd"),
-            sub.get("current_period_start"),
-            sub.get("current_period_end"),
-        ),
+_STRIPE_SUBSCRIPTION_UPSERT_SQL = """INSERT INTO stripe_subscriptions
+       (id, customer_id, customer_name, status, monthly_amount, currency,
+        current_period_start, current_period_end, observed_at)
+   VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+   ON CONFLICT(id) DO UPDATE SET
+       customer_id=excluded.customer_id,
+       customer_name=excluded.customer_name,
+       status=excluded.status,
+       monthly_amount=excluded.monthly_amount,
+       currency=excluded.currency,
+       current_period_start=excluded.current_period_start,
+       current_period_end=excluded.current_period_end,
+       observed_at=excluded.observed_at
+   WHERE excluded.observed_at >= COALESCE(stripe_subscriptions.observed_at, 0)"""
+
+
+def _stripe_subscription_params(sub: dict):
+    return (
+        sub["id"],
+        sub.get("customer_id"),
+        sub.get("customer_name"),
+        sub.get("status"),
+        sub["monthly_amount"],
+        sub.get("currency", "usd"),
+        sub.get("current_period_start"),
+        sub.get("current_period_end"),
+        sub.get("observed_at") or int(time.time()),
     )
-    conn.commit()
-    conn.close()
+
+
+def upsert_stripe_subscription(sub: dict):
+    upsert_stripe_subscriptions([sub])
+
+
+def upsert_stripe_subscriptions(subs, chunk_size: int = None):
+    """Upsert many Stripe subscriptions, one transaction per chunk. Returns row count."""
+    return _bulk_upsert(_STRIPE_SUBSCRIPTION_UPSERT_SQL, map(_stripe_subscription_params, subs), chunk_size)
 
 
 def _has_subscriptions():
     """Check if the stripe_subscriptions table has any active data."""
-    conn = get_connection()
-    row = conn.execute(
-        "SELECT COUNT(*) AS cnt FROM stripe_subscriptions WHERE status = 'active'"
-    ).fetchone()
-    conn.close()
+    with connection() as conn:
+        row = conn.execute(
+            "SELECT COUNT(*) AS cnt FROM stripe_subscriptions WHERE status = 'active'"
+        ).fetchone()
     return row["cnt"] > 0
 
 
-def _get_active_client_ids():
+def get_active_client_ids():
     """Return set of customer_ids that are currently active.
 
     Uses subscriptions table if populated, otherwise falls back to
     clients invoiced in the last 90 days.
     """
-    conn = get_connection()
-    if _has_subscriptions():
-        rows = conn.execute(
-            """SELECT DISTINCT customer_id FROM stripe_subscriptions
-               WHERE status = 'active' AND customer_id IS NOT NULL"""
-        ).fetchall()
-    else:
-        now = datetime.now(timezone.utc).strftime("%Y-%m-%d")
-        rows = conn.execute(
-            """SELECT DISTINCT customer_id FROM stripe_invoices
-               WHERE status IN ('paid', 'open')
-                 AND created_at >= date(?, '-90 days')
-                 AND customer_id IS NOT NULL""",
-            (now,),
-        ).fetchall()
-    conn.close()
+    with connection() as conn:
+        if _has_subscriptions():
+            rows = conn.execute(
+                """SELECT DISTINCT customer_id FROM stripe_subscriptions
+                   WHERE status = 'active' AND customer_id IS NOT NULL"""
+            ).fetchall()
+        else:
+            now = datetime.now(timezone.utc).strftime("%Y-%m-%d")
+            rows = conn.execute(
+                """SELECT DISTINCT customer_id FROM stripe_invoices
+                   WHERE status IN ('paid', 'open')
+                     AND created_at >= date(?, '-90 days')
+                     AND customer_id IS NOT NULL""",
+                (now,),
+            ).fetchall()
     return {r["customer_id"] for r in rows}
 
 
@@ -407,101 +506,89 @@ def get_active_subscriptions_by_client():
     Mercury direct payers are matched against Stripe client names to avoid
     double-counting clients who pay through both channels.
     """
-    conn = get_connection()
-    now = datetime.now(timezone.utc).strftime("%Y-%m-%d")
-    clients = {}  # {name: monthly_revenue}
+    with connection() as conn:
+        now = datetime.now(timezone.utc).strftime("%Y-%m-%d")
+        clients = {}  # {name: monthly_revenue}
+
+        # 1. Stripe clients
+        if _has_subscriptions():
+            # A customer not yet in stripe_customers (until the next customer
+            # sync) is named from its latest invoice, or failing that its id
+            rows = conn.execute(
+                """SELECT MAX(COALESCE(
+                           sc.name, sc.email, ss.customer_name,
+                           (SELECT si.customer_name FROM stripe_invoices si
+                            WHERE si.customer_id = ss.customer_id AND si.customer_name IS NOT NULL
+                            ORDER BY si.created_at DESC LIMIT 1),
+                           ss.customer_id
+                       )) AS customer_name,
+                       SUM(ss.monthly_amount) AS monthly_revenue
+                   FROM stripe_subscriptions ss
+                   LEFT JOIN stripe_customers sc ON sc.id = ss.customer_id
+                   WHERE ss.status = 'active'
+                   GROUP BY ss.customer_id"""
+            ).fetchall()
+            for r in rows:
+                if r["customer_name"] and r["monthly_revenue"] and r["monthly_revenue"] > 0:
+                    name = r["customer_name"]
+                    clients[name] = clients.get(name, 0) + r["monthly_revenue"]
+        else:
+            # Fallback: use each client's most recent invoice amount.
+            # Only include clients with an invoice created in the last 35 days
+            # (one billing cycle) to exclude recently churned clients.
+            rows = conn.execute(
+                f"""SELECT {CUSTOMER_NAME} AS customer_name, si.amount_due AS monthly_revenue
+                   FROM stripe_invoices si
+                   {CUSTOMER_JOIN}
+                   WHERE si.status IN ('paid', 'open')
+                     AND si.amount_due > 0
+                     AND {CUSTOMER_NAME} IS NOT NULL
+                     AND si.created_at >= date(?, '-35 days')
+                     AND si.id IN (
+                         SELECT id FROM stripe_invoices si2
+                         WHERE si2.customer_id = si.customer_id
+                           AND si2.status IN ('paid', 'open')
+                           AND si2.amount_due > 0
+                           AND si2.created_at >= date(?, '-35 days')
+                         ORDER BY si2.created_at DESC
+                         LIMIT 1
+                     )
+                   ORDER BY monthly_revenue DESC""",
+                (now, now),
+            ).fetchall()
+            for r in rows:
+                if r["monthly_revenue"] and r["monthly_revenue"] > 0:
+                    name = r["customer_name"]
+                    clients[name] = clients.get(name, 0) + r["monthly_revenue"]
+
+        # 2. Mercury direct payers (last 30 days only — keeps current clients, drops churned)
+        # Matched against the Stripe client names with the same rule as counterparty_customers
+        stripe_clients = StripeCustomerIndex(clients)
 
-    # 1. Stripe clients
-    if _has_subscriptions():
-        rows = conn.execute(
-            """SELECT customer_name,
-                   SUM(monthly_amount) AS monthly_revenue
-               FROM stripe_subscriptions
-               WHERE status = 'active'
-                 AND customer_name IS NOT NULL
-               GROUP BY customer_name"""
-        ).fetchall()
-        for r in rows:
-            if r["monthly_revenue"] and r["monthly_revenue"] > 0:
-                clients[r["customer_name"]] = r["monthly_revenue"]
-    else:
-        # Fallback: use each client's most recent invoice amount.
-        # Only include clients with an invoice created in the last 35 days
-        # (one billing cycle) to exclude recently churned clients.
         rows = conn.execute(
-            """SELECT customer_name, amount_due AS monthly_revenue
-               FROM stripe_invoices
-               WHERE status IN ('paid', 'open')
-                 AND amount_due > 0
-                 AND customer_name IS NOT NULL
-                 AND created_at >= date(?, '-35 days')
-                 AND id IN (
-                     SELECT id FROM stripe_invoices si2
-                     WHERE si2.customer_name = stripe_invoices.customer_name
-                       AND si2.status IN ('paid', 'open')
-                       AND si2.amount_due > 0
-                       AND si2.created_at >= date(?, '-35 days')
-                     ORDER BY si2.created_at DESC
-                     LIMIT 1
-                 )
-               ORDER BY monthly_revenue DESC""",
-            (now, now),
+            f"""SELECT counterparty_name,
+                   SUM(amount) AS total,
+                   COUNT(DISTINCT month) AS months_active
+               FROM mercury_transactions
+               WHERE amount > 0
+                 AND effective_date >= date(?, '-30 days')
+                 AND status NOT IN ('cancelled', 'failed')
+                 AND kind NOT IN ('creditCardTransaction', 'cardInternationalTransactionFee')
+                 {EXCLUDE_NON_REVENUE}
+                 {EXCLUDE_INTERNAL}
+               GROUP BY counterparty_name
+               HAVING total >= 1000""",
+            (now,),
         ).fetchall()
-        for r in rows:
-            if r["monthly_revenue"] and r["monthly_revenue"] > 0:
-                clients[r["customer_name"]] = r["monthly_revenue"]
-
-    # 2. Mercury direct payers (last 30 days only — keeps current clients, drops churned)
-    # Build a lowercase set of Stripe client names for dedup matching
-    stripe_names_lower = {name.lower() for name in clients}
 
-    rows = conn.execute(
-        f"""SELECT counterparty_name,
-               SUM(amount) AS total,
-               COUNT(DISTINCT strftime('%Y-%m', COALESCE(posted_date, created_at))) AS months_active
-           FROM mercury_transactions
-           WHERE amount > 0
-             AND COALESCE(posted_date, created_at) >= date(?, '-30 days')
-             AND status NOT IN ('cancelled', 'failed')
-             AND kind NOT IN ('creditCardTransaction', 'cardInternationalTransactionFee')
-             AND counterparty_name != 'STRIPE'
-             AND counterparty_name NOT LIKE 'Savings Interest%'
-             AND counterparty_name NOT LIKE '%Cashback%'
-             AND counterparty_name NOT LIKE '%ANTHEM%'
-             AND counterparty_name NOT LIKE '%Kaiser%'
-             AND counterparty_name NOT LIKE '%JP Morgan%'
-             {EXCLUDE_INTERNAL}
-           GROUP BY counterparty_name
-           HAVING total >= 1000""",
-        (now,),
-    ).fetchall()
+        for r in rows:
+            name = r["counterparty_name"]
+            if stripe_clients.match(name) is not None:
+                continue  # already counted through Stripe
 
-    for r in rows:
-        name = r["counterparty_name"]
-        # Skip if this client is already in Stripe (fuzzy match)
-        name_lower = name.lower().strip()
-        for suffix in [", inc.", ", inc", " inc.", " inc", " llc", " ltd"]:
-            if name_lower.endswith(suffix):
-                name_lower = name_lower[:-len(suffix)].strip()
-                break
-        already_in_stripe = False
-        for sn in stripe_names_lower:
-            sn_clean = sn
-            for suffix in [", inc.", ", inc", " inc.", " inc", " llc", " ltd"]:
-                if sn_clean.endswith(suffix):
-                    sn_clean = sn_clean[:-len(suffix)].strip()
-                    break
-            if name_lower == sn_clean or name_lower in sn_clean or sn_clean in name_lower:
-                already_in_stripe = True
-                break
-        if already_in_stripe:
-            continue
-
-        months = max(r["months_active"], 1)
-        monthly = round(r["total"] / months, 2)
-        clients[name] = monthly
-
-    conn.close()
+            months = max(r["months_active"], 1)
+            monthly = round(r["total"] / months, 2)
+            clients[name] = monthly
 
     # Sort by monthly revenue descending, excluding churned clients
     results = [
@@ -512,119 +599,49 @@ def get_active_subscriptions_by_client():
     return results
 
 
-# --------------- Stripe Analytics ---------------
-
-def get_avg_days_to_pay():
-    """Return average days to pay for active clients only.
-
-    Sorted slowest payers first (descending by avg_days).
-    Uses subscriptions for filtering if available, otherwise recent invoices.
-    """
-    active_ids = _get_active_client_ids()
-
-    if not active_ids:
-        return []
-
-    placeholders = ",".join("?" for _ in active_ids)
-    conn = get_connection()
-    rows = conn.execute(
-        f"""SELECT customer_name,
-               ROUND(AVG(julianday(paid_at) - julianday(created_at)), 1) AS avg_days,
-               COUNT(*) AS invoice_count
-           FROM stripe_invoices
-           WHERE status = 'paid'
-             AND paid_at IS NOT NULL
-             AND customer_name IS NOT NULL
-             AND customer_id IN ({placeholders})
-           GROUP BY customer_name
-           ORDER BY avg_days DESC""",
-        list(active_ids),
-    ).fetchall()
-    conn.close()
-    return [dict(r) for r in rows]
-
-
-def get_overall_avg_days_to_pay():
-    """Return overall average days to pay across all paid invoices."""
-    conn = get_connection()
-    row = conn.execute(
-        """SELECT ROUND(AVG(julianday(paid_at) - julianday(created_at)), 1) AS avg_days,
-               COUNT(*) AS total_invoices
-           FROM stripe_invoices
-           WHERE status = 'paid'
-             AND paid_at IS NOT NULL"""
-    ).fetchone()
-    conn.close()
-    return dict(row) if row else {"avg_days": 0, "total_invoices": 0}
-
-
-def get_revenue_by_client():
-    """Return total paid revenue by client, sorted by amount descending."""
-    conn = get_connection()
-    rows = conn.execute(
-        """SELECT customer_name,
-               SUM(amount_paid) AS total_revenue,
-               COUNT(*) AS invoice_count
-           FROM stripe_invoices
-           WHERE amount_paid > 0
-             AND customer_name IS NOT NULL
-           GROUP BY customer_name
-           ORDER BY total_revenue DESC"""
-    ).fetchall()
-    conn.close()
-    return [dict(r) for r in rows]
-
-
 # --------------- Spend by Category ---------------
 
 # Only successful transactions (exclude failed, cancelled, reversed)
 VALID_STATUS = "AND status = 'sent'"
 
-# Credit card itemized purchases (excludes balance payments to checking)
-CREDIT_CARD_FILTER = """
-    AND (kind = 'creditCardTransaction' OR kind = 'cardInternationalTransactionFee')
-    AND counterparty_name NOT LIKE 'Mercury Checking%'
-"""
-
-# Checking account labor payments (contractors, freelancers), excluding owners
-LABOR_FILTER = """
-    AND kind = 'outgoingPayment'
-    AND counterparty_name != 'Alex Fine'
-    AND counterparty_name != 'Alexander Yildirim'
-"""
-
-# Checking/savings account operational costs (salaries, taxes, labor via Payoneer)
-CHECKING_OPS_FILTER = f"""
-    AND kind = 'other'
-    AND (counterparty_name LIKE 'ADP%'
-         OR counterparty_name LIKE '%IRS%'
-         OR counterparty_name LIKE '%GEORGIA ITS TAX%'
-         OR counterparty_name LIKE '%GA DEPT OF LABOR%'
-         OR counterparty_name LIKE '%BOYLE TAX%'
-         OR counterparty_name LIKE '%SAVERITE TAX%'
-         OR counterparty_name LIKE '%STATE OF TN%'
-         OR counterparty_name LIKE '%DELAWARE CORP%'
-         OR counterparty_name LIKE '%Payoneer%'
-         OR counterparty_name LIKE '%GROWTHX%')
-    {EXCLUDE_INTERNAL}
-"""
-
-
-def _query_spend_rows(conn, extra_filter):
-    """Run a spend query with the given filter, returning rows with kind."""
+
+def _query_spend_rows(conn, month: str = None, category: str = None, start: str = None, end: str = None):
+    """Return monthly per-vendor spend rows for the tracked spend categories.
+
+    Tracked spend (credit card purchases, checking labor payments and
+    checking ops costs) and each vendor's category are classified at
+    ingest time — see models.counterparties.is_tracked_spend. Passing month
+    and category narrows the scan to that slice of idx_mercury_spend;
+    start/end limit it to a range of months.
+    """
+    filters, params = "", []
+    if category is not None:
+        filters += " AND spend_category = ?"
+        params.append(category)
+    if month is not None:
+        filters += " AND month = ?"
+        params.append(month)
+    if start is not None:
+        filters += " AND month >= ?"
+        params.append(start)
+    if end is not None:
+        filters += " AND month <= ?"
+        params.append(end)
     return conn.execute(
         f"""SELECT
-               strftime('%Y-%m', COALESCE(posted_date, created_at)) AS month,
+               month,
+               spend_category,
                counterparty_name,
-               kind,
                SUM(ABS(amount)) AS total
            FROM mercury_transactions
-           WHERE amount < 0
-             AND COALESCE(posted_date, created_at) IS NOT NULL
+           WHERE is_tracked_spend = 1
+             AND amount < 0
+             AND month IS NOT NULL
+             {filters}
              {VALID_STATUS}
-             {extra_filter}
-           GROUP BY month, counterparty_name, kind
-           ORDER BY month, total DESC"""
+           GROUP BY month, spend_category, counterparty_name
+           ORDER BY month, total DESC""",
+        params,
     ).fetchall()
 
 
@@ -638,101 +655,96 @@ def get_monthly_spend_by_category():
 
     Returns dict: {month: {category: amount}}.
     """
-    conn = get_connection()
-
-    all_rows = []
-    all_rows.extend(_query_spend_rows(conn, CREDIT_CARD_FILTER))
-    all_rows.extend(_query_spend_rows(conn, LABOR_FILTER))
-    all_rows.extend(_query_spend_rows(conn, CHECKING_OPS_FILTER))
-    conn.close()
+    with connection() as conn:
+        rows = conn.execute(
+            "SELECT month, category, total FROM monthly_spend_facts ORDER BY month"
+        ).fetchall()
 
     result = {}
-    for r in all_rows:
+    for r in rows:
         month = r["month"]
-        category = categorize_vendor(r["counterparty_name"], r["kind"])
         if month not in result:
             result[month] = {c: 0 for c in SPEND_CATEGORIES}
-        result[month][category] = result[month].get(category, 0) + r["total"]
+        result[month][r["category"]] = result[month].get(r["category"], 0) + r["total"]
 
     return result
 
 
-def get_monthly_spend_details():
-    """Return monthly spending with vendor-level detail for hover info.
+def get_period_spend_by_category(start: str, end: str, granularity: str = "month"):
+    """Return {period: {category: amount}} for months start..end, grouped from monthly_spend_facts."""
+    with connection() as conn:
+        rows = conn.execute(
+            f"""SELECT {PERIOD_EXPRESSIONS[granularity]} AS period, category, SUM(total) AS total
+                FROM monthly_spend_facts
+                WHERE month >= ? AND month <= ?
+                GROUP BY period, category""",
+            (start, end),
+        ).fetchall()
 
-    Combines credit card, labor, and checking ops transactions.
-    Returns dict: {month: {category: [(vendor, amount), ...]}}.
-    """
-    conn = get_connection()
+    result = {}
+    for r in rows:
+        period = result.setdefault(r["period"], {c: 0 for c in SPEND_CATEGORIES})
+        period[r["category"]] = period.get(r["category"], 0) + r["total"]
+    return result
 
-    all_rows = []
-    all_rows.extend(_query_spend_rows(conn, CREDIT_CARD_FILTER))
-    all_rows.extend(_query_spend_rows(conn, LABOR_FILTER))
-    all_rows.extend(_query_spend_rows(conn, CHECKING_OPS_FILTER))
-    conn.close()
 
-    result = {}
-    for r in all_rows:
-        month = r["month"]
-        category = categorize_vendor(r["counterparty_name"], r["kind"])
-        if month not in result:
-            result[month] = {c: [] for c in SPEND_CATEGORIES}
-        result[month].setdefault(category, []).append(
-            (r["counterparty_name"], r["total"])
-        )
+def get_spend_details(month: str, category: str):
+    """Return [(vendor, amount), ...] for one month and spend category, largest first.
 
-    return result
+    Reads only that month/category through idx_mercury_spend, so the
+    drill-down costs the same however much history is stored.
+    """
+    with connection() as conn:
+        rows = _query_spend_rows(conn, month=month, category=category)
+    return [(r["counterparty_name"], r["total"]) for r in rows]
 
 
 # --------------- Open Invoices ---------------
 
 def get_open_invoices_for_client(customer_name: str):
     """Return all open invoices for a specific client, with email_sent status."""
-    conn = get_connection()
-    rows = conn.execute(
-        """SELECT si.id, si.number, si.customer_email, si.amount_due,
-                  si.due_date, si.hosted_invoice_url,
-                  COALESCE(lpn.email_sent, 0) AS email_sent,
-                  lpn.email_sent_at,
-                  lpn.notify_email
-           FROM stripe_invoices si
-           LEFT JOIN late_payment_notifications lpn ON si.id = lpn.invoice_id
-           LEFT JOIN disregarded_invoices di ON si.id = di.invoice_id
-           WHERE si.status = 'open'
-             AND si.amount_due > 0
-             AND si.customer_name = ?
-             AND di.invoice_id IS NULL
-           ORDER BY si.due_date""",
-        (customer_name,),
-    ).fetchall()
-    conn.close()
+    with connection() as conn:
+        rows = conn.execute(
+            f"""SELECT si.id, si.number, {CUSTOMER_EMAIL} AS customer_email, si.amount_due,
+                      si.due_date, si.hosted_invoice_url,
+                      COALESCE(lpn.email_sent, 0) AS email_sent,
+                      lpn.email_sent_at,
+                      lpn.notify_email
+               FROM stripe_invoices si
+               {CUSTOMER_JOIN}
+               LEFT JOIN late_payment_notifications lpn ON si.id = lpn.invoice_id
+               LEFT JOIN disregarded_invoices di ON si.id = di.invoice_id
+               WHERE si.status = 'open'
+                 AND si.amount_due > 0
+                 AND {CUSTOMER_NAME} = ?
+                 AND di.invoice_id IS NULL
+               ORDER BY si.due_date""",
+            (customer_name,),
+        ).fetchall()
     return [dict(r) for r in rows]
 
 
 def disregard_invoice(invoice_id: str):
     """Mark an invoice as disregarded so it no longer appears in the dashboard."""
     now = datetime.now(timezone.utc).isoformat()
-    conn = get_connection()
-    conn.execute(
-        "INSERT OR REPLACE INTO disregarded_invoices (invoice_id, disregarded_at) VALUES (?, ?)",
-        (invoice_id, now),
-    )
-    conn.commit()
-    conn.close()
+    with connection() as conn:
+        conn.execute(
+            "INSERT OR REPLACE INTO disregarded_invoices (invoice_id, disregarded_at) VALUES (?, ?)",
+            (invoice_id, now),
+        )
+        bump_data_generation()
 
 
 def upsert_notify_email(invoice_id: str, email: str):
     """Set or update the notification email override for an invoice."""
     now = datetime.now(timezone.utc).isoformat()
-    conn = get_connection()
-    conn.execute(
-        """INSERT INTO late_payment_notifications (invoice_id, notified_at, notify_email)
-           VALUES (?, ?, ?)
-           ON CONFLICT(invoice_id) DO UPDATE SET notify_email = excluded.notify_email""",
-        (invoice_id, now, email),
-    )
-    conn.commit()
-    conn.close()
+    with connection() as conn:
+        conn.execute(
+            """INSERT INTO late_payment_notifications (invoice_id, notified_at, notify_email)
+               VALUES (?, ?, ?)
+               ON CONFLICT(invoice_id) DO UPDATE SET notify_email = excluded.notify_email""",
+            (invoice_id, now, email),
+        )
 
 
 # Manually verified invoiced totals by month. These override auto-calculated
@@ -753,11 +765,13 @@ MANUAL_INVOICED_OVERRIDES = {
 }
 
 
+@_memoize_per_generation
 def get_monthly_invoiced():
     """Return monthly invoiced totals as {month: amount}.
 
     Uses MANUAL_INVOICED_OVERRIDES for months where the auto-calculation is
-    known to be inaccurate. Remaining months are auto-calculated by combining:
+    known to be inaccurate. Remaining months come from monthly_facts.invoiced,
+    which models.facts computes by combining:
     1. Stripe invoices: sum of amount_due grouped by created_at month (non-void).
     2. Mercury direct payers: monthly inflows from counterparties that are NOT
        already covered by Stripe invoices (fuzzy name-matched to deduplicate).
@@ -765,79 +779,12 @@ def get_monthly_invoiced():
     Mercury "STRIPE" entries (batch payouts from Stripe-processed payments) are
     excluded — those are already captured via Stripe invoice amount_due.
     """
-    conn = get_connection()
-
-    # 1. All distinct Stripe customer names for dedup
-    stripe_customer_rows = conn.execute(
-        "SELECT DISTINCT customer_name FROM stripe_invoices WHERE customer_name IS NOT NULL"
-    ).fetchall()
-    stripe_names = {r["customer_name"] for r in stripe_customer_rows}
-
-    # 2. Stripe invoiced by month (when invoiced, not when paid)
-    stripe_rows = conn.execute(
-        """SELECT strftime('%Y-%m', created_at) AS month, SUM(amount_due) AS total
-           FROM stripe_invoices
-           WHERE status != 'void'
-             AND amount_due > 0
-             AND created_at IS NOT NULL
-           GROUP BY month
-           ORDER BY month"""
-    ).fetchall()
-    stripe_by_month = {r["month"]: r["total"] for r in stripe_rows}
-
-    # 3. Mercury inflows per counterparty per month — exclude STRIPE payout batches
-    #    and non-revenue items (interest, cashback, insurance, internals, CC charges)
-    mercury_rows = conn.execute(
-        f"""SELECT
-               strftime('%Y-%m', COALESCE(posted_date, created_at)) AS month,
-               counterparty_name,
-               SUM(amount) AS total
-           FROM mercury_transactions
-           WHERE amount > 0
-             AND COALESCE(posted_date, created_at) IS NOT NULL
-             AND status NOT IN ('cancelled', 'failed')
-             AND kind NOT IN ('creditCardTransaction', 'cardInternationalTransactionFee')
-             AND counterparty_name != 'STRIPE'
-             AND counterparty_name NOT LIKE 'Savings Interest%'
-             AND counterparty_name NOT LIKE '%Cashback%'
-             AND counterparty_name NOT LIKE '%ANTHEM%'
-             AND counterparty_name NOT LIKE '%Kaiser%'
-             AND counterparty_name NOT LIKE '%JP Morgan%'
-             {EXCLUDE_INTERNAL}
-           GROUP BY month, counterparty_name
-           ORDER BY month"""
-    ).fetchall()
-    conn.close()
-
-    # Build normalized Stripe name set for fuzzy matching (same logic as
-    # get_active_subscriptions_by_client to stay consistent)
-    def _normalize(name):
-        n = name.lower().strip()
-        for suffix in [", inc.", ", inc", " inc.", " inc", " llc", " ltd"]:
-            if n.endswith(suffix):
-                n = n[:-len(suffix)].strip()
-                break
-        return n
-
-    stripe_names_normalized = {_normalize(n) for n in stripe_names}
-
-    # 4. Sum Mercury direct-payer inflows for counterparties NOT in Stripe
-    mercury_direct_by_month = {}
-    for r in mercury_rows:
-        name = r["counterparty_name"]
-        if not name:
-            continue
-        norm = _normalize(name)
-        # Skip if this counterparty matches a Stripe client name
-        if any(norm == sn or norm in sn or sn in norm for sn in stripe_names_normalized):
-            continue
-        month = r["month"]
-        mercury_direct_by_month[month] = mercury_direct_by_month.get(month, 0) + r["total"]
+    with connection() as conn:
+        rows = conn.execute(
+            "SELECT month, invoiced FROM monthly_facts WHERE invoiced > 0"
+        ).fetchall()
 
-    # 5. Merge: Stripe invoiced + Mercury direct payer inflows
-    all_months = set(stripe_by_month) | set(mercury_direct_by_month) | set(MANUAL_INVOICED_OVERRIDES)
-    result = {m: stripe_by_month.get(m, 0) + mercury_direct_by_month.get(m, 0)
-              for m in all_months}
+    result = {r["month"]: r["invoiced"] for r in rows}
     # Apply manual overrides — these take precedence over auto-calculated values
     result.update(MANUAL_INVOICED_OVERRIDES)
     return result
@@ -854,64 +801,36 @@ def get_last_month_invoiced():
 
 def get_invoiced_breakdown(month: str):
     """Return detailed per-invoice breakdown of invoiced amounts for a given month (YYYY-MM)."""
-    conn = get_connection()
-
-    stripe_rows = conn.execute(
-        """SELECT customer_name, number, amount_due, status
-           FROM stripe_invoices
-           WHERE status != 'void'
-             AND amount_due > 0
-             AND strftime('%Y-%m', created_at) = ?
-           ORDER BY amount_due DESC""",
-        (month,),
-    ).fetchall()
-
-    stripe_customer_rows = conn.execute(
-        "SELECT DISTINCT customer_name FROM stripe_invoices WHERE customer_name IS NOT NULL"
-    ).fetchall()
-    stripe_names = {r["customer_name"] for r in stripe_customer_rows}
+    with connection() as conn:
+        stripe_rows = conn.execute(
+            f"""SELECT {CUSTOMER_NAME} AS customer_name, si.number, si.amount_due, si.status
+               FROM stripe_invoices si
+               {CUSTOMER_JOIN}
+               WHERE si.status != 'void'
+                 AND si.amount_due > 0
+                 AND strftime('%Y-%m', si.created_at) = ?
+               ORDER BY si.amount_due DESC""",
+            (month,),
+        ).fetchall()
 
-    mercury_rows = conn.execute(
-        f"""SELECT counterparty_name, SUM(amount) AS total
-           FROM mercury_transactions
-           WHERE amount > 0
-             AND COALESCE(posted_date, created_at) IS NOT NULL
-             AND status NOT IN ('cancelled', 'failed')
-             AND kind NOT IN ('creditCardTransaction', 'cardInternationalTransactionFee')
-             AND counterparty_name != 'STRIPE'
-             AND counterparty_name NOT LIKE 'Savings Interest%'
-             AND counterparty_name NOT LIKE '%Cashback%'
-             AND counterparty_name NOT LIKE '%ANTHEM%'
-             AND counterparty_name NOT LIKE '%Kaiser%'
-             AND counterparty_name NOT LIKE '%JP Morgan%'
-             AND strftime('%Y-%m', COALESCE(posted_date, created_at)) = ?
-             {EXCLUDE_INTERNAL}
-           GROUP BY counterparty_name
-           ORDER BY total DESC""",
-        (month,),
-    ).fetchall()
-    conn.close()
-
-    def _normalize(name):
-        n = name.lower().strip()
-        for suffix in [", inc.", ", inc", " inc.", " inc", " llc", " ltd"]:
-            if n.endswith(suffix):
-                n = n[:-len(suffix)].strip()
-                break
-        return n
-
-    stripe_names_normalized = {_normalize(n) for n in stripe_names}
-
-    mercury_direct = []
-    for r in mercury_rows:
-        name = r["counterparty_name"]
-        if not name:
-            continue
-        norm = _normalize(name)
-        if any(norm == sn or norm in sn or sn in norm for sn in stripe_names_normalized):
-            continue
-        mercury_direct.append({"counterparty": name, "amount": r["total"]})
+        # Direct payers: counterparties not resolved to a Stripe customer
+        mercury_rows = conn.execute(
+            f"""SELECT mt.counterparty_name, SUM(mt.amount) AS total
+               FROM mercury_transactions mt
+               JOIN counterparty_customers cc ON cc.counterparty_name = mt.counterparty_name
+               WHERE mt.amount > 0
+                 AND mt.status NOT IN ('cancelled', 'failed')
+                 AND mt.kind NOT IN ('creditCardTransaction', 'cardInternationalTransactionFee')
+                 {EXCLUDE_NON_REVENUE}
+                 AND mt.month = ?
+                 {EXCLUDE_INTERNAL}
+                 AND cc.stripe_customer_name IS NULL
+               GROUP BY mt.counterparty_name
+               ORDER BY total DESC""",
+            (month,),
+        ).fetchall()
 
+    mercury_direct = [{"counterparty": r["counterparty_name"], "amount": r["total"]} for r in mercury_rows]
     stripe_invoices = [dict(r) for r in stripe_rows]
     stripe_total = sum(r["amount_due"] for r in stripe_rows)
     mercury_total = sum(r["amount"] for r in mercury_direct)
@@ -929,77 +848,307 @@ def get_invoiced_breakdown(month: str):
 def get_open_invoices_by_client():
     """Return open invoices grouped by client, split into outstanding vs overdue."""
     now = datetime.now(timezone.utc).strftime("%Y-%m-%d")
-    conn = get_connection()
-    rows = conn.execute(
-        """SELECT si.customer_name,
-               SUM(CASE WHEN si.due_date >= ? OR si.due_date IS NULL THEN si.amount_due ELSE 0 END) AS outstanding,
-               SUM(CASE WHEN si.due_date < ? THEN si.amount_due ELSE 0 END) AS overdue
-           FROM stripe_invoices si
-           LEFT JOIN disregarded_invoices di ON si.id = di.invoice_id
-           WHERE si.status = 'open'
-             AND si.amount_due > 0
-             AND si.customer_name IS NOT NULL
-             AND di.invoice_id IS NULL
-           GROUP BY si.customer_name
-           ORDER BY (outstanding + overdue) DESC""",
-        (now, now),
-    ).fetchall()
-    conn.close()
+    with connection() as conn:
+        rows = conn.execute(
+            f"""SELECT MAX({CUSTOMER_NAME}) AS customer_name,
+                   SUM(CASE WHEN si.due_date >= ? OR si.due_date IS NULL THEN si.amount_due ELSE 0 END) AS outstanding,
+                   SUM(CASE WHEN si.due_date < ? THEN si.amount_due ELSE 0 END) AS overdue
+               FROM stripe_invoices si
+               {CUSTOMER_JOIN}
+               LEFT JOIN disregarded_invoices di ON si.id = di.invoice_id
+               WHERE si.status = 'open'
+                 AND si.amount_due > 0
+                 AND {CUSTOMER_NAME} IS NOT NULL
+                 AND di.invoice_id IS NULL
+               GROUP BY si.customer_id
+               ORDER BY (outstanding + overdue) DESC""",
+            (now, now),
+        ).fetchall()
     return [dict(r) for r in rows]
 
 
 # --------------- Sync Log ---------------
 
-def log_sync(source: str, records_count: int, status: str = "success", error_message: str = None):
+def log_sync(source: str, records_count: int, status: str = "success", error_message: str = None,
+             duration_ms: int = None):
     now = datetime.now(timezone.utc).isoformat()
-    conn = get_connection()
-    conn.execute(
-        """INSERT INTO sync_log (source, synced_at, records_count, status, error_message)
-           VALUES (?, ?, ?, ?, ?)""",
-        (source, now, records_count, status, error_message),
-    )
-    conn.commit()
-    conn.close()
+    with connection() as conn:
+        conn.execute(
+            """INSERT INTO sync_log (source, synced_at, records_count, status, error_message, duration_ms)
+               VALUES (?, ?, ?, ?, ?, ?)""",
+            (source, now, records_count, status, error_message, duration_ms),
+        )
+
+
+# --------------- Data Generation ---------------
+# A counter in app_state that advances whenever synced data changes. Caches
+# of derived views (rendered charts) key on it instead of on wall-clock TTLs.
+
+DATA_GENERATION_KEY = "data_generation"
+
+
+def get_data_generation():
+    """Return (generation, updated_at); (0, None) before the first sync."""
+    with connection() as conn:
+        row = conn.execute(
+            "SELECT value, updated_at FROM app_state WHERE key = ?",
+            (DATA_GENERATION_KEY,),
+        ).fetchone()
+    if not row:
+        return 0, None
+    return int(row["value"]), row["updated_at"]
+
+
+def bump_data_generation():
+    """Advance the data generation and return the new value."""
+    now = datetime.now(timezone.utc).isoformat()
+    with connection() as conn:
+        conn.execute(
+            """INSERT INTO app_state (key, value, updated_at)
+               VALUES (?, '1', ?)
+               ON CONFLICT(key) DO UPDATE SET
+                   value = CAST(value AS INTEGER) + 1,
+                   updated_at = excluded.updated_at""",
+            (DATA_GENERATION_KEY, now),
+        )
+        row = conn.execute(
+            "SELECT value FROM app_state WHERE key = ?", (DATA_GENERATION_KEY,)
+        ).fetchone()
+    return int(row["value"])
+
+
+# --------------- Monthly Facts ---------------
+
+def update_monthly_facts(full: bool = False):
+    """Re-aggregate months changed since the last refresh (all months if full)."""
+    with connection() as conn:
+        return refresh_monthly_facts(conn, full)
+
+
+# --------------- Sync Cursors ---------------
+
+def get_sync_cursor(source: str, cursor_key: str):
+    """Return the stored cursor row for a sync source/key, or None."""
+    with connection() as conn:
+        row = conn.execute(
+            """SELECT cursor_value, last_full_sync_at, updated_at
+               FROM sync_cursors
+               WHERE source = ? AND cursor_key = ?""",
+            (source, cursor_key),
+        ).fetchone()
+    return dict(row) if row else None
+
+
+def set_sync_cursor(source: str, cursor_key: str, cursor_value: str, full_sync: bool = False):
+    """Store the high-water mark for a sync source/key.
+
+    When full_sync is True the last_full_sync_at timestamp is also bumped;
+    otherwise the previous full-sync timestamp is preserved.
+    """
+    now = datetime.now(timezone.utc).isoformat()
+    with connection() as conn:
+        conn.execute(
+            """INSERT INTO sync_cursors (source, cursor_key, cursor_value, last_full_sync_at, updated_at)
+               VALUES (?, ?, ?, ?, ?)
+               ON CONFLICT(source, cursor_key) DO UPDATE SET
+                   cursor_value=excluded.cursor_value,
+                   last_full_sync_at=COALESCE(excluded.last_full_sync_at, sync_cursors.last_full_sync_at),
+                   updated_at=excluded.updated_at""",
+            (source, cursor_key, cursor_value, now if full_sync else None, now),
+        )
+
+
+# --------------- Backfill Checkpoints ---------------
+
+def get_backfill_shards(source: str):
+    """Return the checkpoint rows for a backfill source, keyed by (account_id, start_date, end_date)."""
+    with connection() as conn:
+        rows = conn.execute(
+            """SELECT account_id, start_date, end_date, status, rows, high_water, error, updated_at
+               FROM backfill_shards
+               WHERE source = ?""",
+            (source,),
+        ).fetchall()
+    return {(r["account_id"], r["start_date"], r["end_date"]): dict(r) for r in rows}
+
+
+def set_backfill_shard(source: str, account_id: str, start_date: str, end_date: str, status: str,
+                       rows: int = 0, high_water: str = None, error: str = None):
+    """Record the outcome of one backfill shard."""
+    now = datetime.now(timezone.utc).isoformat()
+    with connection() as conn:
+        conn.execute(
+            """INSERT INTO backfill_shards
+                   (source, account_id, start_date, end_date, status, rows, high_water, error, updated_at)
+               VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+               ON CONFLICT(source, account_id, start_date, end_date) DO UPDATE SET
+                   status=excluded.status,
+                   rows=excluded.rows,
+                   high_water=excluded.high_water,
+                   error=excluded.error,
+                   updated_at=excluded.updated_at""",
+            (source, account_id, start_date, end_date, status, rows, high_water, error, now),
+        )
+
+
+def clear_backfill_shards(source: str):
+    """Forget all checkpoints for a backfill source so the next run starts over."""
+    with connection() as conn:
+        conn.execute("DELETE FROM backfill_shards WHERE source = ?", (source,))
+
+
+# --------------- Sync Jobs ---------------
+
+def claim_sync_lock(job_id: str, trigger: str, owner: str, lease_seconds: int, name: str = "sync"):
+    """Take the named sync lock for a new job, or report the job already holding it.
+
+    Runs under BEGIN IMMEDIATE so concurrent claims from any process are
+    serialized. An expired lock (its holder died) is taken over and that
+    job is marked abandoned. Returns None when the lock was claimed and the
+    job row created, otherwise the id of the active job.
+    """
+    now = datetime.now(timezone.utc)
+    now_iso = now.isoformat()
+    with connection() as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        row = conn.execute(
+            "SELECT job_id, expires_at FROM sync_locks WHERE name = ?", (name,)
+        ).fetchone()
+        if row and row["expires_at"] > now_iso:
+            return row["job_id"]
+        if row:
+            conn.execute(
+                """UPDATE sync_jobs SET status = 'error', error = 'abandoned', finished_at = ?
+                   WHERE id = ? AND status = 'running'""",
+                (now_iso, row["job_id"]),
+            )
+        expires_at = (now + timedelta(seconds=lease_seconds)).isoformat()
+        conn.execute(
+            """INSERT OR REPLACE INTO sync_locks (name, job_id, owner, acquired_at, expires_at)
+               VALUES (?, ?, ?, ?, ?)""",
+            (name, job_id, owner, now_iso, expires_at),
+        )
+        conn.execute(
+            "INSERT INTO sync_jobs (id, trigger, status, requested_at) VALUES (?, ?, 'running', ?)",
+            (job_id, trigger, now_iso),
+        )
+    return None
+
+
+def release_sync_lock(job_id: str, name: str = "sync"):
+    with connection() as conn:
+        conn.execute("DELETE FROM sync_locks WHERE name = ? AND job_id = ?", (name, job_id))
+
+
+def update_sync_job(job_id: str, status: str = None, result: dict = None, error: str = None):
+    """Record progress on a sync job; a terminal status also stamps finished_at."""
+    finished_at = datetime.now(timezone.utc).isoformat() if status and status != "running" else None
+    with connection() as conn:
+        conn.execute(
+            """UPDATE sync_jobs SET
+                   status = COALESCE(?, status),
+                   result = COALESCE(?, result),
+                   error = COALESCE(?, error),
+                   finished_at = COALESCE(?, finished_at)
+               WHERE id = ?""",
+            (status, json.dumps(result) if result is not None else None, error, finished_at, job_id),
+        )
+
+
+def get_sync_job(job_id: str):
+    with connection() as conn:
+        row = conn.execute("SELECT * FROM sync_jobs WHERE id = ?", (job_id,)).fetchone()
+    if not row:
+        return None
+    job = dict(row)
+    job["result"] = json.loads(job["result"]) if job["result"] else None
+    return job
 
 
 # --------------- Summary helpers ---------------
 
-def get_period_summary(start_date: str, end_date: str):
-    """Get financial summary for a date range."""
-    conn = get_connection()
-    mercury = conn.execute(
-        f"""SELECT
-               SUM(CASE WHEN amount > 0
-                        AND kind NOT IN ('creditCardTransaction', 'cardInternationalTransactionFee')
-                        {EXCLUDE_INTERNAL} THEN amount ELSE 0 END) AS inflows,
-               SUM(CASE WHEN amount < 0 {EXCLUDE_INTERNAL} THEN ABS(amount) ELSE 0 END) AS outflows
-           FROM mercury_transactions
-           WHERE COALESCE(posted_date, created_at) BETWEEN ? AND ?
-             AND status NOT IN ('cancelled', 'failed')""",
-        (start_date, end_date),
-    ).fetchone()
+# --------------- Daily Ledger ---------------
 
-    late_count = conn.execute(
-        """SELECT COUNT(*) AS cnt
-           FROM stripe_invoices
-           WHERE status = 'open'
-             AND due_date < ?
-             AND amount_due > 0""",
-        (end_date,),
+def _ledger_before(conn, day: str):
+    """Running Mercury totals over all days before day."""
+    row = conn.execute(
+        """SELECT cum_inflows, cum_outflows, cum_owner_distributions
+           FROM daily_ledger
+           WHERE day < ?
+           ORDER BY day DESC
+           LIMIT 1""",
+        (day,),
     ).fetchone()
+    return tuple(row) if row else (0, 0, 0)
 
-    top_customers = conn.execute(
-        """SELECT customer_name, SUM(amount_paid) AS total_paid
-           FROM stripe_invoices
-           WHERE created_at BETWEEN ? AND ?
-             AND amount_paid > 0
-           GROUP BY customer_name
-           ORDER BY total_paid DESC
-           LIMIT 5""",
-        (start_date, end_date),
+
+def _ledger_totals(conn, start_date: str, end_date: str):
+    """Mercury inflows/outflows/owner distributions for days start_date <= day < end_date.
+
+    Two primary-key lookups on daily_ledger, whatever the length of the range.
+    """
+    end, start = _ledger_before(conn, end_date), _ledger_before(conn, start_date)
+    inflows, outflows, distributions = (round(e - s, 2) for e, s in zip(end, start))
+    return {"inflows": inflows, "outflows": outflows, "owner_distributions": distributions}
+
+
+def _ledger_category_totals(conn, start_date: str, end_date: str):
+    """[(spend_category, outflows), ...] for days start_date <= day < end_date, largest first."""
+    rows = conn.execute(
+        """SELECT c.category,
+                  COALESCE((SELECT cum_spend FROM daily_ledger_categories x
+                            WHERE x.category = c.category AND x.day < ?
+                            ORDER BY x.day DESC LIMIT 1), 0)
+                  - COALESCE((SELECT cum_spend FROM daily_ledger_categories x
+                              WHERE x.category = c.category AND x.day < ?
+                              ORDER BY x.day DESC LIMIT 1), 0) AS total
+           FROM (SELECT DISTINCT category FROM daily_ledger_categories) c""",
+        (end_date, start_date),
     ).fetchall()
+    totals = [(r["category"] or None, round(r["total"], 2)) for r in rows]
+    return sorted((t for t in totals if t[1] > 0), key=lambda t: t[1], reverse=True)
 
-    conn.close()
+
+def get_ledger_summary(start_date: str, end_date: str):
+    """Return Mercury totals and spend by category for start_date..end_date (YYYY-MM-DD, inclusive)."""
+    next_day = (datetime.strptime(end_date, "%Y-%m-%d") + timedelta(days=1)).strftime("%Y-%m-%d")
+    with connection() as conn:
+        totals = _ledger_totals(conn, start_date, next_day)
+        categories = _ledger_category_totals(conn, start_date, next_day)
+    return {
+        "start": start_date,
+        "end": end_date,
+        **totals,
+        "net": round(totals["inflows"] - totals["outflows"], 2),
+        "categories": [{"category": c, "total": t} for c, t in categories],
+    }
+
+
+def get_period_summary(start_date: str, end_date: str):
+    """Get financial summary for a date range."""
+    with connection() as conn:
+        mercury = _ledger_totals(conn, start_date, end_date)
+
+        late_count = conn.execute(
+            """SELECT COUNT(*) AS cnt
+               FROM stripe_invoices
+               WHERE status = 'open'
+                 AND due_date < ?
+                 AND amount_due > 0""",
+            (end_date,),
+        ).fetchone()
+
+        top_customers = conn.execute(
+            f"""SELECT MAX({CUSTOMER_NAME}) AS customer_name, SUM(si.amount_paid) AS total_paid
+               FROM stripe_invoices si
+               {CUSTOMER_JOIN}
+               WHERE si.created_at BETWEEN ? AND ?
+                 AND si.amount_paid > 0
+               GROUP BY si.customer_id
+               ORDER BY total_paid DESC
+               LIMIT 5""",
+            (start_date, end_date),
+        ).fetchall()
     return {
         "inflows": mercury["inflows"] or 0,
         "outflows": mercury["outflows"] or 0,
@@ -1010,228 +1159,171 @@ def get_period_summary(start_date: str, end_date: str):
 
 def get_ytd_owner_distributions():
     """Return total distributed to owners in 2026."""
-    conn = get_connection()
-    row = conn.execute(
-        f"""SELECT COALESCE(SUM(ABS(amount)), 0) AS total
-           FROM mercury_transactions
-           WHERE amount < 0
-             AND COALESCE(posted_date, created_at) >= '2026-01-01'
-             AND status NOT IN ('cancelled', 'failed')
-             AND {OWNER_DISTRIBUTIONS}""",
-    ).fetchone()
-    conn.close()
+    with connection() as conn:
+        row = conn.execute(
+            """SELECT COALESCE(SUM(owner_distributions), 0) AS total
+               FROM monthly_facts
+               WHERE month >= '2026-01'"""
+        ).fetchone()
     return row["total"] or 0
 
 
 def get_ytd_outflows():
     """Return total money out in 2026 via Mercury outflows (includes CC charges)."""
-    conn = get_connection()
-    row = conn.execute(
-        f"""SELECT COALESCE(SUM(ABS(amount)), 0) AS total
-           FROM mercury_transactions
-           WHERE amount < 0
-             AND COALESCE(posted_date, created_at) >= '2026-01-01'
-             AND status NOT IN ('cancelled', 'failed')
-             {EXCLUDE_INTERNAL}""",
-    ).fetchone()
-    conn.close()
+    with connection() as conn:
+        row = conn.execute(
+            """SELECT COALESCE(SUM(outflows), 0) AS total
+               FROM monthly_facts
+               WHERE month >= '2026-01'"""
+        ).fetchone()
     return row["total"] or 0
 
 
 def get_ytd_collected():
     """Return total collected in 2026 via Mercury inflows (includes Stripe payouts)."""
-    conn = get_connection()
-    row = conn.execute(
-        f"""SELECT COALESCE(SUM(amount), 0) AS total
-           FROM mercury_transactions
-           WHERE amount > 0
-             AND COALESCE(posted_date, created_at) >= '2026-01-01'
-             AND status NOT IN ('cancelled', 'failed')
-             AND kind NOT IN ('creditCardTransaction', 'cardInternationalTransactionFee')
-             {EXCLUDE_INTERNAL}""",
-    ).fetchone()
-    conn.close()
+    with connection() as conn:
+        row = conn.execute(
+            """SELECT COALESCE(SUM(inflows), 0) AS total
+               FROM monthly_facts
+               WHERE month >= '2026-01'"""
+        ).fetchone()
     return row["total"] or 0
 
 
-def get_monthly_collected_history(months=6):
-    """Return collected totals for each of the last N complete months via Mercury inflows."""
-    now = datetime.now(timezone.utc)
-    results = []
-    for i in range(1, months + 1):
-        # First day of the month (i months ago)
-        m = now.month - i
-        y = now.year
-        while m <= 0:
-            m += 12
-            y -= 1
-        start = datetime(y, m, 1).strftime("%Y-%m-%d")
-        month_label = datetime(y, m, 1).strftime("%Y-%m")
-
-        # First day of the next month (end boundary)
-        nm = m + 1
-        ny = y
-        if nm > 12:
-            nm = 1
-            ny += 1
-        end = datetime(ny, nm, 1).strftime("%Y-%m-%d")
-
-        conn = get_connection()
-        row = conn.execute(
-            f"""SELECT COALESCE(SUM(amount), 0) AS total
-               FROM mercury_transactions
-               WHERE amount > 0
-                 AND COALESCE(posted_date, created_at) >= ?
-                 AND COALESCE(posted_date, created_at) < ?
-                 AND status NOT IN ('cancelled', 'failed')
-                 AND kind NOT IN ('creditCardTransaction', 'cardInternationalTransactionFee')
-                 {EXCLUDE_INTERNAL}""",
-            (start, end),
-        ).fetchone()
-        conn.close()
-        results.append({"month": month_label, "collected": row["total"] or 0})
+def get_collected_history(start: str, end: str, granularity: str = "month"):
+    """Return collected totals and run-rate ARR per period for months start..end (YYYY-MM, inclusive).
 
-    results.reverse()  # oldest first
-    return results
+    granularity is "month", "quarter" or "year". One grouped query over
+    monthly_facts answers the whole range; periods without inflows are
+    reported as 0. Periods cut off by start/end cover only the months in
+    range, and arr annualizes whatever months a period covers. arr_change
+    and arr_change_pct compare each period with the one before it (None
+    for the first).
+    """
+    periods = period_months(start, end, granularity)
+    if not periods:
+        return []
+
+    with connection() as conn:
+        rows = conn.execute(
+            f"""SELECT {PERIOD_EXPRESSIONS[granularity]} AS period, SUM(inflows) AS collected
+                FROM monthly_facts
+                WHERE month >= ? AND month <= ?
+                GROUP BY period""",
+            (start, end),
+        ).fetchall()
+    collected = {r["period"]: r["collected"] for r in rows}
+
+    result = []
+    prev_arr = None
+    for period, months in periods.items():
+        total = collected.get(period) or 0
+        arr = total * 12 / len(months)
+        change = arr - prev_arr if prev_arr is not None else None
+        result.append({
+            "period": period,
+            "start_month": months[0],
+            "end_month": months[-1],
+            "collected": total,
+            "arr": arr,
+            "arr_change": change,
+            "arr_change_pct": round(change / prev_arr * 100, 1) if change is not None and prev_arr else None,
+        })
+        prev_arr = arr
+    return result
 
 
 def get_last_month_collected():
-    """Return total collected last month across Mercury inflows and Stripe payments."""
+    """Return total collected last month via Mercury inflows (includes Stripe payouts)."""
     now = datetime.now(timezone.utc)
-    # First day of current month
-    first_of_this_month = now.replace(day=1).strftime("%Y-%m-%d")
-    # First day of last month
     if now.month == 1:
-        first_of_last_month = now.replace(year=now.year - 1, month=12, day=1).strftime("%Y-%m-%d")
+        last_month = f"{now.year - 1}-12"
     else:
-        first_of_last_month = now.replace(month=now.month - 1, day=1).strftime("%Y-%m-%d")
+        last_month = f"{now.year}-{now.month - 1:02d}"
 
-    conn = get_connection()
-    mercury_row = conn.execute(
-        f"""SELECT COALESCE(SUM(amount), 0) AS total
-           FROM mercury_transactions
-           WHERE amount > 0
-             AND COALESCE(posted_date, created_at) >= ?
-             AND COALESCE(posted_date, created_at) < ?
-             AND status NOT IN ('cancelled', 'failed')
-             AND kind NOT IN ('creditCardTransaction', 'cardInternationalTransactionFee')
-             {EXCLUDE_INTERNAL}""",
-        (first_of_last_month, first_of_this_month),
-    ).fetchone()
-    conn.close()
-    return mercury_row["total"] or 0
+    with connection() as conn:
+        row = conn.execute(
+            "SELECT inflows FROM monthly_facts WHERE month = ?", (last_month,)
+        ).fetchone()
+    return row["inflows"] if row else 0
 
 
 def get_mtd_report(start_date: str, end_date: str):
     """Get a comprehensive month-to-date financial report."""
-    conn = get_connection()
-
-    # Mercury inflows / outflows
-    mercury = conn.execute(
-        f"""SELECT
-               SUM(CASE WHEN amount > 0
-                        AND kind NOT IN ('creditCardTransaction', 'cardInternationalTransactionFee')
-                        {EXCLUDE_INTERNAL} THEN amount ELSE 0 END) AS inflows,
-               SUM(CASE WHEN amount < 0 {EXCLUDE_INTERNAL} THEN ABS(amount) ELSE 0 END) AS outflows
-           FROM mercury_transactions
-           WHERE COALESCE(posted_date, created_at) BETWEEN ? AND ?
-             AND status NOT IN ('cancelled', 'failed')""",
-        (start_date, end_date),
-    ).fetchone()
-
-    # Invoices sent this period
-    invoices_sent = conn.execute(
-        """SELECT COUNT(*) AS cnt, SUM(amount_due) AS total
-           FROM stripe_invoices
-           WHERE created_at BETWEEN ? AND ?
-             AND amount_due > 0""",
-        (start_date, end_date),
-    ).fetchone()
+    with connection() as conn:
+        # Mercury inflows / outflows, from the daily ledger
+        mercury = _ledger_totals(conn, start_date, end_date)
 
-    # Invoices paid this period
-    invoices_paid = conn.execute(
-        """SELECT COUNT(*) AS cnt, SUM(amount_paid) AS total
-           FROM stripe_invoices
-           WHERE paid_at BETWEEN ? AND ?
-             AND amount_paid > 0""",
-        (start_date, end_date),
-    ).fetchone()
+        # Invoices sent this period
+        invoices_sent = conn.execute(
+            """SELECT COUNT(*) AS cnt, SUM(amount_due) AS total
+               FROM stripe_invoices
+               WHERE created_at BETWEEN ? AND ?
+                 AND amount_due > 0""",
+            (start_date, end_date),
+        ).fetchone()
 
-    # Overdue invoices (as of end_date)
-    overdue = conn.execute(
-        """SELECT COUNT(*) AS cnt, SUM(amount_due) AS total
-           FROM stripe_invoices
-           WHERE status = 'open'
-             AND due_date < ?
-             AND amount_due > 0""",
-        (end_date,),
-    ).fetchone()
+        # Invoices paid this period
+        invoices_paid = conn.execute(
+            """SELECT COUNT(*) AS cnt, SUM(amount_paid) AS total
+               FROM stripe_invoices
+               WHERE paid_at BETWEEN ? AND ?
+                 AND amount_paid > 0""",
+            (start_date, end_date),
+        ).fetchone()
 
-    # Largest single payment received this period
-    largest_payment = conn.execute(
-        """SELECT customer_name, amount_paid, paid_at, number
-           FROM stripe_invoices
-           WHERE paid_at BETWEEN ? AND ?
-             AND amount_paid > 0
-           ORDER BY amount_paid DESC
-           LIMIT 1""",
-        (start_date, end_date),
-    ).fetchone()
+        # Overdue invoices (as of end_date)
+        overdue = conn.execute(
+            """SELECT COUNT(*) AS cnt, SUM(amount_due) AS total
+               FROM stripe_invoices
+               WHERE status = 'open'
+                 AND due_date < ?
+                 AND amount_due > 0""",
+            (end_date,),
+        ).fetchone()
 
-    # Top customers by revenue this period
-    top_customers = conn.execute(
-        """SELECT customer_name, SUM(amount_paid) AS total_paid
-           FROM stripe_invoices
-           WHERE paid_at BETWEEN ? AND ?
-             AND amount_paid > 0
-           GROUP BY customer_name
-           ORDER BY total_paid DESC
-           LIMIT 5""",
-        (start_date, end_date),
-    ).fetchall()
+        # Largest single payment received this period
+        largest_payment = conn.execute(
+            f"""SELECT {CUSTOMER_NAME} AS customer_name, si.amount_paid, si.paid_at, si.number
+               FROM stripe_invoices si
+               {CUSTOMER_JOIN}
+               WHERE si.paid_at BETWEEN ? AND ?
+                 AND si.amount_paid > 0
+               ORDER BY si.amount_paid DESC
+               LIMIT 1""",
+            (start_date, end_date),
+        ).fetchone()
 
-    # Top spending categories this period
-    spend_rows = conn.execute(
-        f"""SELECT counterparty_name, kind, SUM(ABS(amount)) AS total
-           FROM mercury_transactions
-           WHERE amount < 0
-             AND COALESCE(posted_date, created_at) BETWEEN ? AND ?
-             AND status NOT IN ('cancelled', 'failed')
-             {EXCLUDE_INTERNAL}
-           GROUP BY counterparty_name, kind
-           ORDER BY total DESC""",
-        (start_date, end_date),
-    ).fetchall()
+        # Top customers by revenue this period
+        top_customers = conn.execute(
+            f"""SELECT MAX({CUSTOMER_NAME}) AS customer_name, SUM(si.amount_paid) AS total_paid
+               FROM stripe_invoices si
+               {CUSTOMER_JOIN}
+               WHERE si.paid_at BETWEEN ? AND ?
+                 AND si.amount_paid > 0
+               GROUP BY si.customer_id
+               ORDER BY total_paid DESC
+               LIMIT 5""",
+            (start_date, end_date),
+        ).fetchall()
 
-    # Previous month for comparison
-    from dateutil.relativedelta import relativedelta
-    start_dt = datetime.strptime(start_date, "%Y-%m-%d").replace(tzinfo=timezone.utc)
-    prev_start = (start_dt - relativedelta(months=1)).strftime("%Y-%m-%d")
-    prev_end = (start_dt - relativedelta(days=1)).strftime("%Y-%m-%d")
+        # Top spending categories this period
+        spend_rows = _ledger_category_totals(conn, start_date, end_date)
 
-    prev_mercury = conn.execute(
-        f"""SELECT
-               SUM(CASE WHEN amount > 0
-                        AND kind NOT IN ('creditCardTransaction', 'cardInternationalTransactionFee')
-                        {EXCLUDE_INTERNAL} THEN amount ELSE 0 END) AS inflows,
-               SUM(CASE WHEN amount < 0 {EXCLUDE_INTERNAL} THEN ABS(amount) ELSE 0 END) AS outflows
-           FROM mercury_transactions
-           WHERE COALESCE(posted_date, created_at) BETWEEN ? AND ?
-             AND status NOT IN ('cancelled', 'failed')""",
-        (prev_start, prev_end),
-    ).fetchone()
+        # Previous calendar month for comparison, from the monthly rollups
+        from dateutil.relativedelta import relativedelta
+        start_dt = datetime.strptime(start_date, "%Y-%m-%d").replace(tzinfo=timezone.utc)
+        prev_month = (start_dt - relativedelta(months=1)).strftime("%Y-%m")
 
-    conn.close()
+        prev_mercury = conn.execute(
+            "SELECT inflows, outflows FROM monthly_facts WHERE month = ?",
+            (prev_month,),
+        ).fetchone()
 
     inflows = mercury["inflows"] or 0
     outflows = mercury["outflows"] or 0
 
-    # Aggregate spend by category
-    category_totals = {}
-    for r in spend_rows:
-        cat = categorize_vendor(r["counterparty_name"], r["kind"])
-        category_totals[cat] = category_totals.get(cat, 0) + r["total"]
-    top_categories = sorted(category_totals.items(), key=lambda x: -x[1])[:5]
+    top_categories = spend_rows[:5]
 
     return {
         "inflows": inflows,
@@ -1246,6 +1338,6 @@ def get_mtd_report(start_date: str, end_date: str):
         "largest_payment": dict(largest_payment) if largest_payment and largest_payment["amount_paid"] else None,
         "top_customers": [dict(r) for r in top_customers],
         "top_categories": top_categories,
-        "prev_inflows": prev_mercury["inflows"] or 0,
-        "prev_outflows": prev_mercury["outflows"] or 0,
+        "prev_inflows": prev_mercury["inflows"] if prev_mercury else 0,
+        "prev_outflows": prev_mercury["outflows"] if prev_mercury else 0,
     }
@@ -37,6 +37,17 @@ CREATE TABLE IF NOT EXISTS stripe_subscriptions (
     current_period_end TEXT
 );
 
+-- Current Stripe customer details. Invoices and subscriptions join on
+-- customer_id; their own customer_name/customer_email are what Stripe froze
+-- onto the invoice and only serve as a fallback.
+CREATE TABLE IF NOT EXISTS stripe_customers (
+    id TEXT PRIMARY KEY,
+    name TEXT,
+    email TEXT,
+    created_at TEXT,
+    updated_at TEXT NOT NULL
+);
+
 CREATE TABLE IF NOT EXISTS late_payment_notifications (
     id INTEGER PRIMARY KEY AUTOINCREMENT,
     invoice_id TEXT NOT NULL,
@@ -60,3 +71,105 @@ CREATE TABLE IF NOT EXISTS sync_log (
     status TEXT NOT NULL DEFAULT 'success',
     error_message TEXT
 );
+
+CREATE TABLE IF NOT EXISTS sync_cursors (
+    source TEXT NOT NULL,
+    cursor_key TEXT NOT NULL,
+    cursor_value TEXT,
+    last_full_sync_at TEXT,
+    updated_at TEXT NOT NULL,
+    PRIMARY KEY (source, cursor_key)
+);
+
+-- Resumable backfill checkpoints: one row per (account, date shard)
+CREATE TABLE IF NOT EXISTS backfill_shards (
+    source TEXT NOT NULL,
+    account_id TEXT NOT NULL,
+    start_date TEXT NOT NULL,
+    end_date TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    rows INTEGER NOT NULL DEFAULT 0,
+    high_water TEXT,
+    error TEXT,
+    updated_at TEXT NOT NULL,
+    PRIMARY KEY (source, account_id, start_date, end_date)
+);
+
+CREATE TABLE IF NOT EXISTS app_state (
+    key TEXT PRIMARY KEY,
+    value TEXT,
+    updated_at TEXT NOT NULL
+);
+
+-- Monthly rollups maintained by models/facts.py
+CREATE TABLE IF NOT EXISTS monthly_facts (
+    month TEXT PRIMARY KEY,
+    transactions INTEGER NOT NULL DEFAULT 0,
+    inflows REAL NOT NULL DEFAULT 0,
+    outflows REAL NOT NULL DEFAULT 0,
+    owner_distributions REAL NOT NULL DEFAULT 0,
+    stripe_invoiced REAL NOT NULL DEFAULT 0,
+    invoiced REAL NOT NULL DEFAULT 0,
+    updated_at TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS monthly_spend_facts (
+    month TEXT NOT NULL,
+    category TEXT NOT NULL,
+    total REAL NOT NULL DEFAULT 0,
+    PRIMARY KEY (month, category)
+);
+
+-- Per-day Mercury totals with running (prefix) sums, maintained by
+-- models.facts alongside monthly_facts: the total over any date range is
+-- the difference of two cum_* rows.
+CREATE TABLE IF NOT EXISTS daily_ledger (
+    day TEXT PRIMARY KEY,
+    inflows REAL NOT NULL DEFAULT 0,
+    outflows REAL NOT NULL DEFAULT 0,
+    owner_distributions REAL NOT NULL DEFAULT 0,
+    cum_inflows REAL NOT NULL DEFAULT 0,
+    cum_outflows REAL NOT NULL DEFAULT 0,
+    cum_owner_distributions REAL NOT NULL DEFAULT 0
+);
+
+-- Outflows per day and spend category ('' when unclassified), with a running
+-- total per category
+CREATE TABLE IF NOT EXISTS daily_ledger_categories (
+    category TEXT NOT NULL,
+    day TEXT NOT NULL,
+    spend REAL NOT NULL DEFAULT 0,
+    cum_spend REAL NOT NULL DEFAULT 0,
+    PRIMARY KEY (category, day)
+);
+
+CREATE TABLE IF NOT EXISTS monthly_facts_dirty (
+    month TEXT PRIMARY KEY
+);
+
+-- Mercury counterparty -> Stripe customer (NULL for direct payers), see models/counterparties.py
+CREATE TABLE IF NOT EXISTS counterparty_customers (
+    counterparty_name TEXT PRIMARY KEY,
+    stripe_customer_name TEXT,
+    updated_at TEXT NOT NULL
+);
+
+-- Sync runs started through scheduler/coordinator.py
+CREATE TABLE IF NOT EXISTS sync_jobs (
+    id TEXT PRIMARY KEY,
+    trigger TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'running',
+    requested_at TEXT NOT NULL,
+    finished_at TEXT,
+    result TEXT,
+    error TEXT
+);
+
+-- Cross-process single-flight lock: at most one unexpired row per name
+CREATE TABLE IF NOT EXISTS sync_locks (
+    name TEXT PRIMARY KEY,
+    job_id TEXT NOT NULL,
+    owner TEXT NOT NULL,
+    acquired_at TEXT NOT NULL,
+    expires_at TEXT NOT NULL
+);
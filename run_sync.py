@@ -18,7 +18,25 @@ logging.basicConfig(
     format="%(asctime)s [%(levelname)s] %(name)s: %(message)s",
 )
 
-from scheduler.jobs import sync_all_data
+from models.database import init_db
+from models.queries import get_sync_job
+from scheduler.coordinator import run_sync
 
 if __name__ == "__main__":
-    sync_all_data()
+    init_db()
+    job_id, started = run_sync("cli")
+    if not started:
+        print(f"A sync is already running (job {job_id}); skipping.")
+        sys.exit(0)
+    job = get_sync_job(job_id)
+    result = job["result"] or {"sources": {}}
+    for name, r in result["sources"].items():
+        detail = f"{r['records']} records in {r['duration_ms']} ms" if r["status"] == "success" else r["error"]
+        if r.get("throughput"):
+            t = r["throughput"]
+            detail += f", {t['rows_per_sec']} rows/s, {t['pages_per_sec']} pages/s"
+        print(f"{name}: {r['status']} ({detail})")
+    if "duration_ms" in result:
+        print(f"Total: {result['duration_ms']} ms")
+    print(f"Job {job_id}: {job['status']}")
+    sys.exit(0 if job["status"] in ("success", "partial") else 1)
@@ -0,0 +1,86 @@
+import logging
+import os
+import socket
+import threading
+import uuid
+
+from config import Config
+from models.queries import claim_sync_lock, release_sync_lock, update_sync_job
+from scheduler.jobs import sync_all_data
+
+logger = logging.getLogger(__name__)
+
+# Single-flight coordination for data syncs. Every trigger (boot, scheduler,
+# Refresh button, run_sync.py) claims the same lock in SQLite, so at most one
+# sync runs at a time across threads and processes; a trigger that finds a
+# sync already running is coalesced into it and gets that job's id.
+
+# The lock outlives the slowest allowed sync, so a crashed holder frees it.
+LOCK_LEASE_SECONDS = Config.SYNC_TIMEOUT_SECONDS + 60
+
+
+def _owner():
+    return f"{socket.gethostname()}:{os.getpid()}:{threading.get_ident()}"
+
+
+def _job_status(result):
+    statuses = {r["status"] for r in result["sources"].values()}
+    if statuses == {"success"}:
+        return "success"
+    return "partial" if result["synced"] else "error"
+
+
+def _execute(job_id: str):
+    progress = {"sources": {}}
+
+    def on_progress(name, source_result):
+        progress["sources"][name] = source_result
+        update_sync_job(job_id, result=progress)
+
+    try:
+        result = sync_all_data(on_progress=on_progress)
+        update_sync_job(job_id, status=_job_status(result), result=result)
+    except Exception as e:
+        logger.error(f"Sync job {job_id} failed: {e}")
+        update_sync_job(job_id, status="error", error=str(e))
+    finally:
+        release_sync_lock(job_id)
+
+
+def _claim(trigger: str):
+    job_id = uuid.uuid4().hex
+    active = claim_sync_lock(job_id, trigger, _owner(), LOCK_LEASE_SECONDS)
+    if active:
+        logger.info(f"Sync ({trigger}) coalesced into running job {active}")
+        return active, False
+    logger.info(f"Sync job {job_id} started ({trigger})")
+    return job_id, True
+
+
+def start_sync(trigger: str):
+    """Start a sync in a background thread unless one is already running.
+
+    Returns (job_id, started): the new job, or the running job this
+    trigger was coalesced into.
+    """
+    job_id, started = _claim(trigger)
+    if started:
+        threading.Thread(target=_execute, args=(job_id,), name=f"sync-{job_id[:8]}", daemon=True).start()
+    return job_id, started
+
+
+def run_sync(trigger: str):
+    """Run a sync on the calling thread unless one is already running.
+
+    Returns (job_id, started) like start_sync; when started, the job has
+    finished by the time this returns.
+    """
+    job_id, started = _claim(trigger)
+    if started:
+        _execute(job_id)
+    return job_id, started
+
+
+def scheduled_sync():
+    """Scheduler entry point: a no-op while another sync holds the lock."""
+    run_sync("scheduler")
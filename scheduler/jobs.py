@@ -1,35 +1,128 @@
 import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
 from datetime import datetime, timedelta, timezone
 
-from services.stripe_service import sync_invoices, sync_subscriptions, get_balance as get_stripe_balance
-from services.mercury_service import sync_transactions, get_total_balance as get_mercury_balance
+from config import Config
+
+from services.stripe_service import sync_invoices, sync_subscriptions, sync_customers
+from services.mercury_service import sync_transactions
+from services.balance_service import get_balances
+from services.pipeline import take_metrics
 from services.slack_service import post_message
-from models.queries import get_late_invoices, get_all_late_invoices, mark_notified, get_period_summary, get_mtd_report
+from models.analytics import refresh_snapshot
+from models.queries import get_late_invoices, get_all_late_invoices, mark_notified, get_period_summary, get_mtd_report, bump_data_generation, update_monthly_facts
 from slack_bot.messages import late_payment_alert, overdue_invoice_report, mtd_report, weekly_summary
 
 logger = logging.getLogger(__name__)
 
 
-def sync_all_data():
-    """Sync Mercury transactions and Stripe invoices."""
-    logger.info("Running scheduled data sync...")
-    try:
-        mc = sync_transactions()
-        logger.info(f"Mercury: {mc} transactions synced")
-    except Exception as e:
-        logger.error(f"Mercury sync error: {e}")
+# Independent sync sources: (name, sync function, log label). They hit
+# separate APIs and write separate tables, so sync_all_data runs them in parallel.
+# Stripe customers sync here too (incrementally, from customer events), so
+# they share the coordinator's lock with every other writer.
+SYNC_SOURCES = [
+    ("mercury", sync_transactions, "transactions"),
+    ("stripe_invoices", sync_invoices, "invoices"),
+    ("stripe_subscriptions", sync_subscriptions, "active subscriptions"),
+    ("stripe_customers", sync_customers, "customers"),
+]
 
-    try:
-        sc = sync_invoices()
-        logger.info(f"Stripe: {sc} invoices synced")
-    except Exception as e:
-        logger.error(f"Stripe sync error: {e}")
 
+# Sources whose sync thread is still running, including stragglers that
+# outlived an earlier sync's timeout. A source in here is not started again
+# until its thread finishes, so one table never has two writers.
+_running = set()
+_running_lock = threading.Lock()
+
+
+def _run_source(name, fn):
     try:
-        ss = sync_subscriptions()
-        logger.info(f"Stripe: {ss} active subscriptions synced")
-    except Exception as e:
-        logger.error(f"Stripe subscription sync error: {e}")
+        started = time.monotonic()
+        take_metrics(name)  # drop any stale run
+        records = fn()
+        return records, int((time.monotonic() - started) * 1000), take_metrics(name)
+    finally:
+        with _running_lock:
+            _running.discard(name)
+
+
+def sync_all_data(on_progress=None):
+    """Sync Mercury transactions and Stripe invoices/subscriptions/customers concurrently.
+
+    Each source runs on its own thread with SYNC_TIMEOUT_SECONDS to finish; a
+    failure or timeout in one source does not affect the others. A timed-out
+    source keeps running in the background (threads cannot be cancelled);
+    until it finishes, later syncs skip that source (status "skipped")
+    rather than start a second writer, and its rows are picked up by the
+    first fact refresh after it finishes.
+
+    on_progress, if given, is called with (source name, source result) as
+    each source finishes. Returns {"sources": {name: {status, records,
+    duration_ms, error, throughput}}, "synced": bool, "duration_ms": int},
+    where throughput is the source's SyncPipeline metrics (rows/sec,
+    pages/sec, ...) or None when it wrote nothing through a pipeline.
+    """
+    logger.info("Running scheduled data sync...")
+    started = time.monotonic()
+    deadline = started + Config.SYNC_TIMEOUT_SECONDS
+    results = {}
+
+    with _running_lock:
+        busy = {name for name, _, _ in SYNC_SOURCES if name in _running}
+        sources = [source for source in SYNC_SOURCES if source[0] not in busy]
+        _running.update(name for name, _, _ in sources)
+    for name in sorted(busy):
+        results[name] = {
+            "status": "skipped", "records": 0, "duration_ms": None,
+            "error": "previous sync of this source still running",
+        }
+        logger.warning(f"{name} sync skipped: previous run still in progress")
+        if on_progress:
+            on_progress(name, results[name])
+
+    pool = ThreadPoolExecutor(max_workers=max(len(sources), 1), thread_name_prefix="sync")
+    try:
+        futures = {name: pool.submit(_run_source, name, fn) for name, fn, _ in sources}
+        for name, _, label in sources:
+            try:
+                records, duration_ms, throughput = futures[name].result(timeout=max(0, deadline - time.monotonic()))
+                results[name] = {
+                    "status": "success", "records": records, "duration_ms": duration_ms, "error": None,
+                    "throughput": throughput,
+                }
+                logger.info(f"{name}: {records} {label} synced in {duration_ms} ms")
+            except FutureTimeout:
+                results[name] = {
+                    "status": "timeout", "records": 0, "duration_ms": None,
+                    "error": f"timed out after {Config.SYNC_TIMEOUT_SECONDS}s",
+                }
+                logger.error(f"{name} sync timed out after {Config.SYNC_TIMEOUT_SECONDS}s")
+            except Exception as e:
+                results[name] = {"status": "error", "records": 0, "duration_ms": None, "error": str(e)}
+                logger.error(f"{name} sync error: {e}")
+            if on_progress:
+                on_progress(name, results[name])
+    finally:
+        pool.shutdown(wait=False)
+
+    # Roll changed months into the fact tables, then invalidate cached charts
+    synced = any(r["status"] == "success" for r in results.values())
+    if synced:
+        months = update_monthly_facts()
+        logger.info(f"Monthly facts: {months} month(s) re-aggregated")
+        generation = bump_data_generation()
+        logger.info(f"Data generation advanced to {generation}")
+        try:
+            # Build it now so the first chart request after a sync doesn't pay for it
+            refresh_snapshot()
+        except Exception as e:
+            logger.error(f"Analytics snapshot refresh error: {e}")
+
+    duration_ms = int((time.monotonic() - started) * 1000)
+    logger.info(f"Data sync finished in {duration_ms} ms")
+    return {"sources": results, "synced": synced, "duration_ms": duration_ms}
 
 
 def check_late_payments():
@@ -79,12 +172,11 @@ def post_mtd_report():
 
     report = get_mtd_report(start_date, end_date)
 
-    # Fetch live balances
-    stripe_bal = get_stripe_balance()
-    mercury_bal = get_mercury_balance()
-    report["stripe_balance"] = stripe_bal["available"]
-    report["stripe_pending"] = stripe_bal["pending"]
-    report["mercury_balance"] = mercury_bal
+    # Live balances from the shared cache
+    balances = get_balances()
+    report["stripe_balance"] = balances["stripe_available"]
+    report["stripe_pending"] = balances["stripe_pending"]
+    report["mercury_balance"] = balances["mercury"]
 
     blocks = mtd_report(report, month_label, start_date, end_date)
     text = f"{month_label} report: ${report['inflows']:,.2f} in / ${report['outflows']:,.2f} out / net ${report['net']:,.2f}"
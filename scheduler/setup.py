@@ -6,7 +6,9 @@ from apscheduler.triggers.cron import CronTrigger
 from apscheduler.triggers.interval import IntervalTrigger
 
 from config import Config
-from scheduler.jobs import sync_all_data, check_late_payments, post_weekly_summary, post_mtd_report, post_overdue_report
+from services.balance_service import scheduled_refresh
+from scheduler.coordinator import scheduled_sync
+from scheduler.jobs import check_late_payments, post_weekly_summary, post_mtd_report, post_overdue_report
 
 logger = logging.getLogger(__name__)
 
@@ -15,9 +17,10 @@ def create_scheduler() -> BackgroundScheduler:
     scheduler = BackgroundScheduler()
 
     # Data sync — every 30 minutes so charts stay current throughout the day.
-    # next_run_time=now() fires immediately on startup instead of waiting 30 min.
+    # next_run_time=now() fires immediately on startup instead of waiting 30 min;
+    # this is the boot sync. The coordinator skips a run while another holds the lock.
     scheduler.add_job(
-        sync_all_data,
+        scheduled_sync,
         trigger=IntervalTrigger(minutes=30),
         id="sync_all_data",
         name="Sync Mercury + Stripe data",
@@ -25,6 +28,16 @@ def create_scheduler() -> BackgroundScheduler:
         next_run_time=datetime.now(timezone.utc),
     )
 
+    # Live balances — keep the dashboard's cached Mercury/Stripe balances warm
+    scheduler.add_job(
+        scheduled_refresh,
+        trigger=IntervalTrigger(seconds=Config.BALANCE_TTL_SECONDS),
+        id="refresh_balances",
+        name="Refresh live Mercury + Stripe balances",
+        replace_existing=True,
+        next_run_time=datetime.now(timezone.utc),
+    )
+
     # Late payment check — daily at configured hour
     scheduler.add_job(
         check_late_payments,
@@ -0,0 +1,112 @@
+import logging
+import threading
+from datetime import datetime, timezone
+
+from config import Config
+from services.http_client import CircuitOpenError
+from services.mercury_service import fetch_total_balance
+from services.stripe_service import fetch_balance
+
+logger = logging.getLogger(__name__)
+
+# Last known live balances, one entry per source: {source: (value, fetched_at)}.
+# A failed fetch keeps the previous value so the dashboard shows the last good
+# balance (with its as_of) instead of dropping to $0.
+_balances = {}
+_lock = threading.Lock()
+# Held by the one refresh in flight; a plain Lock may be released by the thread that ran it
+_refresh_lock = threading.Lock()
+_cold_fetched = False
+
+_FETCHERS = {
+    "mercury": fetch_total_balance,
+    "stripe": fetch_balance,
+}
+
+
+def refresh_balances():
+    """Fetch live balances from Mercury and Stripe into the cache."""
+    for source, fetch in _FETCHERS.items():
+        try:
+            value = fetch()
+        except CircuitOpenError as e:
+            logger.warning(f"Serving cached {source} balance: {e}")
+            continue
+        except Exception as e:
+            logger.error(f"Failed to refresh {source} balance: {e}")
+            continue
+        with _lock:
+            _balances[source] = (value, datetime.now(timezone.utc))
+
+
+def _refresh_in_background():
+    if not _refresh_lock.acquire(blocking=False):
+        return  # a refresh is already in flight
+
+    def run():
+        try:
+            refresh_balances()
+        finally:
+            _refresh_lock.release()
+
+    threading.Thread(target=run, name="balance-refresh", daemon=True).start()
+
+
+def scheduled_refresh():
+    """Scheduler entry point: refresh on this thread unless a refresh is already in flight.
+
+    Takes the same lock as the request-path refreshes, so the boot run and
+    the first request's cold fetch share one round of API calls: a cold
+    request arriving meanwhile waits for this run instead of repeating it.
+    """
+    global _cold_fetched
+    if not _refresh_lock.acquire(blocking=False):
+        return
+    try:
+        refresh_balances()
+    finally:
+        _cold_fetched = True
+        _refresh_lock.release()
+
+
+def _cold_fetch():
+    """Fetch once on a cold cache; concurrent callers wait for that fetch instead of repeating it."""
+    global _cold_fetched
+    with _refresh_lock:
+        if not _cold_fetched:
+            _cold_fetched = True
+            refresh_balances()
+
+
+def get_balances() -> dict:
+    """Return cached balances, refreshing stale entries in the background.
+
+    Only the first request on a cold cache blocks on the APIs, and requests
+    arriving meanwhile wait for that one fetch. If it fails, later requests
+    get zeros with as_of None while background refreshes retry. Missing
+    entries, or entries older than BALANCE_TTL_SECONDS, are served as-is while
+    a background refresh runs (stale-while-revalidate). as_of is the fetch
+    time of the oldest balance.
+    """
+    with _lock:
+        snapshot = dict(_balances)
+    if not snapshot and not _cold_fetched:
+        _cold_fetch()
+        with _lock:
+            snapshot = dict(_balances)
+
+    now = datetime.now(timezone.utc)
+    fetched = [at for _, at in snapshot.values()]
+    if len(snapshot) < len(_FETCHERS) or (
+        fetched and (now - min(fetched)).total_seconds() > Config.BALANCE_TTL_SECONDS
+    ):
+        _refresh_in_background()
+
+    mercury = snapshot.get("mercury", (0, None))[0]
+    stripe_bal = snapshot.get("stripe", ({"available": 0, "pending": 0, "total": 0}, None))[0]
+    return {
+        "mercury": mercury,
+        "stripe_available": stripe_bal["available"],
+        "stripe_pending": stripe_bal["pending"],
+        "as_of": min(fetched).isoformat() if fetched else None,
+    }
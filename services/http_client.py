@@ -0,0 +1,246 @@
+import logging
+import random
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+# Responses worth retrying: rate limiting and transient upstream failures
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+# Only these are retried; a repeated POST could apply twice
+IDEMPOTENT_METHODS = {"GET", "HEAD", "OPTIONS", "PUT", "DELETE"}
+
+# Upper bounds (ms) of the latency histogram buckets; slower calls land in +Inf
+LATENCY_BUCKETS_MS = (50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+
+class CircuitOpenError(requests.RequestException):
+    """Raised instead of calling a host whose circuit breaker is open."""
+
+
+class CircuitBreaker:
+    """Per-host breaker: fail fast after repeated failures, then probe for recovery.
+
+    Closed: calls pass; HTTP_BREAKER_FAILURES consecutive failures open it.
+    Open: calls raise CircuitOpenError for HTTP_BREAKER_RESET_SECONDS.
+    Half-open: a single trial call passes; its success closes the breaker
+    and its failure re-opens it for another reset period.
+    """
+
+    def __init__(self, host: str, failures: int = None, reset_seconds: float = None):
+        self.host = host
+        self.max_failures = failures or Config.HTTP_BREAKER_FAILURES
+        self.reset_seconds = reset_seconds or Config.HTTP_BREAKER_RESET_SECONDS
+        self.failures = 0
+        self.opened_at = None
+        self._trial = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_seconds:
+            return "half_open"
+        return "open"
+
+    def allow(self):
+        """Raise CircuitOpenError unless a call to the host may go ahead."""
+        with self._lock:
+            state = self.state
+            if state == "closed":
+                return
+            if state == "half_open" and not self._trial:
+                self._trial = True
+                return
+        raise CircuitOpenError(f"Circuit open for {self.host}; failing fast")
+
+    def record_success(self):
+        with self._lock:
+            if self.opened_at is not None:
+                logger.info(f"Circuit for {self.host} closed")
+            self.failures = 0
+            self.opened_at = None
+            self._trial = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self._trial or (self.opened_at is None and self.failures >= self.max_failures):
+                logger.warning(f"Circuit for {self.host} opened after {self.failures} failures")
+                self.opened_at = time.monotonic()
+            self._trial = False
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {"state": self.state, "failures": self.failures}
+
+
+class LatencyHistogram:
+    """Cumulative request latency counts per LATENCY_BUCKETS_MS bucket."""
+
+    def __init__(self):
+        self.counts = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+        self.total_ms = 0.0
+        self.errors = 0
+        self._lock = threading.Lock()
+
+    def observe(self, ms: float, error: bool = False):
+        index = next((i for i, bound in enumerate(LATENCY_BUCKETS_MS) if ms <= bound), len(LATENCY_BUCKETS_MS))
+        with self._lock:
+            self.counts[index] += 1
+            self.total_ms += ms
+            self.errors += error
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            counts, total_ms, errors = list(self.counts), self.total_ms, self.errors
+        count = sum(counts)
+        labels = [f"le_{bound}" for bound in LATENCY_BUCKETS_MS] + ["inf"]
+        return {
+            "count": count,
+            "errors": errors,
+            "mean_ms": round(total_ms / count, 1) if count else None,
+            "buckets": dict(zip(labels, counts)),
+        }
+
+
+_breakers = {}
+_histograms = {}
+_registry_lock = threading.Lock()
+
+
+def breaker_for(host: str) -> CircuitBreaker:
+    """Return the process-wide circuit breaker for host."""
+    with _registry_lock:
+        if host not in _breakers:
+            _breakers[host] = CircuitBreaker(host)
+        return _breakers[host]
+
+
+def _histogram(endpoint: str) -> LatencyHistogram:
+    with _registry_lock:
+        if endpoint not in _histograms:
+            _histograms[endpoint] = LatencyHistogram()
+        return _histograms[endpoint]
+
+
+def metrics() -> dict:
+    """Breaker state per host and latency histogram per endpoint."""
+    with _registry_lock:
+        breakers, histograms = dict(_breakers), dict(_histograms)
+    return {
+        "breakers": {host: b.snapshot() for host, b in sorted(breakers.items())},
+        "endpoints": {name: h.snapshot() for name, h in sorted(histograms.items())},
+    }
+
+
+@contextmanager
+def guarded(host: str, endpoint: str):
+    """Run a non-HTTP-client call (e.g. an SDK request) under host's breaker and endpoint's histogram.
+
+    Any exception from the block counts as a failure of the host.
+    """
+    breaker = breaker_for(host)
+    breaker.allow()
+    started = time.monotonic()
+    try:
+        yield
+    except Exception:
+        breaker.record_failure()
+        _histogram(endpoint).observe((time.monotonic() - started) * 1000, error=True)
+        raise
+    breaker.record_success()
+    _histogram(endpoint).observe((time.monotonic() - started) * 1000)
+
+
+def _backoff(attempt: int) -> float:
+    """Full-jitter exponential backoff: uniform over [0, base * 2^attempt], capped."""
+    return random.uniform(0, min(Config.HTTP_BACKOFF_MAX_SECONDS, Config.HTTP_BACKOFF_BASE_SECONDS * 2 ** attempt))
+
+
+def _retry_after(resp) -> float | None:
+    """Seconds requested by a Retry-After header (delta-seconds or HTTP date), capped."""
+    value = resp.headers.get("Retry-After")
+    if not value:
+        return None
+    try:
+        seconds = float(value)
+    except ValueError:
+        try:
+            seconds = (parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds()
+        except (TypeError, ValueError):
+            return None
+    return min(max(seconds, 0), Config.HTTP_BACKOFF_MAX_SECONDS)
+
+
+class HttpClient:
+    """Pooled HTTP client for one API host with retries, a circuit breaker and latency metrics.
+
+    A single keep-alive requests.Session serves every thread. Idempotent
+    requests that hit a connection error, a timeout or a RETRY_STATUSES
+    response are retried up to HTTP_MAX_RETRIES times with jittered
+    exponential backoff; a 429/503 Retry-After header sets the wait instead.
+    Any requests exception and 5xx responses count against the host's
+    CircuitBreaker, and while it is open requests raise CircuitOpenError
+    immediately rather than tying up the caller for a timeout. The final
+    response is returned as-is; callers still raise_for_status().
+    """
+
+    def __init__(self, base_url: str, headers: dict = None, pool_size: int = 10, retries: int = None):
+        self.base_url = base_url
+        self.host = urlsplit(base_url).netloc
+        self.retries = Config.HTTP_MAX_RETRIES if retries is None else retries
+        self.breaker = breaker_for(self.host)
+        self.session = requests.Session()
+        self.session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=pool_size))
+        self.session.headers.update(headers or {})
+
+    def request(self, method: str, path: str, endpoint: str = None, **kwargs):
+        """Send a request to base_url + path.
+
+        endpoint names the route for the latency histogram (defaults to
+        path); pass a template such as "/account/{id}/transactions" so ids
+        do not split the metrics.
+        """
+        histogram = _histogram(f"{method} {self.host}{endpoint or path}")
+        kwargs.setdefault("timeout", (Config.HTTP_CONNECT_TIMEOUT, Config.HTTP_READ_TIMEOUT))
+        retries = self.retries if method in IDEMPOTENT_METHODS else 0
+
+        for attempt in range(retries + 1):
+            self.breaker.allow()
+            started = time.monotonic()
+            try:
+                resp = self.session.request(method, f"{self.base_url}{path}", **kwargs)
+            except requests.RequestException as e:
+                # Any failed call (e.g. ChunkedEncodingError) settles a half-open trial
+                histogram.observe((time.monotonic() - started) * 1000, error=True)
+                self.breaker.record_failure()
+                if attempt == retries or not isinstance(e, (requests.ConnectionError, requests.Timeout)):
+                    raise
+                wait, reason = _backoff(attempt), type(e).__name__
+            else:
+                histogram.observe((time.monotonic() - started) * 1000, error=resp.status_code >= 500)
+                if resp.status_code >= 500:
+                    self.breaker.record_failure()
+                else:
+                    self.breaker.record_success()
+                if resp.status_code not in RETRY_STATUSES or attempt == retries:
+                    return resp
+                wait, reason = _retry_after(resp) or _backoff(attempt), f"HTTP {resp.status_code}"
+            logger.warning(
+                f"{method} {self.host}{path}: {reason}; retry {attempt + 1}/{retries} in {wait:.1f}s"
+            )
+            time.sleep(wait)
+
+    def get(self, path: str, endpoint: str = None, params: dict = None):
+        return self.request("GET", path, endpoint=endpoint, params=params)
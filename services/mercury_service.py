@@ -1,115 +1,466 @@
+import hashlib
+import hmac
 import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import date, datetime, timedelta, timezone
 
-import requests
+from dateutil.relativedelta import relativedelta
 
 from config import Config
-from models.queries import upsert_mercury_transaction, log_sync
+from services.http_client import HttpClient
+from services.pipeline import SyncPipeline
+from models.queries import (
+    upsert_mercury_transaction,
+    upsert_mercury_transactions,
+    get_mercury_transaction,
+    log_sync,
+    get_sync_cursor,
+    set_sync_cursor,
+    get_backfill_shards,
+    set_backfill_shard,
+    clear_backfill_shards,
+)
 
 logger = logging.getLogger(__name__)
 
 BASE_URL = "https://backend.mercury.com/api/v1"
 
+# Earliest date requested on a full history pull
+HISTORY_START = "2020-01-01"
+HISTORY_END = "2030-12-31"
 
-def _headers():
-    return {
-        "Authorization": f"Bearer {Config.MERCURY_API_TOKEN}",
-        "Content-Type": "application/json",
-    }
 
+class MercuryClient:
+    """Mercury REST client over the shared HttpClient.
+
+    One keep-alive connection pool is shared by every call (including the
+    per-account fetch threads in sync_transactions), so TCP/TLS connections
+    are reused instead of re-handshaking on each page. Transient failures are
+    retried with backoff, and while the Mercury circuit breaker is open calls
+    raise CircuitOpenError at once.
+    """
+
+    def __init__(self, token: str = None, base_url: str = BASE_URL, pool_size: int = None):
+        self.http = HttpClient(
+            base_url,
+            headers={
+                "Authorization": f"Bearer {token or Config.MERCURY_API_TOKEN}",
+                "Content-Type": "application/json",
+            },
+            pool_size=pool_size or Config.MERCURY_MAX_WORKERS,
+        )
+
+    def _get(self, path: str, endpoint: str = None, params: dict = None):
+        return self.http.get(path, endpoint=endpoint, params=params)
 
-def _get_accounts():
-    """Fetch all Mercury accounts."""
-    resp = requests.get(f"{BASE_URL}/accounts", headers=_headers(), timeout=30)
-    resp.raise_for_status()
-    return resp.json().get("accounts", [])
+    def accounts(self):
+        """Fetch all Mercury accounts."""
+        resp = self._get("/accounts")
+        resp.raise_for_status()
+        return resp.json().get("accounts", [])
 
+    def credit_accounts(self):
+        """Fetch Mercury credit card accounts via /credit endpoint."""
+        resp = self._get("/credit")
+        if resp.status_code == 404:
+            return []
+        resp.raise_for_status()
+        return resp.json().get("accounts", [])
 
-def _get_transactions(account_id: str):
-    """Fetch all transactions for a Mercury account, handling pagination."""
-    transactions = []
-    offset = 0
-    limit = 500
+    def transaction_pages(self, account_id: str, start: str = HISTORY_START, end: str = HISTORY_END,
+                          limit: int = 500):
+        """Yield an account's transactions dated start..end, one API page at a time."""
+        offset = 0
+        while True:
+            resp = self._get(
+                f"/account/{account_id}/transactions",
+                endpoint="/account/{id}/transactions",
+                params={"offset": offset, "limit": limit, "start": start, "end": end},
+            )
+            resp.raise_for_status()
+            batch = resp.json().get("transactions", [])
+            yield batch
 
-    while True:
-        resp = requests.get(
-            f"{BASE_URL}/account/{account_id}/transactions",
-            headers=_headers(),
-            params={"offset": offset, "limit": limit, "start": "2020-01-01", "end": "2030-12-31"},
-            timeout=30,
+            if len(batch) < limit:
+                break
+            offset += limit
+
+    def transaction(self, account_id: str, transaction_id: str):
+        """Fetch a single transaction."""
+        resp = self._get(
+            f"/account/{account_id}/transaction/{transaction_id}",
+            endpoint="/account/{id}/transaction/{id}",
         )
         resp.raise_for_status()
-        data = resp.json()
-        batch = data.get("transactions", [])
-        transactions.extend(batch)
+        return resp.json()
+
 
-        if len(batch) < limit:
-            break
-        offset += limit
+_client = None
+_client_lock = threading.Lock()
 
-    return transactions
 
+def get_client() -> MercuryClient:
+    """Return the process-wide Mercury client, creating it on first use."""
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = MercuryClient()
+        return _client
 
-def _get_credit_accounts():
-    """Fetch Mercury credit card accounts via /credit endpoint."""
-    resp = requests.get(f"{BASE_URL}/credit", headers=_headers(), timeout=30)
-    if resp.status_code == 404:
-        return []
-    resp.raise_for_status()
-    return resp.json().get("accounts", [])
+
+def fetch_total_balance() -> float:
+    """Fetch the total balance across all Mercury accounts, raising on API errors."""
+    accounts = get_client().accounts()
+    return sum(a.get("currentBalance", 0) for a in accounts)
 
 
 def get_total_balance() -> float:
     """Fetch the total balance across all Mercury accounts."""
     try:
-        accounts = _get_accounts()
-        total = sum(a.get("currentBalance", 0) for a in accounts)
-        return total
+        return fetch_total_balance()
     except Exception as e:
         logger.error(f"Failed to fetch Mercury balance: {e}")
         return 0
 
 
-def sync_transactions():
-    """Fetch all Mercury transactions across all accounts (including credit card) and cache in SQLite."""
+def _sync_window_start(account_id: str, full: bool):
+    """Return (start_date, is_full, high_water) for an account's next transaction fetch.
+
+    Falls back to a full history pull when forced, when the account has no
+    cursor yet, or when the last full reconcile is older than
+    MERCURY_FULL_SYNC_HOURS. Otherwise starts MERCURY_RECHECK_DAYS before the
+    stored high-water mark so late postings and status changes are re-read.
+    """
+    cursor = get_sync_cursor("mercury", account_id)
+    high_water = cursor["cursor_value"] if cursor else None
+    if full or not high_water or not cursor["last_full_sync_at"]:
+        return HISTORY_START, True, high_water
+
+    now = datetime.now(timezone.utc)
+    last_full = datetime.fromisoformat(cursor["last_full_sync_at"])
+    if now - last_full >= timedelta(hours=Config.MERCURY_FULL_SYNC_HOURS):
+        return HISTORY_START, True, high_water
+
+    start = datetime.strptime(high_water[:10], "%Y-%m-%d") - timedelta(days=Config.MERCURY_RECHECK_DAYS)
+    return max(start.strftime("%Y-%m-%d"), HISTORY_START), False, high_water
+
+
+def _transaction_row(txn: dict, account_id: str):
+    counterparty = txn.get("counterpartyName", "")
+    if not counterparty and txn.get("counterpartyNickname"):
+        counterparty = txn["counterpartyNickname"]
+    return {
+        "id": txn["id"],
+        "amount": txn["amount"],
+        "counterparty_name": counterparty,
+        "note": txn.get("note"),
+        "kind": txn.get("kind"),
+        "status": txn.get("status"),
+        "created_at": txn.get("createdAt"),
+        "posted_date": txn.get("postedDate"),
+        "account_id": account_id,
+    }
+
+
+def _high_water(transactions, high_water=None):
+    """Latest posted/created timestamp among transactions, starting from high_water."""
+    for txn in transactions:
+        seen = txn.get("postedDate") or txn.get("createdAt")
+        if seen and (high_water is None or seen > high_water):
+            high_water = seen
+    return high_water
+
+
+def _finish_account(account_id: str, result: dict):
+    """Advance an account's cursor once all its rows are written (runs on the pipeline writer)."""
+    if result["high_water"]:
+        set_sync_cursor("mercury", account_id, result["high_water"], full_sync=result["is_full"])
+    log_sync(f"mercury:{account_id}", result["rows"], duration_ms=result["fetch_ms"])
+    logger.info(
+        f"Mercury account {account_id}: {result['rows']} transactions since {result['start']}"
+        f"{' (full reconcile)' if result['is_full'] else ''} in {result['fetch_ms']} ms"
+    )
+
+
+def _stream_account(client: MercuryClient, account_id: str, full: bool, pipeline: SyncPipeline):
+    """Stream one account's sync window into the pipeline. Runs on a fetch thread."""
+    started = time.monotonic()
+    start, is_full, high_water = _sync_window_start(account_id, full)
+
+    rows = 0
+    for page, transactions in enumerate(client.transaction_pages(account_id, start=start), 1):
+        high_water = _high_water(transactions, high_water)
+        pipeline.put(upsert_mercury_transactions, [_transaction_row(txn, account_id) for txn in transactions])
+        rows += len(transactions)
+        logger.debug(f"Mercury account {account_id}: page {page}, {rows} transactions")
+
+    result = {
+        "start": start,
+        "is_full": is_full,
+        "high_water": high_water,
+        "rows": rows,
+        "fetch_ms": int((time.monotonic() - started) * 1000),
+    }
+    pipeline.call(_finish_account, account_id, result)
+    return result
+
+
+def sync_transactions(full: bool = False):
+    """Fetch Mercury transactions across all accounts (including credit card) and cache in SQLite.
+
+    Accounts are fetched concurrently (up to MERCURY_MAX_WORKERS), and every
+    page streams through a SyncPipeline to a single writer thread, so writes
+    overlap with the remaining fetches and memory stays flat however long
+    the history. Each account is fetched incrementally from its stored
+    cursor (see _sync_window_start); pass full=True to force a complete
+    history pull. A failing account is logged and skipped, and the sync
+    raises once the remaining accounts are stored.
+    """
     logger.info("Syncing Mercury transactions...")
+    started = time.monotonic()
     count = 0
+    failed = []
     try:
+        client = get_client()
         # Gather all account IDs: checking/savings + credit card
-        account_ids = []
-        accounts = _get_accounts()
-        for account in accounts:
-            account_ids.append(account["id"])
-
-        credit_accounts = _get_credit_accounts()
-        for ca in credit_accounts:
-            account_ids.append(ca["id"])
-
-        for account_id in account_ids:
-            transactions = _get_transactions(account_id)
-
-            for txn in transactions:
-                counterparty = txn.get("counterpartyName", "")
-                if not counterparty and txn.get("counterpartyNickname"):
-                    counterparty = txn["counterpartyNickname"]
-
-                upsert_mercury_transaction({
-                    "id": txn["id"],
-                    "amount": txn["amount"],
-                    "counterparty_name": counterparty,
-                    "note": txn.get("note"),
-                    "kind": txn.get("kind"),
-                    "status": txn.get("status"),
-                    "created_at": txn.get("createdAt"),
-                    "posted_date": txn.get("postedDate"),
-                    "account_id": account_id,
-                })
-                count += 1
-
-        log_sync("mercury", count)
-        logger.info(f"Synced {count} Mercury transactions")
+        account_ids = [a["id"] for a in client.accounts()]
+        account_ids += [ca["id"] for ca in client.credit_accounts()]
+
+        workers = max(1, min(Config.MERCURY_MAX_WORKERS, len(account_ids)))
+        with SyncPipeline("mercury") as pipeline:
+            with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="mercury") as pool:
+                futures = {
+                    pool.submit(_stream_account, client, account_id, full, pipeline): account_id
+                    for account_id in account_ids
+                }
+                for future in as_completed(futures):
+                    account_id = futures[future]
+                    try:
+                        future.result()
+                    except Exception as e:
+                        logger.error(f"Mercury account {account_id} failed: {e}")
+                        log_sync(f"mercury:{account_id}", 0, status="error", error_message=str(e))
+                        failed.append(account_id)
+        count = pipeline.written
+
+        if failed:
+            raise RuntimeError(f"{len(failed)} of {len(account_ids)} Mercury accounts failed: {', '.join(failed)}")
+
+        duration_ms = int((time.monotonic() - started) * 1000)
+        log_sync("mercury", count, duration_ms=duration_ms)
+        logger.info(f"Synced {count} Mercury transactions in {duration_ms} ms")
     except Exception as e:
         logger.error(f"Mercury sync failed: {e}")
-        log_sync("mercury", count, status="error", error_message=str(e))
+        log_sync("mercury", count, status="error", error_message=str(e),
+                 duration_ms=int((time.monotonic() - started) * 1000))
         raise
 
     return count
+
+
+# --------------- Backfill ---------------
+
+BACKFILL_SOURCE = "mercury"
+
+
+def date_shards(start: str, end: str, months: int):
+    """Split start..end (inclusive ISO dates) into consecutive shards of months calendar months."""
+    shards = []
+    shard_start = date.fromisoformat(start)
+    last = date.fromisoformat(end)
+    while shard_start <= last:
+        next_start = shard_start.replace(day=1) + relativedelta(months=months)
+        shard_end = min(next_start - timedelta(days=1), last)
+        shards.append((shard_start.isoformat(), shard_end.isoformat()))
+        shard_start = next_start
+    return shards
+
+
+def _finish_shard(account_id: str, start: str, end: str, rows: int, high_water: str):
+    """Checkpoint a shard once all its rows are written (runs on the pipeline writer)."""
+    set_backfill_shard(BACKFILL_SOURCE, account_id, start, end, "done", rows=rows, high_water=high_water)
+    logger.info(f"Mercury backfill {account_id} {start}..{end}: {rows} transactions")
+
+
+def _stream_shard(client: MercuryClient, account_id: str, start: str, end: str, pipeline: SyncPipeline):
+    """Stream one account's date shard into the pipeline. Runs on a fetch thread."""
+    rows = 0
+    high_water = None
+    for transactions in client.transaction_pages(account_id, start=start, end=end):
+        high_water = _high_water(transactions, high_water)
+        pipeline.put(upsert_mercury_transactions, [_transaction_row(txn, account_id) for txn in transactions])
+        rows += len(transactions)
+    pipeline.call(_finish_shard, account_id, start, end, rows, high_water)
+    return rows
+
+
+def _advance_cursors(shards_by_account: dict, covers_history: bool):
+    """Move each fully backfilled account's sync cursor up to the backfilled high-water mark.
+
+    When the backfill spanned the whole history the account also counts as
+    fully reconciled, so the next scheduled sync is incremental.
+    """
+    checkpoints = get_backfill_shards(BACKFILL_SOURCE)
+    for account_id, shards in shards_by_account.items():
+        done = [checkpoints.get((account_id, s, e)) for s, e in shards]
+        if not all(c and c["status"] == "done" for c in done):
+            continue
+        marks = [c["high_water"] for c in done if c["high_water"]]
+        cursor = get_sync_cursor("mercury", account_id)
+        if cursor and cursor["cursor_value"]:
+            marks.append(cursor["cursor_value"])  # never move a cursor backwards
+        high_water = max(marks, default=None)
+        if high_water:
+            set_sync_cursor("mercury", account_id, high_water, full_sync=covers_history)
+
+
+def backfill_transactions(start: str = HISTORY_START, end: str = None, months: int = None,
+                          workers: int = None, restart: bool = False, account_ids=None):
+    """Load Mercury transaction history in parallel date shards, resumably.
+
+    Each account's start..end range (end defaults to today) is split into
+    shards of months calendar months (MERCURY_BACKFILL_SHARD_MONTHS). Up to
+    workers shards (MERCURY_BACKFILL_WORKERS) are fetched at once, each over
+    its own short offset-paginated range, and all pages stream through one
+    SyncPipeline into the bulk upsert. A shard is checkpointed in
+    backfill_shards only after its rows are committed, so an interrupted
+    run resumes with the shards that are not done; restart=True discards
+    the checkpoints first. Failed shards are recorded and the backfill
+    raises once the others are stored.
+
+    Returns {"shards", "skipped", "rows", "duration_ms", "throughput"}.
+    """
+    today = datetime.now(timezone.utc).date().isoformat()
+    end = end or today
+    months = months or Config.MERCURY_BACKFILL_SHARD_MONTHS
+    workers = max(1, workers or Config.MERCURY_BACKFILL_WORKERS)
+    started = time.monotonic()
+
+    if restart:
+        clear_backfill_shards(BACKFILL_SOURCE)
+    client = MercuryClient(pool_size=workers)
+    if account_ids is None:
+        account_ids = [a["id"] for a in client.accounts()]
+        account_ids += [ca["id"] for ca in client.credit_accounts()]
+
+    shards = date_shards(start, end, months)
+    shards_by_account = {account_id: shards for account_id in account_ids}
+    checkpoints = get_backfill_shards(BACKFILL_SOURCE)
+    todo = [
+        (account_id, s, e)
+        for account_id in account_ids
+        for s, e in shards
+        if (checkpoints.get((account_id, s, e)) or {}).get("status") != "done"
+    ]
+    skipped = len(account_ids) * len(shards) - len(todo)
+    logger.info(
+        f"Mercury backfill {start}..{end}: {len(todo)} shards to fetch "
+        f"({skipped} already done) across {len(account_ids)} accounts, {workers} workers"
+    )
+
+    failed = []
+    with SyncPipeline("mercury_backfill") as pipeline:
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="mercury-backfill") as pool:
+            futures = {pool.submit(_stream_shard, client, *shard, pipeline): shard for shard in todo}
+            for future in as_completed(futures):
+                account_id, s, e = futures[future]
+                try:
+                    future.result()
+                except Exception as exc:
+                    logger.error(f"Mercury backfill {account_id} {s}..{e} failed: {exc}")
+                    set_backfill_shard(BACKFILL_SOURCE, account_id, s, e, "error", error=str(exc))
+                    failed.append(futures[future])
+
+    _advance_cursors(shards_by_account, covers_history=start <= HISTORY_START and end >= today)
+    duration_ms = int((time.monotonic() - started) * 1000)
+    status = "error" if failed else "success"
+    error = f"{len(failed)} of {len(todo)} shards failed" if failed else None
+    log_sync("mercury_backfill", pipeline.written, status=status, error_message=error, duration_ms=duration_ms)
+    if failed:
+        raise RuntimeError(f"Mercury backfill: {error}; rerun to retry them")
+
+    return {
+        "shards": len(todo),
+        "skipped": skipped,
+        "rows": pipeline.written,
+        "duration_ms": duration_ms,
+        "throughput": pipeline.metrics(),
+    }
+
+
+# --------------- Webhooks ---------------
+
+# Seconds a signed delivery stays valid (guards against replayed requests)
+WEBHOOK_TOLERANCE_SECONDS = 300
+
+
+def verify_webhook_signature(payload: bytes, signature: str, secret: str = None,
+                             tolerance: int = WEBHOOK_TOLERANCE_SECONDS):
+    """Check a Mercury-Signature header (t=<timestamp>,v1=<hex HMAC-SHA256>).
+
+    The HMAC covers "<timestamp>.<raw body>" keyed with the webhook secret.
+    Raises ValueError when the header is malformed, stale or does not match.
+    """
+    secret = secret or Config.MERCURY_WEBHOOK_SECRET
+    parts = {}
+    for item in (signature or "").split(","):
+        key, _, value = item.strip().partition("=")
+        parts.setdefault(key, []).append(value)
+    try:
+        timestamp = int(parts["t"][0])
+    except (KeyError, ValueError):
+        raise ValueError("Mercury-Signature header missing timestamp")
+    if abs(time.time() - timestamp) > tolerance:
+        raise ValueError("Mercury-Signature timestamp outside tolerance")
+
+    expected = hmac.new(secret.encode(), f"{timestamp}.".encode() + payload, hashlib.sha256).hexdigest()
+    if not any(hmac.compare_digest(expected, v) for v in parts.get("v1", [])):
+        raise ValueError("Mercury-Signature does not match payload")
+
+
+def _api_transaction(row: dict):
+    """Inverse of _transaction_row: a stored row back in Mercury API field names."""
+    return {
+        "id": row["id"],
+        "amount": row["amount"],
+        "counterpartyName": row["counterparty_name"],
+        "note": row["note"],
+        "kind": row["kind"],
+        "status": row["status"],
+        "createdAt": row["created_at"],
+        "postedDate": row["posted_date"],
+    }
+
+
+def handle_webhook_event(event: dict) -> bool:
+    """Apply a verified Mercury webhook event to mercury_transactions.
+
+    Transaction events carry a JSON merge patch of the changed fields. A
+    status change is applied on top of the stored row; a new transaction is
+    taken from the patch, or fetched from the API when the patch is partial.
+    The upsert marks only that transaction's month dirty for the fact
+    refresh. Returns True when a transaction was written, False for other
+    resource types.
+    """
+    if event.get("resourceType") != "transaction":
+        return False
+
+    txn_id = event["resourceId"]
+    patch = event.get("mergePatch") or {}
+    stored = get_mercury_transaction(txn_id)
+    account_id = patch.get("accountId") or (stored or {}).get("account_id")
+
+    if stored:
+        txn = {**_api_transaction(stored), **patch}
+    elif "amount" in patch:
+        txn = {"id": txn_id, **patch}
+    elif account_id:
+        txn = get_client().transaction(account_id, txn_id)
+    else:
+        raise ValueError(f"Mercury transaction {txn_id} is unknown and the event has no account id")
+
+    upsert_mercury_transaction(_transaction_row(txn, account_id))
+    set_sync_cursor("mercury_webhook", "last_event", event.get("id") or txn_id)
+    return True
@@ -0,0 +1,161 @@
+import logging
+import queue
+import threading
+import time
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+# Longest a partial batch waits for more rows before it is written
+FLUSH_SECONDS = 0.5
+
+# Throughput of the most recent run of each named pipeline: {name: metrics}
+_last_metrics = {}
+_metrics_lock = threading.Lock()
+
+
+def take_metrics(name: str):
+    """Return and clear the metrics of the last finished run of pipeline name, or None."""
+    with _metrics_lock:
+        return _last_metrics.pop(name, None)
+
+
+class SyncPipeline:
+    """Stream API pages to a single writer thread through a bounded queue.
+
+    Producers (page generators, possibly on several threads) put() each page
+    of rows together with the function that writes them. The writer thread
+    drains the queue in order, coalescing consecutive pages for the same
+    writer into batches of about DB_BATCH_SIZE rows per transaction (a
+    partial batch is written after FLUSH_SECONDS without new rows). The
+    queue holds at most SYNC_QUEUE_PAGES pages, so a producer that outruns
+    the disk blocks instead of buffering the whole history, and network
+    waits overlap with writes.
+
+    Use as a context manager: leaving the block flushes and joins the writer,
+    records the run's metrics and re-raises a write error. After a write
+    error the writer keeps draining (discarding) so producers never block,
+    and further put() calls raise it.
+    """
+
+    def __init__(self, name: str, max_pages: int = None, batch_size: int = None):
+        self.name = name
+        self.batch_size = batch_size or Config.DB_BATCH_SIZE
+        self.error = None
+        self.pages = 0
+        self.rows = 0
+        self.written = 0
+        self.max_depth = 0
+        self._queue = queue.Queue(maxsize=max_pages or Config.SYNC_QUEUE_PAGES)
+        self._lock = threading.Lock()
+        self._pending_write = None
+        self._pending = []
+        self._started = None
+        self._seconds = None
+        self._thread = threading.Thread(target=self._drain, name=f"{name}-writer", daemon=True)
+
+    def __enter__(self):
+        self._started = time.monotonic()
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._queue.put(_STOP)
+        self._thread.join()
+        self._seconds = time.monotonic() - self._started
+        metrics = self.metrics()
+        with _metrics_lock:
+            _last_metrics[self.name] = metrics
+        logger.info(
+            f"{self.name} pipeline: {metrics['rows']} rows / {metrics['pages']} pages in "
+            f"{metrics['seconds']}s ({metrics['rows_per_sec']} rows/s, {metrics['pages_per_sec']} pages/s, "
+            f"peak queue {metrics['max_queue_depth']})"
+        )
+        if self.error and exc_type is None:
+            raise self.error
+        return False
+
+    def put(self, write, rows):
+        """Queue one page of rows for write(rows); blocks while the queue is full."""
+        if self.error:
+            raise self.error
+        self._queue.put(("rows", write, rows))
+        with self._lock:
+            self.pages += 1
+            self.rows += len(rows)
+            self.max_depth = max(self.max_depth, self._queue.qsize())
+
+    def call(self, fn, *args):
+        """Run fn(*args) on the writer thread once everything queued before it is written.
+
+        Used for bookkeeping that must follow the data, such as advancing a
+        sync cursor. Skipped after a write error.
+        """
+        if self.error:
+            raise self.error
+        self._queue.put(("call", fn, args))
+
+    def metrics(self) -> dict:
+        seconds = self._seconds if self._seconds is not None else time.monotonic() - (self._started or time.monotonic())
+        with self._lock:
+            pages, rows = self.pages, self.rows
+        return {
+            "pages": pages,
+            "rows": rows,
+            "written": self.written,
+            "seconds": round(seconds, 3),
+            "rows_per_sec": round(rows / seconds, 1) if seconds else None,
+            "pages_per_sec": round(pages / seconds, 2) if seconds else None,
+            "max_queue_depth": self.max_depth,
+        }
+
+    def _flush(self):
+        if self._pending:
+            self.written += self._pending_write(self._pending)
+        self._pending_write = None
+        self._pending = []
+
+    def _drain(self):
+        while True:
+            try:
+                # A partial batch waits at most FLUSH_SECONDS for more rows
+                item = self._queue.get(timeout=FLUSH_SECONDS if self._pending else None)
+            except queue.Empty:
+                self._safe_flush()
+                continue
+            if item is _STOP:
+                break
+            if self.error:
+                continue
+            kind, fn, payload = item
+            try:
+                if kind == "call":
+                    self._flush()
+                    fn(*payload)
+                    continue
+                if fn is not self._pending_write:
+                    self._flush()
+                    self._pending_write = fn
+                self._pending.extend(payload)
+                if len(self._pending) >= self.batch_size:
+                    self._flush()
+            except Exception as e:
+                self._fail(e)
+        self._safe_flush()
+
+    def _safe_flush(self):
+        if self.error:
+            return
+        try:
+            self._flush()
+        except Exception as e:
+            self._fail(e)
+
+    def _fail(self, e):
+        logger.error(f"{self.name} pipeline write failed: {e}")
+        self.error = e
+        self._pending_write = None
+        self._pending = []
@@ -1,14 +1,52 @@
+import json
 import logging
-from datetime import datetime, timezone
+import time
+from datetime import datetime, timedelta, timezone
 
 import stripe
 
 from config import Config
-from models.queries import upsert_stripe_invoice, upsert_stripe_subscription, log_sync
+from services.http_client import guarded
+from services.pipeline import SyncPipeline
+from models.queries import (
+    upsert_stripe_invoice,
+    upsert_stripe_invoices,
+    delete_stripe_invoice,
+    upsert_stripe_subscription,
+    upsert_stripe_subscriptions,
+    upsert_stripe_customer,
+    upsert_stripe_customers,
+    log_sync,
+    get_sync_cursor,
+    set_sync_cursor,
+)
 
 logger = logging.getLogger(__name__)
 
 stripe.api_key = Config.STRIPE_API_KEY
+# The SDK retries connection errors and 409/429/5xx itself with jittered backoff
+stripe.max_network_retries = Config.HTTP_MAX_RETRIES
+STRIPE_HOST = "api.stripe.com"
+
+# Event types applied from webhooks and the Events API (plus invoice.deleted).
+# Anything else, such as invoice.upcoming (a preview with no invoice id), is
+# ignored.
+INVOICE_EVENT_TYPES = [
+    "invoice.created", "invoice.updated", "invoice.finalized", "invoice.sent", "invoice.paid",
+    "invoice.payment_succeeded", "invoice.payment_failed", "invoice.marked_uncollectible",
+    "invoice.voided", "invoice.overdue",
+]
+SUBSCRIPTION_EVENT_TYPES = [
+    "customer.subscription.created", "customer.subscription.updated", "customer.subscription.deleted",
+    "customer.subscription.paused", "customer.subscription.resumed",
+]
+CUSTOMER_EVENT_TYPES = ["customer.created", "customer.updated"]
+
+# Stripe keeps events for 30 days; a cursor not synced within that window
+# forces a full walk. Event.list filters for the incrementally synced resources:
+EVENT_RETENTION_DAYS = 30
+INVOICE_EVENTS = {"types": INVOICE_EVENT_TYPES + ["invoice.deleted"]}
+CUSTOMER_EVENTS = {"types": CUSTOMER_EVENT_TYPES}
 
 
 def _ts_to_datestr(ts):
@@ -24,127 +62,357 @@ def _ts_to_iso(ts):
     return datetime.fromtimestamp(ts, tz=timezone.utc).isoformat()
 
 
-def sync_invoices():
-    """Fetch all Stripe invoices and cache them in SQLite."""
-    logger.info("Syncing Stripe invoices...")
-    count = 0
+def _customer_id(obj):
+    """The customer id of an invoice/subscription, whether or not it was expanded."""
+    if isinstance(obj.customer, str) or obj.customer is None:
+        return obj.customer
+    return obj.customer.id
+
+
+def _customer_row(customer) -> dict:
+    """Map a Stripe customer to a stripe_customers row."""
+    return {
+        "id": customer.id,
+        "name": customer.name,
+        "email": customer.email,
+        "created_at": _ts_to_iso(getattr(customer, "created", None)),
+        "observed_at": int(time.time()),
+    }
+
+
+def _invoice_row(invoice) -> dict:
+    """Map a Stripe invoice to a stripe_invoices row.
+
+    customer_name/customer_email are the values Stripe froze onto the
+    invoice; readers prefer the current ones from stripe_customers.
+    """
+    # Extract paid_at from status_transitions if available
+    paid_at = None
+    if hasattr(invoice, "status_transitions") and invoice.status_transitions:
+        paid_ts = getattr(invoice.status_transitions, "paid_at", None)
+        if paid_ts:
+            paid_at = _ts_to_iso(paid_ts)
+
+    return {
+        "id": invoice.id,
+        "number": invoice.number,
+        "customer_id": _customer_id(invoice),
+        "customer_name": invoice.customer_name or None,
+        "customer_email": invoice.customer_email or None,
+        "amount_due": invoice.amount_due / 100.0,
+        "amount_paid": invoice.amount_paid / 100.0,
+        "currency": invoice.currency,
+        "status": invoice.status,
+        "due_date": _ts_to_datestr(invoice.due_date),
+        "created_at": _ts_to_iso(invoice.created),
+        "paid_at": paid_at,
+        "hosted_invoice_url": invoice.hosted_invoice_url,
+        "observed_at": int(time.time()),
+    }
+
+
+def _subscription_row(sub) -> dict:
+    """Map a Stripe subscription to a stripe_subscriptions row.
+
+    The customer is stored by id only; readers take its name from
+    stripe_customers.
+    """
+    # Calculate monthly amount from subscription items
+    # Note: sub["items"] avoids conflict with dict.items() method
+    monthly_amount = 0
+    for item in sub["items"]["data"]:
+        price = item.price
+        amount = (price.unit_amount or 0) / 100.0
+        quantity = item.quantity or 1
+        interval = "month"
+        interval_count = 1
+        if price.recurring:
+            interval = price.recurring.interval or "month"
+            interval_count = price.recurring.interval_count or 1
+        if interval == "year":
+            monthly_amount += (amount * quantity) / (12 * interval_count)
+        elif interval == "month":
+            monthly_amount += (amount * quantity) / interval_count
+        elif interval == "week":
+            monthly_amount += (amount * quantity * 52) / (12 * interval_count)
+        else:
+            monthly_amount += amount * quantity
+
+    return {
+        "id": sub.id,
+        "customer_id": _customer_id(sub),
+        "customer_name": None,
+        "status": sub.status,
+        "monthly_amount": round(monthly_amount, 2),
+        "currency": sub.currency,
+        "current_period_start": _ts_to_datestr(getattr(sub, "current_period_start", None)),
+        "current_period_end": _ts_to_datestr(getattr(sub, "current_period_end", None)),
+        "observed_at": int(time.time()),
+    }
+
+
+def _full_sync_due(cursor, full: bool) -> bool:
+    """Whether a full list walk should run, given a sync_cursors row.
+
+    Full walks reconcile whatever incremental updates (webhooks or the
+    Events API) might have missed; they run every STRIPE_RECONCILE_HOURS.
+    """
+    if full or not cursor or not cursor["last_full_sync_at"]:
+        return True
+    last_full = datetime.fromisoformat(cursor["last_full_sync_at"])
+    return datetime.now(timezone.utc) - last_full >= timedelta(hours=Config.STRIPE_RECONCILE_HOURS)
+
+
+def _event_cursor(cursor):
+    """Parse a stored event cursor: {"id", "created", "synced_at"}, or None.
+
+    created is the newest applied event's time and synced_at when the
+    events were last listed. Every event after synced_at is still
+    retained as long as that listing is within Stripe's event retention,
+    however old the newest event is; beyond it the cursor cannot be
+    replayed.
+    """
     try:
-        for invoice in stripe.Invoice.list(limit=100, expand=["data.customer"]).auto_paging_iter():
-            customer_name = None
-            customer_email = None
-            # Prefer current customer object data over frozen invoice fields
-            if not isinstance(invoice.customer, str) and invoice.customer:
-                customer_name = getattr(invoice.customer, "name", None) or invoice.customer_name or None
-                customer_email = getattr(invoice.customer, "email", None) or invoice.customer_email or None
+        value = json.loads(cursor["cursor_value"]) if cursor else None
+    except (TypeError, ValueError):
+        return None
+    if not isinstance(value, dict) or "created" not in value:
+        return None
+    if time.time() - value.get("synced_at", value["created"]) > EVENT_RETENTION_DAYS * 86400:
+        return None
+    return value
+
+
+def _latest_event(filters: dict):
+    """Cursor for the newest event matching filters, or a bare timestamp if there are none."""
+    events = stripe.Event.list(**filters, limit=1)
+    if events.data:
+        return {"id": events.data[0].id, "created": events.data[0].created}
+    return {"id": None, "created": int(time.time())}
+
+
+def _events_since(filters: dict, cursor):
+    """Events matching filters after cursor, newest first.
+
+    Pages forward from the cursor event; when Stripe no longer has that
+    event (or there was none), falls back to a created[gte] window from
+    the cursor's timestamp. Events at the boundary may repeat, which is
+    harmless since the records are upserted.
+    """
+    if cursor["id"]:
+        try:
+            events = stripe.Event.list(**filters, ending_before=cursor["id"], limit=100)
+            # ending_before pages toward newer events, yielding oldest first
+            return list(events.auto_paging_iter())[::-1]
+        except stripe.InvalidRequestError as e:
+            logger.warning(f"Stripe event cursor {cursor['id']} unusable ({e}); using created window")
+    events = stripe.Event.list(**filters, created={"gte": cursor["created"]}, limit=100)
+    return list(events.auto_paging_iter())
+
+
+def _stream_list(listing, to_row, write, pipeline: SyncPipeline):
+    """Queue every page of a Stripe list into pipeline as rows for write."""
+    page = listing
+    while True:
+        pipeline.put(write, [to_row(obj) for obj in page.data])
+        if not page.has_more:
+            break
+        page = page.next_page()
+
+
+def _sync_invoices_incremental(cursor, pipeline: SyncPipeline):
+    """Re-fetch only the invoices touched by events since cursor. Returns the new cursor."""
+    events = _events_since(INVOICE_EVENTS, cursor)
+    if not events:
+        return cursor
+
+    # Newest first, so the first event per invoice decides whether it still exists
+    latest = {}
+    for event in events:
+        if getattr(event.data.object, "id", None):
+            latest.setdefault(event.data.object.id, event.type)
+    for invoice_id, event_type in latest.items():
+        if event_type == "invoice.deleted":
+            pipeline.call(delete_stripe_invoice, invoice_id)
+            continue
+        try:
+            pipeline.put(upsert_stripe_invoices, [_invoice_row(stripe.Invoice.retrieve(invoice_id))])
+        except stripe.InvalidRequestError as e:
+            # Deleted drafts can no longer be retrieved
+            logger.warning(f"Skipping Stripe invoice {invoice_id}: {e}")
+    logger.info(f"{len(events)} Stripe invoice events touched {len(latest)} invoices")
+    return {"id": events[0].id, "created": events[0].created}
+
+
+def sync_invoices(full: bool = False):
+    """Fetch changed Stripe invoices and cache them in SQLite.
+
+    Between full walks (see _full_sync_due) only invoices touched by
+    Stripe events since the stored event cursor are re-fetched, so a sync
+    costs in proportion to the changes rather than the invoice history.
+    When webhooks are configured they deliver those changes, and this
+    only runs the periodic full walk. Pass full=True to force one.
+    Customers are not expanded; see sync_customers. Pages stream through
+    a SyncPipeline, so writes overlap with fetching the next page.
+    """
+    synced_at = int(time.time())
+    cursor_row = get_sync_cursor("stripe", "invoices")
+    cursor = _event_cursor(cursor_row)
+    walk = cursor is None or _full_sync_due(cursor_row, full)
+    if not walk and Config.STRIPE_WEBHOOK_SECRET:
+        logger.info("Stripe invoices kept current by webhooks — reconciliation not due")
+        return 0
+
+    logger.info(f"Syncing Stripe invoices ({'full' if walk else 'incremental'})...")
+    pipeline = SyncPipeline("stripe_invoices")
+    try:
+        with pipeline:
+            if walk:
+                # Taken before the walk so events during it are replayed next time
+                cursor = _latest_event(INVOICE_EVENTS)
+                _stream_list(stripe.Invoice.list(limit=100), _invoice_row, upsert_stripe_invoices, pipeline)
             else:
-                if invoice.customer_name:
-                    customer_name = invoice.customer_name
-                if invoice.customer_email:
-                    customer_email = invoice.customer_email
-
-            # Extract paid_at from status_transitions if available
-            paid_at = None
-            if hasattr(invoice, "status_transitions") and invoice.status_transitions:
-                paid_ts = getattr(invoice.status_transitions, "paid_at", None)
-                if paid_ts:
-                    paid_at = _ts_to_iso(paid_ts)
-
-            upsert_stripe_invoice({
-                "id": invoice.id,
-                "number": invoice.number,
-                "customer_id": invoice.customer if isinstance(invoice.customer, str) else getattr(invoice.customer, "id", None),
-                "customer_name": customer_name,
-                "customer_email": customer_email,
-                "amount_due": invoice.amount_due / 100.0,
-                "amount_paid": invoice.amount_paid / 100.0,
-                "currency": invoice.currency,
-                "status": invoice.status,
-                "due_date": _ts_to_datestr(invoice.due_date),
-                "created_at": _ts_to_iso(invoice.created),
-                "paid_at": paid_at,
-                "hosted_invoice_url": invoice.hosted_invoice_url,
-            })
-            count += 1
-
-        log_sync("stripe", count)
-        logger.info(f"Synced {count} Stripe invoices")
+                cursor = _sync_invoices_incremental(cursor, pipeline)
+
+        set_sync_cursor("stripe", "invoices", json.dumps({**cursor, "synced_at": synced_at}), full_sync=walk)
+        log_sync("stripe", pipeline.written)
+        logger.info(f"Synced {pipeline.written} Stripe invoices")
     except Exception as e:
         logger.error(f"Stripe sync failed: {e}")
-        log_sync("stripe", count, status="error", error_message=str(e))
+        log_sync("stripe", pipeline.written, status="error", error_message=str(e))
         raise
 
-    return count
+    return pipeline.written
+
 
+def sync_subscriptions(full: bool = False):
+    """Fetch all active Stripe subscriptions and cache them in SQLite.
+
+    When webhooks are configured this only runs the periodic full walk
+    (see _full_sync_due); pass full=True to force it.
+    """
+    if Config.STRIPE_WEBHOOK_SECRET and not _full_sync_due(get_sync_cursor("stripe", "subscriptions"), full):
+        logger.info("Stripe subscriptions kept current by webhooks — reconciliation not due")
+        return 0
 
-def sync_subscriptions():
-    """Fetch all active Stripe subscriptions and cache them in SQLite."""
     logger.info("Syncing Stripe subscriptions...")
-    count = 0
+    pipeline = SyncPipeline("stripe_subscriptions")
     try:
-        # Expand customer so we get the name without extra API calls
-        for sub in stripe.Subscription.list(
-            status="active", limit=100, expand=["data.customer"]
-        ).auto_paging_iter():
-            # Calculate monthly amount from subscription items
-            # Note: sub["items"] avoids conflict with dict.items() method
-            monthly_amount = 0
-            for item in sub["items"]["data"]:
-                price = item.price
-                amount = (price.unit_amount or 0) / 100.0
-                quantity = item.quantity or 1
-                interval = "month"
-                interval_count = 1
-                if price.recurring:
-                    interval = price.recurring.interval or "month"
-                    interval_count = price.recurring.interval_count or 1
-                if interval == "year":
-                    monthly_amount += (amount * quantity) / (12 * interval_count)
-                elif interval == "month":
-                    monthly_amount += (amount * quantity) / interval_count
-                elif interval == "week":
-                    monthly_amount += (amount * quantity * 52) / (12 * interval_count)
-                else:
-                    monthly_amount += amount * quantity
-
-            # Get customer name from expanded customer object
-            customer_name = "Unknown"
-            customer_id = None
-            if isinstance(sub.customer, str):
-                customer_id = sub.customer
-            else:
-                customer_id = sub.customer.id
-                customer_name = sub.customer.name or sub.customer.email or "Unknown"
-
-            upsert_stripe_subscription({
-                "id": sub.id,
-                "customer_id": customer_id,
-                "customer_name": customer_name,
-                "status": sub.status,
-                "monthly_amount": round(monthly_amount, 2),
-                "currency": sub.currency,
-                "current_period_start": _ts_to_datestr(getattr(sub, "current_period_start", None)),
-                "current_period_end": _ts_to_datestr(getattr(sub, "current_period_end", None)),
-            })
-            count += 1
-
-        log_sync("stripe_subscriptions", count)
-        logger.info(f"Synced {count} active Stripe subscriptions")
+        with pipeline:
+            _stream_list(
+                stripe.Subscription.list(status="active", limit=100),
+                _subscription_row, upsert_stripe_subscriptions, pipeline,
+            )
+
+        set_sync_cursor("stripe", "subscriptions", datetime.now(timezone.utc).isoformat(), full_sync=True)
+        log_sync("stripe_subscriptions", pipeline.written)
+        logger.info(f"Synced {pipeline.written} active Stripe subscriptions")
     except Exception as e:
         logger.error(f"Stripe subscription sync failed: {e}")
-        log_sync("stripe_subscriptions", count, status="error", error_message=str(e))
+        log_sync("stripe_subscriptions", pipeline.written, status="error", error_message=str(e))
+        raise
+
+    return pipeline.written
+
+
+def sync_customers(full: bool = False):
+    """Sync the Stripe customer dimension (names/emails) into stripe_customers.
+
+    Runs on its own schedule, separately from invoices. Like sync_invoices
+    it applies customer.created/updated events since the stored cursor
+    (the event payload is the full customer, so nothing is re-fetched)
+    and lists every customer only on a full walk. With webhooks
+    configured, only the full walk runs. Returns the number of customers
+    written.
+    """
+    synced_at = int(time.time())
+    cursor_row = get_sync_cursor("stripe", "customers")
+    cursor = _event_cursor(cursor_row)
+    walk = cursor is None or _full_sync_due(cursor_row, full)
+    if not walk and Config.STRIPE_WEBHOOK_SECRET:
+        logger.info("Stripe customers kept current by webhooks — reconciliation not due")
+        return 0
+
+    pipeline = SyncPipeline("stripe_customers")
+    try:
+        with pipeline:
+            if walk:
+                cursor = _latest_event(CUSTOMER_EVENTS)
+                _stream_list(stripe.Customer.list(limit=100), _customer_row, upsert_stripe_customers, pipeline)
+            else:
+                events = _events_since(CUSTOMER_EVENTS, cursor)
+                # Newest first, so the first event per customer is its current state
+                latest = {}
+                for event in events:
+                    latest.setdefault(event.data.object.id, event.data.object)
+                pipeline.put(upsert_stripe_customers, [_customer_row(c) for c in latest.values()])
+                if events:
+                    cursor = {"id": events[0].id, "created": events[0].created}
+
+        set_sync_cursor("stripe", "customers", json.dumps({**cursor, "synced_at": synced_at}), full_sync=walk)
+        log_sync("stripe_customers", pipeline.written)
+        logger.info(f"Synced {pipeline.written} Stripe customers ({'full' if walk else 'incremental'})")
+    except Exception as e:
+        logger.error(f"Stripe customer sync failed: {e}")
+        log_sync("stripe_customers", pipeline.written, status="error", error_message=str(e))
         raise
 
-    return count
+    return pipeline.written
+
+
+# --------------- Webhooks ---------------
+
+def construct_webhook_event(payload: bytes, signature: str):
+    """Verify a webhook's Stripe-Signature header and parse the event.
+
+    Raises stripe.SignatureVerificationError (bad or stale signature) or
+    ValueError (malformed payload).
+    """
+    return stripe.Webhook.construct_event(payload, signature, Config.STRIPE_WEBHOOK_SECRET)
+
+
+def handle_webhook_event(event) -> bool:
+    """Apply a verified Stripe event to the local tables.
+
+    Handles the INVOICE_EVENT_TYPES, SUBSCRIPTION_EVENT_TYPES and
+    CUSTOMER_EVENT_TYPES through the same row mapping and upserts as
+    polling, and deletes the invoice on invoice.deleted. Rows are stamped
+    with the event's created time, so a delivery that arrives after newer
+    state was stored changes nothing. Returns True when the event was
+    applied, False for ignored event types.
+    """
+    event_type = event.type
+    obj = event.data.object
+
+    if event_type == "invoice.deleted":
+        delete_stripe_invoice(obj.id)
+    elif event_type in INVOICE_EVENT_TYPES:
+        upsert_stripe_invoice({**_invoice_row(obj), "observed_at": event.created})
+    elif event_type in SUBSCRIPTION_EVENT_TYPES:
+        upsert_stripe_subscription({**_subscription_row(obj), "observed_at": event.created})
+    elif event_type in CUSTOMER_EVENT_TYPES:
+        upsert_stripe_customer({**_customer_row(obj), "observed_at": event.created})
+    else:
+        return False
+
+    set_sync_cursor("stripe_webhook", "last_event", event.id)
+    return True
+
+
+def fetch_balance() -> dict:
+    """Fetch the current Stripe balance, raising on API errors (or CircuitOpenError)."""
+    with guarded(STRIPE_HOST, "GET api.stripe.com/v1/balance"):
+        balance = stripe.Balance.retrieve()
+    # available and pending are lists of {amount, currency} objects
+    available = sum(b.amount for b in balance.available) / 100.0
+    pending = sum(b.amount for b in balance.pending) / 100.0
+    return {"available": available, "pending": pending, "total": available + pending}
 
 
 def get_balance() -> dict:
     """Fetch the current Stripe balance."""
     try:
-        balance = stripe.Balance.retrieve()
-        # available and pending are lists of {amount, currency} objects
-        available = sum(b.amount for b in balance.available) / 100.0
-        pending = sum(b.amount for b in balance.pending) / 100.0
-        return {"available": available, "pending": pending, "total": available + pending}
+        return fetch_balance()
     except Exception as e:
         logger.error(f"Failed to fetch Stripe balance: {e}")
         return {"available": 0, "pending": 0, "total": 0}
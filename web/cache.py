@@ -0,0 +1,66 @@
+"""In-process cache for rendered chart JSON.
+
+Chart data only changes when a sync lands, so each rendered chart is kept
+per (chart name, parameters) and reused until the data generation advances
+(see models.queries.bump_data_generation) or the UTC day rolls over, since
+several charts are relative to the current month.
+"""
+import hashlib
+import threading
+from datetime import datetime, timezone
+
+from flask import Response, request
+
+from models.analytics import snapshot_generation
+from models.queries import get_data_generation
+
+MAX_ENTRIES = 256
+
+_lock = threading.Lock()
+_entries = {}  # {(name, params): (version, etag, last_modified, body)}
+
+
+def _last_modified(updated_at):
+    if not updated_at:
+        return datetime.now(timezone.utc).replace(microsecond=0)
+    return datetime.fromisoformat(updated_at).replace(microsecond=0)
+
+
+def chart_response(name: str, build, **params) -> Response:
+    """Return a conditional JSON response for a chart, building it on a cache miss.
+
+    The ETag is a hash of the rendered body, so a sync that leaves a chart
+    unchanged still answers revalidations with 304 Not Modified.
+    """
+    generation, updated_at = get_data_generation()
+    version = (generation, datetime.now(timezone.utc).date())
+    key = (name, tuple(sorted(params.items())))
+
+    with _lock:
+        entry = _entries.get(key)
+
+    if entry is None or entry[0] != version:
+        body = build(**params)
+        etag = hashlib.sha1(body.encode()).hexdigest()
+        entry = (version, etag, _last_modified(updated_at), body)
+        # Built from an analytics snapshot still being rebuilt for this
+        # generation: serve it, but let the next request build it again
+        if snapshot_generation() in (None, generation):
+            with _lock:
+                _entries.pop(key, None)
+                while len(_entries) >= MAX_ENTRIES:
+                    _entries.pop(next(iter(_entries)))
+                _entries[key] = entry
+
+    _, etag, last_modified, body = entry
+    resp = Response(body, mimetype="application/json")
+    resp.set_etag(etag)
+    resp.last_modified = last_modified
+    resp.cache_control.no_cache = True  # always revalidate; the ETag makes that cheap
+    return resp.make_conditional(request)
+
+
+def clear():
+    """Drop every cached chart."""
+    with _lock:
+        _entries.clear()
@@ -1,19 +1,23 @@
 from datetime import datetime, timezone
-from dateutil.relativedelta import relativedelta
 
 import plotly
 import plotly.graph_objects as go
 
-from models.queries import (
-    get_mercury_monthly_flows,
+from config import Config
+from models.analytics import (
     get_avg_days_to_pay,
     get_overall_avg_days_to_pay,
     get_revenue_by_client,
+    get_monthly_spend_details,
+)
+from models.queries import (
+    PERIOD_EXPRESSIONS,
+    get_period_flows,
+    get_period_spend_by_category,
     get_active_subscriptions_by_client,
     get_open_invoices_by_client,
-    get_monthly_spend_by_category,
-    get_monthly_spend_details,
-    get_monthly_invoiced,
+    get_spend_details,
+    period_months,
     SPEND_CATEGORIES,
 )
 
@@ -25,31 +29,63 @@ RED = "#e74c3c"
 BLUE = "#3498db"
 
 
-def _chart_months():
-    """Return monthly labels from April 2025 through the current month."""
-    start = datetime(2025, 4, 1, tzinfo=timezone.utc)
-    now = datetime.now(timezone.utc)
-    months = []
-    dt = start
-    while dt.strftime("%Y-%m") <= now.strftime("%Y-%m"):
-        months.append(dt.strftime("%Y-%m"))
-        dt += relativedelta(months=1)
-    return months
+GRANULARITY_LABELS = {"month": "Month", "quarter": "Quarter", "year": "Year"}
+# Coarser granularity tried, in order, when a range has too many periods
+_COARSER = {"month": "quarter", "quarter": "year"}
 
+# Trailing windows summarised on the time-series charts: (periods, short label, long label)
+TRAILING_WINDOWS = {
+    "month": [(12, "12-mo", "12-Month"), (6, "6-mo", "6-Month"), (3, "3-mo", "3-Month")],
+    "quarter": [(4, "4-qtr", "4-Quarter"), (2, "2-qtr", "2-Quarter"), (1, "1-qtr", "1-Quarter")],
+    "year": [(3, "3-yr", "3-Year"), (2, "2-yr", "2-Year"), (1, "1-yr", "1-Year")],
+}
 
-def build_in_vs_out_chart() -> str:
+
+def chart_range(start: str = None, end: str = None):
+    """Fill in a time-series chart's default range: CHART_START_MONTH through the current month."""
+    return start or Config.CHART_START_MONTH, end or datetime.now(timezone.utc).strftime("%Y-%m")
+
+
+def chart_periods(start: str = None, end: str = None, granularity: str = "month"):
+    """Resolve a time-series chart's range into (start, end, granularity, period labels).
+
+    Defaults come from chart_range. A range with more than CHART_MAX_POINTS
+    periods is downsampled by coarsening the granularity (month, then
+    quarter, then year): periods are summed, not sampled, so totals stay
+    exact while the payload and build time stay bounded. A range with more
+    than CHART_MAX_POINTS years raises ValueError.
+    """
+    if granularity not in PERIOD_EXPRESSIONS:
+        raise ValueError(f"granularity must be one of {', '.join(PERIOD_EXPRESSIONS)}")
+    start, end = chart_range(start, end)
+
+    while True:
+        periods = list(period_months(start, end, granularity))
+        if len(periods) <= Config.CHART_MAX_POINTS:
+            return start, end, granularity, periods
+        if granularity not in _COARSER:
+            raise ValueError(f"range must not exceed {Config.CHART_MAX_POINTS} years")
+        granularity = _COARSER[granularity]
+
+
+def _period_axis(granularity: str) -> dict:
+    """X-axis settings for a time-series chart at granularity."""
+    title = dict(text=GRANULARITY_LABELS[granularity], font=dict(color=TEXT_COLOR))
+    if granularity == "month":
+        return dict(dtick="M1", tickformat="%b %Y", title=title)
+    return dict(type="category", title=title)
+
+
+def build_in_vs_out_chart(start: str = None, end: str = None, granularity: str = "month") -> str:
     """Build a dark-mode Plotly JSON figure for money in vs money out."""
-    data = get_mercury_monthly_flows()
-    inflows_by_month = {row["month"]: row["inflows"] for row in data}
-    outflows_by_month = {row["month"]: row["outflows"] for row in data}
-    distributions_by_month = {row["month"]: row["owner_distributions"] for row in data}
-    invoiced_by_month = get_monthly_invoiced()
-
-    months = _chart_months()
-    inflows = [inflows_by_month.get(m, 0) for m in months]
-    outflows = [outflows_by_month.get(m, 0) for m in months]
-    distributions = [distributions_by_month.get(m, 0) for m in months]
-    invoiced = [invoiced_by_month.get(m, 0) for m in months]
+    start, end, granularity, months = chart_periods(start, end, granularity)
+    flows = get_period_flows(start, end, granularity)
+    empty = {}
+
+    inflows = [flows.get(m, empty).get("inflows", 0) for m in months]
+    outflows = [flows.get(m, empty).get("outflows", 0) for m in months]
+    distributions = [flows.get(m, empty).get("owner_distributions", 0) for m in months]
+    invoiced = [flows.get(m, empty).get("invoiced", 0) for m in months]
 
     INVOICED_COLOR = "#f39c12"
 
@@ -97,7 +133,7 @@ def build_in_vs_out_chart() -> str:
         marker=dict(size=10, color=BLUE),
     ))
 
-    # Right-side summary: 12-mo, 6-mo, 3-mo totals for each line
+    # Right-side summary: trailing totals (12-mo, 6-mo, 3-mo by month) for each line
     # 4 metrics, slightly compressed spacing to fit all on the right panel
     summary_metrics = [
         {"label": "Total Invoiced",      "values": invoiced,      "color": INVOICED_COLOR},
@@ -105,11 +141,7 @@ def build_in_vs_out_chart() -> str:
         {"label": "Total Expenses",      "values": outflows,      "color": RED},
         {"label": "Owner Distributions", "values": distributions, "color": BLUE},
     ]
-    periods = [
-        {"n": 12, "label": "12-mo"},
-        {"n": 6,  "label": "6-mo"},
-        {"n": 3,  "label": "3-mo"},
-    ]
+    periods = [{"n": n, "label": label} for n, label, _ in TRAILING_WINDOWS[granularity]]
 
     # 4 metrics at 0.24 spacing, period rows at 0.05 intervals
     y_starts = [0.88, 0.64, 0.40, 0.16]
@@ -133,14 +165,12 @@ def build_in_vs_out_chart() -> str:
 
     fig.update_layout(
         title=dict(
-            text="Total Collected vs Total Expenses by Month",
+            text=f"Total Collected vs Total Expenses by {GRANULARITY_LABELS[granularity]}",
             font=dict(size=22, color=TEXT_COLOR),
             x=0.45,
         ),
         xaxis=dict(
-            dtick="M1",
-            tickformat="%b %Y",
-            title=dict(text="Month", font=dict(color=TEXT_COLOR)),
+            **_period_axis(granularity),
             tickfont=dict(color=TEXT_COLOR, size=12),
             gridcolor=GRID_COLOR,
             linecolor=GRID_COLOR,
@@ -174,25 +204,20 @@ def build_in_vs_out_chart() -> str:
     return plotly.io.to_json(fig)
 
 
-def build_profit_margin_chart(use_invoiced: bool = False) -> str:
+def build_profit_margin_chart(use_invoiced: bool = False, start: str = None, end: str = None,
+                              granularity: str = "month") -> str:
     """Build a dark-mode profit margin chart.
 
     When use_invoiced=True, uses Total Invoiced as the revenue figure instead of
     Money In (collected). Margin = (Revenue - Money Out) / Revenue * 100.
     """
-    data = get_mercury_monthly_flows()
-    inflows_by_month = {row["month"]: row["inflows"] for row in data}
-    outflows_by_month = {row["month"]: row["outflows"] for row in data}
-
-    months = _chart_months()
-    inflows = [inflows_by_month.get(m, 0) for m in months]
-    outflows = [outflows_by_month.get(m, 0) for m in months]
+    start, end, granularity, months = chart_periods(start, end, granularity)
+    flows = get_period_flows(start, end, granularity)
+    empty = {}
 
-    if use_invoiced:
-        invoiced_by_month = get_monthly_invoiced()
-        revenue = [invoiced_by_month.get(m, 0) for m in months]
-    else:
-        revenue = inflows
+    outflows = [flows.get(m, empty).get("outflows", 0) for m in months]
+    revenue_key = "invoiced" if use_invoiced else "inflows"
+    revenue = [flows.get(m, empty).get(revenue_key, 0) for m in months]
 
     margins = []
     for r, o in zip(revenue, outflows):
@@ -216,9 +241,10 @@ def build_profit_margin_chart(use_invoiced: bool = False) -> str:
     ))
     # Compute trailing averages
     avg_configs = [
-        {"n": 12, "label": "12-Month", "color": "#f39c12", "x": 0.15},
-        {"n": 6,  "label": "6-Month",  "color": "#9b59b6", "x": 0.50},
-        {"n": 3,  "label": "3-Month",  "color": "#1abc9c", "x": 0.85},
+        {"n": n, "label": label, "color": color, "x": x}
+        for (n, _, label), color, x in zip(
+            TRAILING_WINDOWS[granularity], ["#f39c12", "#9b59b6", "#1abc9c"], [0.15, 0.50, 0.85]
+        )
     ]
     for cfg in avg_configs:
         recent = [m for m in margins[-cfg["n"]:] if m != 0]
@@ -251,7 +277,8 @@ def build_profit_margin_chart(use_invoiced: bool = False) -> str:
                 align="center",
             )
 
-    title_text = "Net Profit Margin by Month (Invoiced)" if use_invoiced else "Net Profit Margin by Month (Cash Collected)"
+    basis = "Invoiced" if use_invoiced else "Cash Collected"
+    title_text = f"Net Profit Margin by {GRANULARITY_LABELS[granularity]} ({basis})"
     fig.update_layout(
         title=dict(
             text=title_text,
@@ -260,9 +287,7 @@ def build_profit_margin_chart(use_invoiced: bool = False) -> str:
             y=0.98,
         ),
         xaxis=dict(
-            dtick="M1",
-            tickformat="%b %Y",
-            title=dict(text="Month", font=dict(color=TEXT_COLOR)),
+            **_period_axis(granularity),
             tickfont=dict(color=TEXT_COLOR, size=12),
             gridcolor=GRID_COLOR,
             linecolor=GRID_COLOR,
@@ -299,10 +324,10 @@ PURPLE = "#9b59b6"
 TEAL = "#1abc9c"
 
 
-def build_days_to_pay_chart() -> str:
-    """Horizontal bar chart showing average days to pay per client."""
-    data = get_avg_days_to_pay()
-    overall = get_overall_avg_days_to_pay()
+def build_days_to_pay_chart(start: str = None, end: str = None) -> str:
+    """Horizontal bar chart showing average days to pay per client (invoices paid in months start..end)."""
+    data = get_avg_days_to_pay(start, end)
+    overall = get_overall_avg_days_to_pay(start, end)
 
     if not data:
         fig = go.Figure()
@@ -396,9 +421,9 @@ def build_days_to_pay_chart() -> str:
     return plotly.io.to_json(fig)
 
 
-def build_revenue_by_client_chart() -> str:
-    """Horizontal bar chart showing total revenue per client (top 15)."""
-    data = get_revenue_by_client()
+def build_revenue_by_client_chart(start: str = None, end: str = None) -> str:
+    """Horizontal bar chart showing total revenue per client (top 15), paid in months start..end."""
+    data = get_revenue_by_client(start, end)
 
     if not data:
         fig = go.Figure()
@@ -700,10 +725,11 @@ CATEGORY_COLORS = {
 }
 
 
-def build_spend_by_category_chart() -> str:
-    """Stacked area chart showing monthly spending by category with vendor detail on hover."""
-    cat_data = get_monthly_spend_by_category()
-    detail_data = get_monthly_spend_details()
+def build_spend_by_category_chart(start: str = None, end: str = None, granularity: str = "month") -> str:
+    """Stacked area chart showing spending by category per period with vendor detail on hover."""
+    start, end, granularity, months = chart_periods(start, end, granularity)
+    cat_data = get_period_spend_by_category(start, end, granularity)
+    detail_data = get_monthly_spend_details(start, end, granularity)
 
     if not cat_data:
         fig = go.Figure()
@@ -715,8 +741,6 @@ def build_spend_by_category_chart() -> str:
         fig.update_layout(paper_bgcolor=BG_COLOR, plot_bgcolor=BG_COLOR)
         return plotly.io.to_json(fig)
 
-    months = _chart_months()
-
     fig = go.Figure()
 
     for category in SPEND_CATEGORIES:
@@ -777,9 +801,7 @@ def build_spend_by_category_chart() -> str:
             x=0.5,
         ),
         xaxis=dict(
-            dtick="M1",
-            tickformat="%b %Y",
-            title=dict(text="Month", font=dict(color=TEXT_COLOR)),
+            **_period_axis(granularity),
             tickfont=dict(color=TEXT_COLOR, size=12),
             gridcolor=GRID_COLOR,
             linecolor=GRID_COLOR,
@@ -815,8 +837,7 @@ def build_spend_by_category_chart() -> str:
 
 def build_spend_detail_chart(month: str, category: str) -> str:
     """Build a horizontal bar chart showing vendor-level spend for one month+category."""
-    detail_data = get_monthly_spend_details()
-    vendors = detail_data.get(month, {}).get(category, [])
+    vendors = get_spend_details(month, category)
 
     fig = go.Figure()
 
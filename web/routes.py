@@ -1,13 +1,16 @@
 import logging
 from datetime import datetime, timezone
 
-from flask import Blueprint, Response, jsonify, render_template, request
+from flask import Blueprint, jsonify, render_template, request
 
-from models.queries import get_open_invoices_for_client, get_all_late_invoices, mark_email_sent, upsert_notify_email, get_invoiced_breakdown, disregard_invoice
+from models.queries import PERIOD_EXPRESSIONS, get_open_invoices_for_client, get_all_late_invoices, mark_email_sent, upsert_notify_email, get_invoiced_breakdown, disregard_invoice, get_sync_job
 from services.email_service import send_reminder_email
-from services.stripe_service import get_fresh_invoice, get_balance as get_stripe_balance
-from services.mercury_service import get_total_balance as get_mercury_balance
-from scheduler.jobs import post_weekly_summary, post_mtd_report, post_overdue_report, sync_all_data
+from services.stripe_service import get_fresh_invoice
+from services.balance_service import get_balances
+from services import http_client
+from scheduler.coordinator import start_sync
+from scheduler.jobs import post_weekly_summary, post_mtd_report, post_overdue_report
+from web.cache import chart_response
 from web.charts import (
     build_in_vs_out_chart,
     build_profit_margin_chart,
@@ -17,12 +20,17 @@ from web.charts import (
     build_expected_revenue_chart,
     build_spend_by_category_chart,
     build_spend_detail_chart,
+    chart_periods,
+    chart_range,
 )
 
 logger = logging.getLogger(__name__)
 
 bp = Blueprint("web", __name__, template_folder="templates", static_folder="static", static_url_path="/assets")
 
+# Longest month range a request may ask for (50 years)
+MAX_RANGE_MONTHS = 600
+
 
 @bp.route("/")
 def dashboard():
@@ -32,14 +40,14 @@ def dashboard():
 @bp.route("/api/balances")
 def api_balances():
     from models.queries import get_last_month_collected, get_last_month_invoiced, get_ytd_collected, get_ytd_outflows, get_ytd_owner_distributions
-    stripe_bal = get_stripe_balance()
-    mercury_bal = get_mercury_balance()
+    balances = get_balances()
     last_month_collected = get_last_month_collected()
     last_month_invoiced = get_last_month_invoiced()
     return jsonify({
-        "mercury": mercury_bal,
-        "stripe_available": stripe_bal["available"],
-        "stripe_pending": stripe_bal["pending"],
+        "mercury": balances["mercury"],
+        "stripe_available": balances["stripe_available"],
+        "stripe_pending": balances["stripe_pending"],
+        "as_of": balances["as_of"],
         "run_rate_arr": last_month_collected * 12,
         "invoiced_arr": last_month_invoiced * 12,
         "last_month_collected": last_month_collected,
@@ -49,47 +57,88 @@ def api_balances():
     })
 
 
+def _month_arg(name: str, default: str = None) -> str:
+    """Read a YYYY-MM query parameter, raising ValueError when malformed."""
+    value = request.args.get(name) or default
+    if value is not None:
+        try:
+            datetime.strptime(value, "%Y-%m")
+        except ValueError:
+            raise ValueError(f"{name} must be YYYY-MM")
+    return value
+
+
+def _check_span(start: str, end: str):
+    """Raise ValueError when start..end (YYYY-MM, inclusive) spans more than MAX_RANGE_MONTHS."""
+    months = (int(end[:4]) - int(start[:4])) * 12 + int(end[5:7]) - int(start[5:7]) + 1
+    if months > MAX_RANGE_MONTHS:
+        raise ValueError(f"range must not exceed {MAX_RANGE_MONTHS} months")
+
+
+def _range_chart(name: str, build, granularity: bool = True, **params):
+    """Serve a chart limited to the start/end (YYYY-MM) query params, and granularity when supported.
+
+    Malformed parameters, and ranges too long to chart, get a 400 instead
+    of a chart.
+    """
+    try:
+        params.update(start=_month_arg("start"), end=_month_arg("end"))
+        if granularity:
+            params["granularity"] = request.args.get("granularity", "month")
+            if params["granularity"] not in PERIOD_EXPRESSIONS:
+                raise ValueError(f"granularity must be one of {', '.join(PERIOD_EXPRESSIONS)}")
+            # Checked before chart_periods walks the range month by month
+            start, end = chart_range(params["start"], params["end"])
+            _check_span(start, end)
+            chart_periods(start, end, params["granularity"])
+        elif params["start"] and params["end"]:
+            _check_span(params["start"], params["end"])
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return chart_response(name, build, **params)
+
+
 @bp.route("/api/charts/in-vs-out")
 def chart_in_vs_out():
-    return Response(build_in_vs_out_chart(), mimetype="application/json")
+    return _range_chart("in-vs-out", build_in_vs_out_chart)
 
 
 @bp.route("/api/charts/profit-margin")
 def chart_profit_margin():
     mode = request.args.get("mode", "collected")
-    return Response(build_profit_margin_chart(use_invoiced=(mode == "invoiced")), mimetype="application/json")
+    return _range_chart("profit-margin", build_profit_margin_chart, use_invoiced=(mode == "invoiced"))
 
 
 @bp.route("/api/charts/days-to-pay")
 def chart_days_to_pay():
-    return Response(build_days_to_pay_chart(), mimetype="application/json")
+    return _range_chart("days-to-pay", build_days_to_pay_chart, granularity=False)
 
 
 @bp.route("/api/charts/revenue-by-client")
 def chart_revenue_by_client():
-    return Response(build_revenue_by_client_chart(), mimetype="application/json")
+    return _range_chart("revenue-by-client", build_revenue_by_client_chart, granularity=False)
 
 
 @bp.route("/api/charts/concentration-risk")
 def chart_concentration_risk():
-    return Response(build_concentration_risk_chart(), mimetype="application/json")
+    return chart_response("concentration-risk", build_concentration_risk_chart)
 
 
 @bp.route("/api/charts/expected-revenue")
 def chart_expected_revenue():
-    return Response(build_expected_revenue_chart(), mimetype="application/json")
+    return chart_response("expected-revenue", build_expected_revenue_chart)
 
 
 @bp.route("/api/charts/spend-by-category")
 def chart_spend_by_category():
-    return Response(build_spend_by_category_chart(), mimetype="application/json")
+    return _range_chart("spend-by-category", build_spend_by_category_chart)
 
 
 @bp.route("/api/charts/spend-detail")
 def chart_spend_detail():
     month = request.args.get("month", "")
     category = request.args.get("category", "")
-    return Response(build_spend_detail_chart(month, category), mimetype="application/json")
+    return chart_response("spend-detail", build_spend_detail_chart, month=month, category=category)
 
 
 @bp.route("/api/invoiced-breakdown")
@@ -103,20 +152,53 @@ def api_invoiced_breakdown():
 
 @bp.route("/api/arr-history")
 def api_arr_history():
-    from models.queries import get_monthly_collected_history
-    rows = get_monthly_collected_history(months=6)
-    months = []
-    for r in rows:
-        arr = r["collected"] * 12
-        months.append({"month": r["month"], "collected": r["collected"], "arr": arr})
+    """Collected and run-rate ARR per period, with period-over-period changes.
+
+    Query params: start/end (YYYY-MM, inclusive; end defaults to the last
+    complete month), months (range length when start is omitted, default
+    6) and granularity (month, quarter or year).
+    """
+    from models.queries import get_collected_history, shift_month
+    granularity = request.args.get("granularity", "month")
+    try:
+        last_month = shift_month(datetime.now(timezone.utc).strftime("%Y-%m"), -1)
+        end = _month_arg("end", last_month)
+        months = request.args.get("months", 6, type=int)
+        if not 1 <= months <= MAX_RANGE_MONTHS:
+            raise ValueError(f"months must be between 1 and {MAX_RANGE_MONTHS}")
+        start = _month_arg("start", shift_month(end, 1 - months))
+        _check_span(start, end)
+        periods = get_collected_history(start, end, granularity)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    changes = [p["arr_change"] for p in periods if p["arr_change"] is not None]
+    pct_changes = [p["arr_change_pct"] for p in periods if p["arr_change_pct"] is not None]
+    return jsonify({
+        "granularity": granularity,
+        "start": start,
+        "end": end,
+        "periods": periods,
+        "avg_change": round(sum(changes) / len(changes), 2) if changes else 0,
+        "avg_change_pct": round(sum(pct_changes) / len(pct_changes), 1) if pct_changes else 0,
+    })
+
 
-    # Calculate month-on-month changes and average
-    changes = []
-    for i in range(1, len(months)):
-        changes.append(months[i]["arr"] - months[i - 1]["arr"])
-    avg_mom_change = round(sum(changes) / len(changes), 2) if changes else 0
+@bp.route("/api/period-summary")
+def api_period_summary():
+    """Mercury inflows, outflows, owner distributions and spend by category for any date range.
 
-    return jsonify({"months": months, "avg_mom_change": avg_mom_change})
+    Query params: start and end (YYYY-MM-DD, inclusive). Answered from the
+    daily ledger's running totals, so long ranges cost the same as short ones.
+    """
+    from models.queries import get_ledger_summary
+    start, end = request.args.get("start", ""), request.args.get("end", "")
+    try:
+        if datetime.strptime(start, "%Y-%m-%d") > datetime.strptime(end, "%Y-%m-%d"):
+            return jsonify({"error": "start must not be after end"}), 400
+    except ValueError:
+        return jsonify({"error": "start and end (YYYY-MM-DD) required"}), 400
+    return jsonify(get_ledger_summary(start, end))
 
 
 @bp.route("/api/margin-detail")
@@ -199,12 +281,27 @@ def api_open_invoices():
 
 @bp.route("/api/sync", methods=["POST"])
 def api_sync():
+    """Start a background sync (or join the one already running) and return its job id."""
     try:
-        sync_all_data()
-        return jsonify({"success": True})
+        job_id, started = start_sync("manual")
     except Exception as e:
-        logger.error(f"Manual sync failed: {e}")
+        logger.error(f"Manual sync failed to start: {e}")
         return jsonify({"error": str(e)}), 500
+    return jsonify({"success": True, "job_id": job_id, "started": started}), 202
+
+
+@bp.route("/api/sync/<job_id>")
+def api_sync_status(job_id):
+    job = get_sync_job(job_id)
+    if not job:
+        return jsonify({"error": "unknown sync job"}), 404
+    return jsonify(job)
+
+
+@bp.route("/api/http-metrics")
+def api_http_metrics():
+    """Circuit breaker state per API host and latency histograms per endpoint."""
+    return jsonify(http_client.metrics())
 
 
 @bp.route("/api/invoices/<invoice_id>/notify-email", methods=["PUT"])
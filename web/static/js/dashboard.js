@@ -31,6 +31,17 @@ async function pushSlackReport() {
     }
 }
 
+// Poll a background sync job until it finishes
+async function waitForSync(jobId) {
+    while (true) {
+        await new Promise((resolve) => setTimeout(resolve, 2000));
+        const resp = await fetch(`/api/sync/${jobId}`);
+        const job = await resp.json();
+        if (!resp.ok) throw new Error(job.error || "Unknown sync job");
+        if (job.status !== "running") return job;
+    }
+}
+
 async function refreshData() {
     const btn = document.getElementById("refresh-data-btn");
     const label = btn.querySelector("span");
@@ -42,7 +53,9 @@ async function refreshData() {
     try {
         const resp = await fetch("/api/sync", { method: "POST" });
         const data = await resp.json();
-        if (data.success) {
+        if (!data.job_id) throw new Error(data.error || "Unknown error");
+        const job = await waitForSync(data.job_id);
+        if (job.status === "success" || job.status === "partial") {
             label.textContent = "Done!";
             btn.style.background = "#27ae60";
             loadAll();
@@ -52,7 +65,7 @@ async function refreshData() {
                 btn.disabled = false;
             }, 3000);
         } else {
-            throw new Error(data.error || "Unknown error");
+            throw new Error(job.error || "Sync failed");
         }
     } catch (err) {
         label.textContent = "Failed";
@@ -312,6 +325,11 @@ async function loadBalances() {
         document.getElementById("kpi-mercury").textContent = fmt(data.mercury);
         const stripeTotal = Number(data.stripe_available) + Number(data.stripe_pending);
         document.getElementById("kpi-stripe").textContent = fmt(stripeTotal);
+        if (data.as_of) {
+            const asOf = "As of " + new Date(data.as_of).toLocaleString();
+            document.getElementById("kpi-mercury").title = asOf;
+            document.getElementById("kpi-stripe").title = asOf;
+        }
         const fmtWhole = (n) => "$" + Math.round(Number(n)).toLocaleString("en-US");
         _arrCollected = data.run_rate_arr;
         _arrInvoiced = data.invoiced_arr;
@@ -956,25 +974,26 @@ async function loadArrHistory() {
     try {
         const resp = await fetch("/api/arr-history");
         const data = await resp.json();
-        const months = data.months;
+        const periods = data.periods;
 
         const fmtWhole = (n) => "$" + Math.round(Number(n)).toLocaleString("en-US");
         const fmtChange = (n) => {
             const sign = n >= 0 ? "+" : "";
             return sign + "$" + Math.round(Math.abs(n)).toLocaleString("en-US");
         };
-        const monthName = (m) => {
-            const [y, mo] = m.split("-");
+        const periodName = (p) => {
+            if (data.granularity !== "month") return p.replace("-", " ");
+            const [y, mo] = p.split("-");
             const d = new Date(Number(y), Number(mo) - 1);
             return d.toLocaleString("default", { month: "short", year: "numeric" });
         };
 
         tbody.innerHTML = "";
-        months.forEach(function (row, i) {
+        periods.forEach(function (row) {
             const tr = document.createElement("tr");
 
             const tdMonth = document.createElement("td");
-            tdMonth.textContent = monthName(row.month);
+            tdMonth.textContent = periodName(row.period);
             tr.appendChild(tdMonth);
 
             const tdCollected = document.createElement("td");
@@ -991,17 +1010,16 @@ async function loadArrHistory() {
             tdChange.className = "text-right";
             const tdPct = document.createElement("td");
             tdPct.className = "text-right";
-            if (i === 0) {
+            if (row.arr_change === null) {
                 tdChange.textContent = "—";
                 tdChange.style.color = "#888";
                 tdPct.textContent = "—";
                 tdPct.style.color = "#888";
             } else {
-                const prevArr = months[i - 1].arr;
-                const change = row.arr - prevArr;
+                const change = row.arr_change;
                 tdChange.textContent = fmtChange(change);
                 tdChange.style.color = change >= 0 ? "#2ecc71" : "#e74c3c";
-                const pct = prevArr !== 0 ? (change / prevArr) * 100 : 0;
+                const pct = row.arr_change_pct || 0;
                 const pctSign = pct >= 0 ? "+" : "";
                 tdPct.textContent = pctSign + pct.toFixed(1) + "%";
                 tdPct.style.color = pct >= 0 ? "#2ecc71" : "#e74c3c";
@@ -1029,17 +1047,12 @@ async function loadArrHistory() {
         tdAvg.className = "text-right";
         tdAvg.style.fontWeight = "600";
         tdAvg.style.padding = "12px 12px";
-        tdAvg.textContent = fmtChange(data.avg_mom_change);
-        tdAvg.style.color = data.avg_mom_change >= 0 ? "#2ecc71" : "#e74c3c";
+        tdAvg.textContent = fmtChange(data.avg_change);
+        tdAvg.style.color = data.avg_change >= 0 ? "#2ecc71" : "#e74c3c";
         footTr.appendChild(tdAvg);
 
         // Average % change
-        var pctChanges = [];
-        for (var j = 1; j < months.length; j++) {
-            var prev = months[j - 1].arr;
-            if (prev !== 0) pctChanges.push(((months[j].arr - prev) / prev) * 100);
-        }
-        var avgPct = pctChanges.length > 0 ? pctChanges.reduce(function (s, v) { return s + v; }, 0) / pctChanges.length : 0;
+        var avgPct = data.avg_change_pct;
         const tdAvgPct = document.createElement("td");
         tdAvgPct.className = "text-right";
         tdAvgPct.style.fontWeight = "600";
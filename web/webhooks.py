@@ -0,0 +1,68 @@
+import json
+import logging
+
+import stripe
+from flask import Blueprint, jsonify, request
+
+from config import Config
+from models.queries import bump_data_generation, update_monthly_facts
+from services import mercury_service, stripe_service
+
+logger = logging.getLogger(__name__)
+
+# Provider webhooks. Requests are authenticated by their signatures, so this
+# blueprint is exempt from dashboard basic auth (see app.require_auth).
+bp = Blueprint("webhooks", __name__, url_prefix="/webhooks")
+
+
+def _apply(source: str, event_id: str, event_type: str, handle):
+    """Run an event handler, then roll the changed months into the fact tables."""
+    try:
+        handled = handle()
+        if handled:
+            months = update_monthly_facts()
+            bump_data_generation()
+    except Exception as e:
+        # A non-2xx makes the provider retry the delivery
+        logger.error(f"{source} webhook {event_id} ({event_type}) failed: {e}")
+        return jsonify({"error": str(e)}), 500
+
+    if handled:
+        logger.info(f"{source} webhook {event_id} ({event_type}) applied, {months} month(s) re-aggregated")
+    else:
+        logger.info(f"{source} webhook {event_id} ({event_type}) ignored")
+    return jsonify({"received": True, "handled": handled})
+
+
+@bp.route("/stripe", methods=["POST"])
+def stripe_webhook():
+    if not Config.STRIPE_WEBHOOK_SECRET:
+        return jsonify({"error": "Stripe webhooks not configured"}), 503
+
+    try:
+        event = stripe_service.construct_webhook_event(request.get_data(), request.headers.get("Stripe-Signature", ""))
+    except (ValueError, stripe.SignatureVerificationError) as e:
+        logger.warning(f"Rejected Stripe webhook: {e}")
+        return jsonify({"error": "invalid signature"}), 400
+
+    return _apply("Stripe", event.id, event.type, lambda: stripe_service.handle_webhook_event(event))
+
+
+@bp.route("/mercury", methods=["POST"])
+def mercury_webhook():
+    if not Config.MERCURY_WEBHOOK_SECRET:
+        return jsonify({"error": "Mercury webhooks not configured"}), 503
+
+    payload = request.get_data()
+    try:
+        mercury_service.verify_webhook_signature(payload, request.headers.get("Mercury-Signature", ""))
+    except ValueError as e:
+        logger.warning(f"Rejected Mercury webhook: {e}")
+        return jsonify({"error": "invalid signature"}), 400
+    try:
+        event = json.loads(payload)
+    except ValueError:
+        return jsonify({"error": "invalid payload"}), 400
+
+    event_type = f"{event.get('resourceType')}.{event.get('operationType')}"
+    return _apply("Mercury", event.get("id"), event_type, lambda: mercury_service.handle_webhook_event(event))